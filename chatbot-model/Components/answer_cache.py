@@ -0,0 +1,54 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+
+class AnswerCache:
+    """
+      LRU cache of query responses with a time to live, so that a question asked again is answered without
+      retrieving documents and running the QA model again.
+
+      The key is chosen by the caller (see QueryPipeline): the normalized question together with the corpus
+      version of every retriever it was answered from, so a response is never served once its corpus changed.
+      An entry expires `ttl` seconds after it was stored, and the least recently used entry is evicted once
+      more than `max_size` responses are cached.
+
+      get: Return a copy of the cached response for a key, or None.
+      put: Store a response under a key.
+      clear: Drop every cached response.
+    """
+
+    def __init__(self, max_size=1024, ttl=600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            created, response = entry
+            if self.ttl is not None and time.monotonic() - created > self.ttl:
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+
+        # callers may modify the response they get
+        return copy.deepcopy(response)
+
+    def put(self, key, response):
+        response = copy.deepcopy(response)
+        with self.lock:
+            self.entries[key] = (time.monotonic(), response)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -1,23 +1,101 @@
 import config
+import logging
 import operator
+import threading
+import numpy as np
+import torch
 from transformers import QuestionAnsweringPipeline
+from Components.inference_scheduler import InferenceScheduler
+from Components.metrics import get_metrics
+from Components.passage_windows import PassageWindows
+from Components.qa_backend import PARITY_SAMPLES, TorchBackend, load_backend
+
+
+logger = logging.getLogger(__name__)
 
 
 class AnswerExtractor:
 
-    # load pretrained model and tokenizer and create pipeline to generate answers
-    def __init__(self, tokenizer, model):
-        tokenizer = tokenizer.from_pretrained(config.MODEL_PATH)
-        model = model.from_pretrained(config.MODEL_PATH)
-        
-        self.nlp = QuestionAnsweringPipeline(model=model, tokenizer=tokenizer)
-
-    # given question and related passages, it returns answers dictionary sorted 
-    # in descending order of scores
-    def extract(self, question, passages):
-        
+    # load pretrained model and tokenizer (from model_path, MODEL_PATH by default) and create pipeline to generate answers
+    # - with verify=False the parity check of the backend is left to a later call of verify()
+    def __init__(self, tokenizer, model, batch_size=None, model_path=None, verify=True):
+        self.model_path = config.MODEL_PATH if model_path is None else model_path
+        self.tokenizer = tokenizer.from_pretrained(self.model_path)
+        self.model = model.from_pretrained(self.model_path)
+        self.model.eval()
+
+        self.nlp = QuestionAnsweringPipeline(model=self.model, tokenizer=self.tokenizer)
+
+        self.batch_size = config.ANSWER_EXTRACTOR['BATCH_SIZE'] if batch_size is None else batch_size
+        self.max_seq_len = config.ANSWER_EXTRACTOR['MAX_SEQ_LEN']
+        self.doc_stride = config.ANSWER_EXTRACTOR['DOC_STRIDE']
+        self.max_answer_len = config.ANSWER_EXTRACTOR['MAX_ANSWER_LEN']
+        self.windows = PassageWindows(self.tokenizer, self.max_seq_len, config.ANSWER_EXTRACTOR['MAX_QUERY_LEN'],
+                                      self.doc_stride, config.ANSWER_EXTRACTOR['WINDOW_CACHE_SIZE'])
+
+        # windows and tokens run through the model for answering questions (not for the parity check)
+        metrics = get_metrics()
+        self.windows_processed = metrics.counter('chatbot_qa_windows_total', 'Passage windows run through the QA model',
+                                                 ('model',))
+        self.tokens_processed = metrics.counter('chatbot_qa_tokens_total',
+                                                'Tokens (question and window, without padding) run through the QA model',
+                                                ('model',))
+
+        # the windows of concurrent questions are batched together by the scheduler
+        self.scheduler = None
+        scheduler = config.ANSWER_EXTRACTOR['SCHEDULER']
+        if scheduler['ENABLED']:
+            self.scheduler = InferenceScheduler(self.forward, scheduler['MAX_BATCH_SIZE'], scheduler['MAX_WAIT'])
+
+        # the model runs on the backend chosen by QA_BACKEND (torch, quantized, torchscript or onnx), the parity
+        # check goes through extract_batched, so it runs once the counters and the scheduler are set up
+        self.backend = load_backend(config.QA_BACKEND['BACKEND'], self.model, self.tokenizer, self.model_path,
+                                    self.max_seq_len)
+        self.verified = False
+        if verify:
+            self.verify()
+
+    # throughput and queueing delay of the inference scheduler
+    def metrics(self):
+        return self.scheduler.metrics() if self.scheduler is not None else {}
+
+    # run the parity check of a non-torch backend, once, if PARITY_CHECK is enabled - the prefork server (serve.py)
+    # creates the extractor with verify=False, so that no forward pass runs before the fork, and verifies it in
+    # every worker
+    def verify(self):
+        if not self.verified and self.backend.name != 'torch' and config.QA_BACKEND['PARITY_CHECK']:
+            self.check_parity(config.QA_BACKEND['PARITY_TOLERANCE'])
+        self.verified = True
+
+    # compare the top answer and score of the backend with the fp32 model on PARITY_SAMPLES, and fall back
+    # to the fp32 model if the answer differs or the score is off by more than tolerance
+    def check_parity(self, tolerance):
+        reference = TorchBackend(self.model)
+
+        for question, context in PARITY_SAMPLES:
+            expected = self.extract_batched(question, [context], reference)
+            actual = self.extract_batched(question, [context], self.backend)
+            if not expected or not actual:
+                continue
+
+            error = abs(expected[0]['score'] - actual[0]['score'])
+            if expected[0]['answer'] != actual[0]['answer'] or error > tolerance:
+                logger.error('QA backend %s failed the parity check (%r, score %.4f) vs fp32 (%r, score %.4f), '
+                             'falling back to torch', self.backend.name, actual[0]['answer'], actual[0]['score'],
+                             expected[0]['answer'], expected[0]['score'])
+                self.backend = reference
+                return
+
+        logger.info('QA backend %s passed the parity check', self.backend.name)
+
+    # given question and related passages, it returns answers dictionary sorted
+    # in descending order of scores - inline runs the model on the calling thread instead of the scheduler
+    def extract(self, question, passages, inline=False):
+        if self.batch_size > 1 or self.backend.name != 'torch':
+            return self.extract_batched(question, passages, inline=inline)
+
         answers = []
-        
+
         for passage in passages:
             try:
                 currAnswer = self.nlp(question=question, context=passage)
@@ -26,4 +104,181 @@ class AnswerExtractor:
             except KeyError:
                 pass
         answers.sort(key=operator.itemgetter('score'), reverse=True)
-        return answers
\ No newline at end of file
+        return answers
+
+    # same as extract, but yields the answer of every passage (in the order of the passages) as soon as it is scored
+    def extract_iter(self, question, passages):
+        for passage in passages:
+            answers = self.extract(question, [passage])
+            if answers:
+                yield answers[0]
+
+    # same as extract, but all (question, passage) pairs are tokenized together and run through
+    # the model in padded batches of batch_size windows instead of one pipeline call per passage -
+    # or, with the inference scheduler, in batches shared with the other questions being answered
+    def extract_batched(self, question, passages, backend=None, inline=False):
+        features = self.encode(question, passages)
+        if backend is None:
+            self.windows_processed.inc(len(features), model=self.model_path)
+            self.tokens_processed.inc(sum(len(feature['input_ids']) for feature in features), model=self.model_path)
+
+        if self.scheduler is not None and backend is None and not inline:
+            logits = [future.result() for future in self.scheduler.submit(features)]
+        else:
+            logits = []
+            for i in range(0, len(features), self.batch_size):
+                start_logits, end_logits = self.forward(features[i:i + self.batch_size], backend)
+                logits.extend(zip(start_logits, end_logits))
+
+        # best (score, start, end) span of every passage over all of its windows
+        best = {}
+        for feature, (start, end) in zip(features, logits):
+            span = self.decode(feature, start, end)
+            if span is None:
+                continue
+            if feature['passage'] not in best or span[0] > best[feature['passage']][0]:
+                best[feature['passage']] = span
+
+        answers = []
+
+        for i, passage in enumerate(passages):
+            try:
+                score, start, end = best[i]
+                answers.append(self.make_answer(passage, score, start, end))
+            except KeyError:
+                pass
+        answers.sort(key=operator.itemgetter('score'), reverse=True)
+        return answers
+
+    # concatenate the question with every window of every passage - passages are tokenized and split into
+    # windows starting every doc_stride tokens once, and cached by PassageWindows, each window becomes a feature
+    def encode(self, question, passages):
+        return self.windows.features(question, passages)
+
+    # run one padded forward pass over the given features and return start and end logits
+    def forward(self, features, backend=None):
+        backend = self.backend if backend is None else backend
+        if backend.fixed_length:
+            width = self.max_seq_len
+        else:
+            width = max(len(feature['input_ids']) for feature in features)
+        input_ids = torch.full((len(features), width), self.tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(features), width), dtype=torch.long)
+        token_type_ids = torch.zeros((len(features), width), dtype=torch.long)
+
+        for row, feature in enumerate(features):
+            length = len(feature['input_ids'])
+            input_ids[row, :length] = torch.tensor(feature['input_ids'])
+            attention_mask[row, :length] = 1
+            if feature['token_type_ids'] is not None:
+                token_type_ids[row, :length] = torch.tensor(feature['token_type_ids'])
+
+        inputs = {'input_ids': input_ids, 'attention_mask': attention_mask}
+        if features[0]['token_type_ids'] is not None:
+            inputs['token_type_ids'] = token_type_ids
+
+        return backend(inputs)
+
+    # find the best answer span of a feature - the score of a span is P(start) * P(end) where the
+    # probabilities are a softmax over the context tokens and [CLS] (the question and separator tokens
+    # are masked), then [CLS] is excluded from the answers, like in QuestionAnsweringPipeline
+    def decode(self, feature, start_logits, end_logits):
+        context = np.array(feature['context'])
+        if not context.any():
+            return None
+
+        length = len(feature['input_ids'])
+        scored = context.copy()
+        scored[0] = True
+        start = self.softmax(np.where(scored, start_logits[:length], -10000.0))
+        end = self.softmax(np.where(scored, end_logits[:length], -10000.0))
+        start[0] = end[0] = 0.0
+
+        # only spans with start <= end and at most max_answer_len tokens are candidates
+        candidates = np.tril(np.triu(np.outer(start, end)), self.max_answer_len - 1)
+        start_index, end_index = np.unravel_index(np.argmax(candidates), candidates.shape)
+
+        offsets = feature['offsets']
+        return float(candidates[start_index, end_index]), offsets[start_index][0], offsets[end_index][1]
+
+    @staticmethod
+    def softmax(logits):
+        exp = np.exp(logits - np.max(logits))
+        return exp / exp.sum()
+
+    # the span already covers whole words (see PassageWindows), the answer is that text of the passage,
+    # like in QuestionAnsweringPipeline
+    @staticmethod
+    def make_answer(passage, score, start, end):
+        return {
+            'score': score,
+            'start': start,
+            'end': end,
+            'answer': passage[start:end],
+            'text': passage,
+        }
+
+
+class CascadeAnswerExtractor:
+    """
+      Answers with a small fast model first and escalates to the large model only when the small one is not sure.
+
+      All passages are scored by the fast AnswerExtractor. If its best answer scores at least THRESHOLD, its answers
+      are returned. Otherwise the ESCALATE_TOPN passages with the best fast answers are run through the accurate
+      AnswerExtractor, whose answers come first, followed by the fast answers of the other passages (the scores
+      of the two models are not comparable). How often each tier answered is logged every LOG_EVERY questions.
+
+      extract: Same as AnswerExtractor.extract.
+      verify: Run the parity check of the backends of both extractors (see AnswerExtractor.verify).
+      metrics: Return the number of questions answered by every tier and the metrics of both extractors.
+    """
+
+    def __init__(self, fast, accurate, cascade):
+        self.fast = fast
+        self.accurate = accurate
+        self.threshold = cascade['THRESHOLD']
+        self.escalate_topn = cascade['ESCALATE_TOPN']
+        self.log_every = cascade['LOG_EVERY']
+        self.counts = {'fast': 0, 'accurate': 0}
+        self.lock = threading.Lock()
+
+    # answer with the fast model, escalate the top passages to the accurate one below the threshold
+    def extract(self, question, passages, inline=False):
+        answers = self.fast.extract(question, passages, inline)
+
+        if answers and answers[0]['score'] >= self.threshold:
+            self.count('fast')
+            return answers
+
+        if answers:
+            escalated = [answer['text'] for answer in answers[:self.escalate_topn]]
+        else:
+            escalated = passages[:self.escalate_topn]
+
+        accurate_answers = self.accurate.extract(question, escalated, inline)
+        self.count('accurate')
+        return accurate_answers + [answer for answer in answers if answer['text'] not in escalated]
+
+    # parity check of both models, if it was left for later
+    def verify(self):
+        self.fast.verify()
+        self.accurate.verify()
+
+    # questions answered per tier and the inference metrics of both models
+    def metrics(self):
+        with self.lock:
+            counts = dict(self.counts)
+        return {'tiers': counts, 'fast': self.fast.metrics(), 'accurate': self.accurate.metrics()}
+
+    # count the questions answered by a tier and log the share of every tier
+    def count(self, tier):
+        with self.lock:
+            self.counts[tier] += 1
+            total = sum(self.counts.values())
+            if total % self.log_every:
+                return
+            counts = dict(self.counts)
+
+        logger.info('Cascade: %d questions, %.1f%% answered by %s, %.1f%% escalated to %s', total,
+                    100 * counts['fast'] / total, self.fast.model_path, 100 * counts['accurate'] / total,
+                    self.accurate.model_path)
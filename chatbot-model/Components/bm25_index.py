@@ -0,0 +1,313 @@
+import json
+import os
+from collections import Counter, namedtuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+# A set of documents to score against, with IDF and length norms computed over that set only
+Subset = namedtuple('Subset', ['mask', 'columns', 'norms', 'size'])
+
+
+class BM25Index:
+    """
+      Inverted BM25 index, stored as a sparse term-document matrix of term frequencies (one row per term,
+      one column per document) together with the document frequency of every term and the length of every
+      document. IDF and length norms are precomputed and only refreshed after the index changes.
+
+      Scoring a query only reads the posting lists (matrix rows) of the query terms, so its cost scales with
+      the number of postings of those terms instead of the number of documents in the index.
+
+      Documents are added to a small pending matrix and removed documents are only tombstoned, so neither
+      needs a rebuild of the main matrix - pending and removed documents are folded in by compact(), which
+      runs automatically once they make up a large part of the index and before every save().
+
+      add: Add documents given as (key, tokens) pairs - a key that is already indexed is replaced.
+      remove: Remove documents by key.
+      subset: Select documents by key, to score only against them with IDF and length norms of that subset.
+      search: Return the top N (key, score) pairs for the query tokens.
+      compact: Merge pending documents into the main matrix and drop removed documents.
+      save: Write the index to a directory of .npy files.
+      load: Load an index written by save() - the arrays are memory-mapped instead of read into memory.
+    """
+
+    ARRAYS = ['data', 'indices', 'indptr', 'forward_indptr', 'forward_indices', 'doc_len', 'doc_freq', 'idf', 'norms']
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+
+        self.terms = []
+        self.vocabulary = {}
+        self.keys = []
+        self.columns = {}
+
+        # compacted documents: term-major postings for scoring and document-major term lists for removal
+        self.main = csr_matrix((0, 0), dtype=np.float32)
+        self.forward_indptr = np.zeros(1, dtype=np.int32)
+        self.forward_indices = np.zeros(0, dtype=np.int32)
+
+        # documents added since the last compaction: column -> (term rows, term frequencies)
+        self.pending = {}
+        self.delta = None
+
+        self.doc_len = np.zeros(0, dtype=np.float32)
+        self.doc_freq = np.zeros(0, dtype=np.int32)
+        self.alive = np.zeros(0, dtype=bool)
+
+        self.idf = np.zeros(0, dtype=np.float32)
+        self.norms = np.zeros(0, dtype=np.float32)
+        self.stale = False
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __contains__(self, key):
+        return key in self.columns
+
+    def add(self, documents):
+        documents = list(documents)
+        self.remove([key for key, _ in documents if key in self.columns])
+
+        lengths = []
+        for key, tokens in documents:
+            counts = Counter(tokens)
+            rows = np.fromiter((self.row(term) for term in counts), dtype=np.int32, count=len(counts))
+            tfs = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+
+            column = len(self.keys)
+            self.keys.append(key)
+            self.columns[key] = column
+            self.pending[column] = (rows, tfs)
+            lengths.append(len(tokens))
+
+        doc_freq = np.zeros(len(self.terms), dtype=np.int32)
+        doc_freq[:len(self.doc_freq)] = self.doc_freq
+        for column in range(len(self.keys) - len(documents), len(self.keys)):
+            doc_freq[self.pending[column][0]] += 1
+
+        self.doc_freq = doc_freq
+        self.doc_len = np.concatenate([self.doc_len, np.array(lengths, dtype=np.float32)])
+        self.alive = np.concatenate([self.alive, np.ones(len(documents), dtype=bool)])
+        self.delta = None
+        self.stale = True
+
+        self.maybe_compact()
+
+    def remove(self, keys):
+        removed = False
+        for key in keys:
+            column = self.columns.pop(key, None)
+            if column is None:
+                continue
+
+            if not self.doc_freq.flags.writeable:
+                self.doc_freq = np.array(self.doc_freq)
+
+            self.alive[column] = False
+            self.doc_freq[self.doc_rows(column)] -= 1
+            if self.pending.pop(column, None) is not None:
+                self.delta = None
+            removed = True
+
+        if removed:
+            self.stale = True
+            self.maybe_compact()
+
+    def row(self, term):
+        row = self.vocabulary.get(term)
+        if row is None:
+            row = len(self.terms)
+            self.terms.append(term)
+            self.vocabulary[term] = row
+        return row
+
+    def doc_rows(self, column):
+        if column in self.pending:
+            return self.pending[column][0]
+        return self.forward_indices[self.forward_indptr[column]:self.forward_indptr[column + 1]]
+
+    def maybe_compact(self):
+        compacted = self.main.shape[1]
+        if len(self.pending) > max(1000, compacted) or len(self.keys) - len(self.columns) > len(self.keys) / 2:
+            self.compact()
+
+    def compact(self):
+        live = np.flatnonzero(self.alive)
+        remap = np.full(len(self.keys), -1, dtype=np.int64)
+        remap[live] = np.arange(len(live))
+
+        main = self.main.tocoo()
+        keep = self.alive[main.col] if main.nnz else np.zeros(0, dtype=bool)
+        rows = [main.row[keep]]
+        cols = [remap[main.col[keep]]]
+        data = [main.data[keep]]
+        for column, (term_rows, tfs) in self.pending.items():
+            rows.append(term_rows)
+            cols.append(np.full(len(term_rows), remap[column]))
+            data.append(tfs)
+
+        # terms that no longer occur in any document are dropped from the vocabulary
+        used = np.flatnonzero(self.doc_freq > 0)
+        term_remap = np.full(len(self.terms), -1, dtype=np.int64)
+        term_remap[used] = np.arange(len(used))
+
+        rows = term_remap[np.concatenate(rows)]
+        cols = np.concatenate(cols)
+        data = np.concatenate(data).astype(np.float32)
+        self.main = csr_matrix((data, (rows, cols)), shape=(len(used), len(live)), dtype=np.float32)
+        self.main.sort_indices()
+
+        forward = self.main.tocsc()
+        self.forward_indptr = forward.indptr
+        self.forward_indices = forward.indices
+
+        self.terms = [self.terms[row] for row in used]
+        self.vocabulary = {term: row for row, term in enumerate(self.terms)}
+        self.keys = [self.keys[column] for column in live]
+        self.columns = {key: column for column, key in enumerate(self.keys)}
+
+        self.doc_len = np.array(self.doc_len[live], dtype=np.float32)
+        self.doc_freq = np.array(self.doc_freq[used], dtype=np.int32)
+        self.alive = np.ones(len(live), dtype=bool)
+        self.pending = {}
+        self.delta = None
+        self.stale = True
+
+    def idf_of(self, doc_freq, size):
+        return np.log((size - doc_freq + 0.5) / (doc_freq + 0.5) + 1)
+
+    def norms_of(self, lengths):
+        avgdl = lengths.mean() if len(lengths) else 0
+        return self.k1 * (1 - self.b + self.b * lengths / (avgdl or 1))
+
+    def refresh(self):
+        if self.delta is None and self.pending:
+            columns = list(self.pending)
+            rows = np.concatenate([self.pending[column][0] for column in columns])
+            cols = np.concatenate([np.full(len(self.pending[column][0]), column) for column in columns])
+            data = np.concatenate([self.pending[column][1] for column in columns])
+            self.delta = csr_matrix((data, (rows, cols)), shape=(len(self.terms), len(self.keys)), dtype=np.float32)
+
+        if self.stale:
+            self.idf = self.idf_of(self.doc_freq, len(self.columns)).astype(np.float32)
+            norms = np.zeros(len(self.keys), dtype=np.float32)
+            norms[self.alive] = self.norms_of(self.doc_len[self.alive])
+            self.norms = norms
+            self.stale = False
+
+    def postings(self, row):
+        cols = []
+        tfs = []
+        for matrix in (self.main, self.delta):
+            if matrix is not None and row < matrix.shape[0]:
+                start, end = matrix.indptr[row], matrix.indptr[row + 1]
+                cols.append(matrix.indices[start:end])
+                tfs.append(matrix.data[start:end])
+
+        if not cols:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+        return np.concatenate(cols), np.concatenate(tfs)
+
+    def subset(self, keys):
+        self.refresh()
+        columns = np.unique(np.fromiter((self.columns[key] for key in keys), dtype=np.int64))
+        mask = np.zeros(len(self.keys), dtype=bool)
+        mask[columns] = True
+        norms = np.zeros(len(self.keys), dtype=np.float32)
+        norms[columns] = self.norms_of(self.doc_len[columns])
+        return Subset(mask, columns, norms, len(columns))
+
+    def search(self, tokens, topn, subset=None):
+        self.refresh()
+        mask = self.alive if subset is None else subset.mask
+        norms = self.norms if subset is None else subset.norms
+
+        matched = []
+        scores = []
+        for term, count in Counter(tokens).items():
+            row = self.vocabulary.get(term)
+            if row is None:
+                continue
+
+            cols, tfs = self.postings(row)
+            selected = mask[cols]
+            cols, tfs = cols[selected], tfs[selected]
+            if subset is None:
+                idf = self.idf[row]
+            else:
+                idf = self.idf_of(len(cols), subset.size)
+
+            matched.append(cols)
+            scores.append(count * idf * tfs * (self.k1 + 1) / (tfs + norms[cols]))
+
+        if matched:
+            columns, inverse = np.unique(np.concatenate(matched), return_inverse=True)
+            totals = np.bincount(inverse, weights=np.concatenate(scores))
+        else:
+            columns, totals = np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        order = np.argsort(-totals, kind='stable')[:topn]
+        results = [(self.keys[columns[i]], float(totals[i])) for i in order]
+
+        # not enough documents share a term with the query - fill up with zero scored ones
+        if len(results) < topn:
+            candidates = np.flatnonzero(mask) if subset is None else subset.columns
+            extra = candidates[~np.isin(candidates, columns)][:topn - len(results)]
+            results.extend((self.keys[column], 0.0) for column in extra)
+
+        return results
+
+    def save(self, path):
+        self.compact()
+        self.refresh()
+        os.makedirs(path, exist_ok=True)
+
+        arrays = {
+            'data': self.main.data,
+            'indices': self.main.indices,
+            'indptr': self.main.indptr,
+            'forward_indptr': self.forward_indptr,
+            'forward_indices': self.forward_indices,
+            'doc_len': self.doc_len,
+            'doc_freq': self.doc_freq,
+            'idf': self.idf,
+            'norms': self.norms,
+        }
+
+        # write next to the old files and rename, an index loaded from this path may still map them
+        for name, array in arrays.items():
+            file = os.path.join(path, name + '.npy')
+            with open(file + '.tmp', 'wb') as f:
+                np.save(f, array)
+            os.replace(file + '.tmp', file)
+
+        meta = {'k1': self.k1, 'b': self.b, 'shape': list(self.main.shape), 'terms': self.terms, 'keys': self.keys}
+        with open(os.path.join(path, 'meta.json.tmp'), 'w') as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(path, 'meta.json.tmp'), os.path.join(path, 'meta.json'))
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+
+        arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in cls.ARRAYS}
+
+        index = cls(meta['k1'], meta['b'])
+        index.terms = meta['terms']
+        index.vocabulary = {term: row for row, term in enumerate(index.terms)}
+        index.keys = meta['keys']
+        index.columns = {key: column for column, key in enumerate(index.keys)}
+
+        index.main = csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=tuple(meta['shape']), copy=False)
+        index.forward_indptr = arrays['forward_indptr']
+        index.forward_indices = arrays['forward_indices']
+        index.doc_len = arrays['doc_len']
+        index.doc_freq = arrays['doc_freq']
+        index.alive = np.ones(len(index.keys), dtype=bool)
+        index.idf = arrays['idf']
+        index.norms = arrays['norms']
+
+        return index
@@ -0,0 +1,132 @@
+import logging
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+
+logger = logging.getLogger(__name__)
+
+# page parser of a worker process, created once per process by init_worker
+_parser = None
+
+
+def init_worker(confluence):
+    global _parser
+    from Components.document_retriever import ConfluencePageParser
+    _parser = ConfluencePageParser(confluence)
+
+
+def summarize_page(page_html):
+    return _parser.summarize_page(page_html)
+
+
+class ConfluenceIngestor:
+    """
+      Bulk summary generation for the pages of a ConfluenceDocumentRetriever.
+
+      The html of the pages is fetched concurrently by FETCH_WORKERS threads. Parsing and GPT-2 summarization are
+      CPU bound, they run in a pool of PROCESS_WORKERS processes which load their own summarizer once - with
+      PROCESS_WORKERS = 0 they run on a single thread with the summarizer of the retriever instead.
+      At most MAX_IN_FLIGHT pages are fetched or summarized at the same time, so fetching does not run ahead
+      of summarization and hold the html of a whole space in memory.
+
+      Summarized pages are written to the summary store (with their version) every CHECKPOINT_EVERY pages. An
+      interrupted run therefore resumes where it stopped: the next sync only ingests the pages whose stored
+      version is still missing or outdated. Progress and throughput are logged every REPORT_EVERY seconds.
+
+      The process pool uses the spawn start method, which imports the main module of the program again in every
+      worker - use it from ingest.py rather than from model-api.py, which loads the QA model at import time.
+
+      ingest: Fetch, summarize and store the given {page_id: version} pages, return the number of stored pages.
+    """
+
+    def __init__(self, retriever, ingest):
+        self.retriever = retriever
+        self.fetch_workers = ingest['FETCH_WORKERS']
+        self.process_workers = ingest['PROCESS_WORKERS']
+        self.max_in_flight = ingest['MAX_IN_FLIGHT']
+        self.checkpoint_every = ingest['CHECKPOINT_EVERY']
+        self.report_every = ingest['REPORT_EVERY']
+        self.confluence = {
+            'CODE_PREFIX': retriever.CODE_PREFIX,
+            'SEPARATOR': retriever.SEPARATOR,
+            'MIN_SUMMARY_WORDS': retriever.min_summary_words,
+        }
+
+    def fetch(self, page_id):
+        page_json = self.retriever.search_page(page_id, 'body.storage')
+        return page_json['body']['storage']['value']
+
+    def summarizers(self):
+        if self.process_workers:
+            return ProcessPoolExecutor(self.process_workers, mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=init_worker, initargs=(self.confluence,))
+        return ThreadPoolExecutor(1)
+
+    def checkpoint(self, completed):
+        if completed:
+            self.retriever.store.upsert(completed)
+            completed.clear()
+
+    def ingest(self, page_versions):
+        if not page_versions:
+            return 0
+
+        total = len(page_versions)
+        pending = iter(page_versions)
+        in_flight = {}
+        completed = []
+        processed = stored = failed = 0
+        started = last_report = time.monotonic()
+
+        with ThreadPoolExecutor(self.fetch_workers) as fetchers, self.summarizers() as summarizers:
+            summarize = summarize_page if self.process_workers else self.retriever.summarize_page
+
+            def fetch_next():
+                page_id = next(pending, None)
+                if page_id is not None:
+                    in_flight[fetchers.submit(self.fetch, page_id)] = ('fetch', page_id)
+
+            for _ in range(self.max_in_flight):
+                fetch_next()
+
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    stage, page_id = in_flight.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception:
+                        logger.exception('Failed to %s confluence page %s', stage, page_id)
+                        failed += 1
+                        fetch_next()
+                        continue
+
+                    if stage == 'fetch':
+                        in_flight[summarizers.submit(summarize, result)] = ('summarize', page_id)
+                        continue
+
+                    summary, passages = result
+                    processed += 1
+                    if summary:
+                        completed.append((page_id, summary, passages, self.retriever.SPACEKEY, page_versions[page_id]))
+                        stored += 1
+                    if len(completed) >= self.checkpoint_every:
+                        self.checkpoint(completed)
+                    fetch_next()
+
+                now = time.monotonic()
+                if now - last_report >= self.report_every:
+                    last_report = now
+                    self.report(processed + failed, total, failed, now - started)
+
+        self.checkpoint(completed)
+        self.report(processed + failed, total, failed, time.monotonic() - started)
+        return stored
+
+    def report(self, done, total, failed, elapsed):
+        rate = done / elapsed if elapsed else 0
+        eta = (total - done) / rate if rate else float('inf')
+        logger.info('Ingested %d/%d confluence pages of space %s (%d failed), %.2f pages/sec, ETA %.0f sec',
+                    done, total, self.retriever.SPACEKEY, failed, rate, eta)
@@ -0,0 +1,181 @@
+import json
+import logging
+import os
+
+import numpy as np
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+
+logger = logging.getLogger(__name__)
+
+
+def load_encoder(name):
+    """
+        Returns the sentence-transformers model `name`, or None when sentence-transformers is not installed.
+    """
+
+    if SentenceTransformer is None:
+        logger.warning('sentence-transformers is not installed, dense passage retrieval is disabled')
+        return None
+    return SentenceTransformer(name)
+
+
+class DenseIndex:
+    """
+      Index of normalized passage embeddings, stored as one row per document in a float16 or int8 matrix.
+      int8 rows are scaled by their largest absolute value, the scale of every row is kept next to the matrix.
+      The name of the encoder model is saved with the index, embeddings of different models are not comparable.
+
+      Scoring is a single matrix-vector product (cosine similarity) over the selected rows. Removed documents are
+      only tombstoned and dropped by compact(), which runs once they make up half of the index and before save().
+
+      add: Add documents given as keys and an (n, dim) array of their embeddings - a key that is already indexed
+           is replaced.
+      remove: Remove documents by key.
+      search: Return the top N (key, score) pairs for a query embedding, optionally among the given keys only.
+      score: Return the scores of the given keys for a query embedding.
+      compact: Drop removed documents.
+      save: Write the index to a directory of .npy files.
+      load: Load an index written by save() - the arrays are memory-mapped instead of read into memory.
+    """
+
+    DTYPES = {'float16': np.float16, 'int8': np.int8}
+
+    def __init__(self, dim, dtype='float16', model=None):
+        self.dim = dim
+        self.dtype = dtype
+        self.model = model
+
+        self.keys = []
+        self.columns = {}
+        self.size = 0
+
+        # rows [0, size) are in use, the buffers grow by doubling
+        self.vectors = np.zeros((0, dim), dtype=self.DTYPES[dtype])
+        self.scales = np.zeros(0, dtype=np.float32)
+        self.alive = np.zeros(0, dtype=bool)
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __contains__(self, key):
+        return key in self.columns
+
+    def quantize(self, embeddings):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.maximum(norms, 1e-12)
+
+        if self.dtype == 'int8':
+            scales = np.abs(embeddings).max(axis=1) / 127
+            scales[scales == 0] = 1
+            return np.round(embeddings / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+        return embeddings.astype(np.float16), np.ones(len(embeddings), dtype=np.float32)
+
+    def reserve(self, size):
+        if size <= len(self.vectors) and self.vectors.flags.writeable:
+            return
+
+        capacity = max(size, 2 * len(self.vectors), 1024)
+        vectors = np.zeros((capacity, self.dim), dtype=self.vectors.dtype)
+        scales = np.zeros(capacity, dtype=np.float32)
+        alive = np.zeros(capacity, dtype=bool)
+        vectors[:self.size] = self.vectors[:self.size]
+        scales[:self.size] = self.scales[:self.size]
+        alive[:self.size] = self.alive[:self.size]
+        self.vectors, self.scales, self.alive = vectors, scales, alive
+
+    def add(self, keys, embeddings):
+        keys = list(keys)
+        if not keys:
+            return
+
+        self.remove([key for key in keys if key in self.columns])
+        vectors, scales = self.quantize(embeddings)
+
+        self.reserve(self.size + len(keys))
+        self.vectors[self.size:self.size + len(keys)] = vectors
+        self.scales[self.size:self.size + len(keys)] = scales
+        self.alive[self.size:self.size + len(keys)] = True
+        for key in keys:
+            self.columns[key] = len(self.keys)
+            self.keys.append(key)
+        self.size += len(keys)
+
+    def remove(self, keys):
+        for key in keys:
+            column = self.columns.pop(key, None)
+            if column is not None:
+                if not self.alive.flags.writeable:
+                    self.alive = np.array(self.alive)
+                self.alive[column] = False
+
+        if self.size - len(self.columns) > self.size / 2:
+            self.compact()
+
+    def compact(self):
+        live = np.flatnonzero(self.alive[:self.size])
+        self.vectors = np.array(self.vectors[live])
+        self.scales = np.array(self.scales[live])
+        self.alive = np.ones(len(live), dtype=bool)
+        self.keys = [self.keys[column] for column in live]
+        self.columns = {key: column for column, key in enumerate(self.keys)}
+        self.size = len(live)
+
+    def scores_of(self, query, columns):
+        query = np.asarray(query, dtype=np.float32)
+        query = query / max(np.linalg.norm(query), 1e-12)
+        return (self.vectors[columns].astype(np.float32) @ query) * self.scales[columns]
+
+    def score(self, query, keys):
+        columns = np.fromiter((self.columns[key] for key in keys), dtype=np.int64)
+        return self.scores_of(query, columns)
+
+    def search(self, query, topn, keys=None):
+        if keys is None:
+            columns = np.flatnonzero(self.alive[:self.size])
+        else:
+            columns = np.fromiter((self.columns[key] for key in keys if key in self.columns), dtype=np.int64)
+
+        scores = self.scores_of(query, columns)
+        if topn < len(scores):
+            top = np.argpartition(-scores, topn)[:topn]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(self.keys[columns[i]], float(scores[i])) for i in top]
+
+    def save(self, path):
+        self.compact()
+        os.makedirs(path, exist_ok=True)
+
+        # write next to the old files and rename, an index loaded from this path may still map them
+        for name, array in (('vectors', self.vectors), ('scales', self.scales)):
+            file = os.path.join(path, name + '.npy')
+            with open(file + '.tmp', 'wb') as f:
+                np.save(f, array)
+            os.replace(file + '.tmp', file)
+
+        meta = {'dim': self.dim, 'dtype': self.dtype, 'model': self.model, 'keys': self.keys}
+        with open(os.path.join(path, 'meta.json.tmp'), 'w') as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(path, 'meta.json.tmp'), os.path.join(path, 'meta.json'))
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+
+        index = cls(meta['dim'], meta['dtype'], meta['model'])
+        index.vectors = np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r')
+        index.scales = np.load(os.path.join(path, 'scales.npy'), mmap_mode='r')
+        index.keys = meta['keys']
+        index.columns = {key: column for column, key in enumerate(index.keys)}
+        index.size = len(index.keys)
+        index.alive = np.ones(index.size, dtype=bool)
+
+        return index
@@ -1,100 +1,45 @@
-import os
-import csv
 import pandas as pd
-import requests
 import json
+import logging
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from bs4 import BeautifulSoup
 import html2text
+import requests
 from summarizer import TransformerSummarizer
-from gensim.summarization.bm25 import BM25
+from Components.bm25_index import BM25Index
+from Components.confluence_ingest import ConfluenceIngestor
+from Components.http_client import get_http_client
+from Components.scheduler import PeriodicTask
+from Components.summary_store import SummaryStore
+from Components.token_cache import get_token_cache
+
 
+logger = logging.getLogger(__name__)
 
-class ConfluenceDocumentRetriever:
+
+class ConfluencePageParser:
     """
-      This class is for retrieving Documents from atlassian confluence api and returing the pages
-      in the form of List after appropriate preprocessing.
+      This class is for converting the html of a confluence page into passages and a summary. It does not call the
+      API, so it can also be used on its own, for example in the worker processes of ConfluenceIngestor.
 
-      search: Search the pages from an API and return passages and tables in the form of list of strings.
-          - First, It will get all the pages for a user.
-          - If summary of some page is not present in summary file, then it will generate and store the summary for that page.
-          - Apply BM25 between user's question (query) and summary of docs and get TOP N docs to search using API.
-          - Search the most relavant N pages (extracted in previous) step though API.
-          - Extract text and tables from these pages and convert it into a list of passages.
-      generate_summary: Given a page ID, generate summary of that page content using GPT-2 Model.
-      get_relavant_pages: Extract the most relavant N pages using BM25 between query and summary of the docs.
-      search_pages: Get metadata of all the pages of a user and return a list of page ids.
-      search_page: Given a page id, get html of that page using an API.
+      summarize_page: Given the html of a page, return its summary (generated using GPT-2 Model) and its passages
+                      joined by SEPARATOR. The summarizer is loaded on first use when none is given.
       extract_text: To extract text data from given html data of a page.
       extract_passages: To extract passages from a text data of a page.
       extract tables: To extract tables from given html data of a page in below format:
                       col1: val1, col2: val2, ... , colN: valN
                       Rows within a table are separated by "  |  ".
-      update_confluence_summary_db: To update the confluence summary csv - delete the summary of deleted docs
-                                    and add the summary for newly created docs.
     """
 
-    def __init__(self, userName, token, nlp, confluence, domain, projectkey):
-        self.domain = domain
-        self.page_ids = []
-        self.userName = userName
-        self.token = token
-        self.SPACEKEY = projectkey
+    def __init__(self, confluence, summarizer=None):
         self.CODE_PREFIX = confluence['CODE_PREFIX']
-        self.CONFLUENCE_SUMMARY_DB = confluence['CONFLUENCE_SUMMARY_DB']
-        self.min_summary_words = confluence['MIN_SUMMARY_WORDS']
-        self.update_confluence_summary = confluence['UPDATE_CONFLUENCE_SUMMARY']
         self.SEPARATOR = confluence['SEPARATOR']
-        self.tokenize = lambda text: [token.lemma_ for token in nlp(text)]
-        self.GPT2_model = TransformerSummarizer(transformer_type="GPT2", transformer_model_key="gpt2-medium")
-        self.invalid = False
-
-        self.validate()
-
-        if self.invalid is False:
-            if not os.path.exists(confluence['CONFLUENCE_SUMMARY_DB']):
-                with open(confluence['CONFLUENCE_SUMMARY_DB'], 'w') as csvfile:
-                    csvwriter = csv.writer(csvfile)
-                    csvwriter.writerow(['page_id', 'summary', 'passages'])
-
-            if self.update_confluence_summary:
-                self.update_confluence_summary = False
-                self.search_pages()
-                self.update_confluence_summary_db()
-
-    def validate(self):
-        url = 'https://' + self.domain + '.atlassian.net/wiki/rest/api/search?cql='
-        if self.SPACEKEY:
-            url = url + 'space=' + self.SPACEKEY + ' and '
-        url = url + 'type=page'
-        requestResponse = requests.get(url, auth=(self.userName, self.token))
-        if requestResponse.ok is False:
-            self.invalid = True
-    
-    def search_page(self, page_id, expand=False):
-        if expand:
-            suffix = '?expand=' + expand
-        else:
-            suffix = ''
-
-        url = 'https://' + self.domain + '.atlassian.net/wiki/rest/api/content/' + page_id + suffix
-        response = requests.get(url, auth=(self.userName, self.token))
-        response.encoding = 'utf8'
-
-        return json.loads(response.text)
-
-    def search_pages(self):
-        url = 'https://' + self.domain + '.atlassian.net/wiki/rest/api/search?cql='
-        if self.SPACEKEY:
-            url = url + 'space=' + self.SPACEKEY + ' and '
-        url = url + 'type=page'
-        response = requests.get(url, auth=(self.userName, self.token))
-        obj = response.json()
-
-        page_ids = []
-        for page in obj['results']:
-            page_ids.append(page['content']['id'])
-
-        self.page_ids = page_ids
+        self.min_summary_words = confluence['MIN_SUMMARY_WORDS']
+        self.GPT2_model = summarizer
 
     def extract_text(self, html_data):
         soup = BeautifulSoup(html_data, features='html.parser')
@@ -152,28 +97,7 @@ class ConfluenceDocumentRetriever:
 
         return txt_data
 
-    def get_relavant_pages(self, df, question, topn=2):
-        summary_docs = []
-        for idx, row in df.iterrows():
-            if str(row['page_id']) in self.page_ids:
-                summary_docs.append(row['summary'])
-
-        corpus = [self.tokenize(doc) for doc in summary_docs]
-        self.bm25 = BM25(corpus)
-
-        tokens = self.tokenize(question)
-        average_idf = sum(float(val) for val in self.bm25.idf.values()) / len(self.bm25.idf)
-        scores = self.bm25.get_scores(tokens, average_idf)
-        pairs = [(s, i) for i, s in enumerate(scores)]
-        pairs.sort(reverse=True)
-        topn_docs = [summary_docs[i] for _, i in pairs[:topn]]
-        mask = df['summary'].isin(topn_docs)
-
-        return list(map(str, df.loc[mask]['page_id']))
-
-    def generate_summary(self, page_id):
-        page_json = self.search_page(page_id, 'body.storage')
-        page_html = page_json['body']['storage']['value']
+    def summarize_page(self, page_html):
         tables = self.extract_tables(page_html)
         codes = self.extract_codes(page_html)
         text = self.extract_text(page_html)
@@ -192,51 +116,206 @@ class ConfluenceDocumentRetriever:
         if data_length <= self.min_summary_words:
             summary = data + '  |  ' + codes + '  |  ' + tables
         else:
+            if self.GPT2_model is None:
+                self.GPT2_model = TransformerSummarizer(transformer_type="GPT2", transformer_model_key="gpt2-medium")
             summary = self.GPT2_model(data,
                                       ratio=self.min_summary_words / data_length) + '  |  ' + codes + '  |  ' + tables
 
         return summary, csv_final
 
+
+# ------------------------------------------------------------------------------------------------------------------------
+
+
+class ConfluenceDocumentRetriever(ConfluencePageParser):
+    """
+      This class is for retrieving Documents from atlassian confluence api and returing the pages
+      in the form of List after appropriate preprocessing.
+
+      search: Search the pages from an API and return passages and tables in the form of list of strings.
+          - The pages of the space and their summaries are kept up to date by sync, in the background.
+          - Apply BM25 between user's question (query) and summary of docs and get TOP N docs to search using API.
+          - Search the most relavant N pages (extracted in previous) step though API.
+          - Extract text and tables from these pages and convert it into a list of passages.
+      generate_summary: Given a page ID, generate summary of that page content using GPT-2 Model (see ConfluencePageParser).
+      get_relavant_pages: Extract the most relavant N pages using BM25 between query and summary of the docs.
+      search_pages: Get metadata of all the pages of a user (following the pagination of the search results)
+                    and return a dictionary of page id -> page version.
+      search_page: Given a page id, get html of that page using an API.
+      update_confluence_summary_db: To update the confluence summary store - delete the summary of deleted docs
+                                    and add the summary for newly created docs and for docs whose version changed.
+                                    The summaries are generated by a ConfluenceIngestor (see INGEST config).
+      sync: List the pages of the space and, if UPDATE_CONFLUENCE_SUMMARY is set, update the summary store.
+            It runs every SYNC_INTERVAL seconds on a background thread - the pages are first listed during
+            construction, the summaries (if enabled) are first updated right after it.
+      close: Stop the background sync.
+
+      corpus_id / corpus_version identify the pages this retriever answers from: corpus_version is incremented
+      whenever a sync finds new, changed or deleted pages.
+
+      The summaries and passages are kept in a SummaryStore (SQLite, page_id primary key). A summary CSV of
+      previous versions (CONFLUENCE_SUMMARY_CSV) is imported into it on first start.
+    """
+
+    def __init__(self, userName, token, nlp, confluence, domain, projectkey, summarizer=None):
+        super().__init__(confluence, summarizer)
+        self.domain = domain
+        self.base_url = confluence['BASE_URL'].format(domain=domain)
+        self.page_ids = []
+        self.userName = userName
+        self.token = token
+        self.SPACEKEY = projectkey
+        self.CONFLUENCE_SUMMARY_DB = confluence['CONFLUENCE_SUMMARY_DB']
+        self.CONFLUENCE_SUMMARY_CSV = confluence['CONFLUENCE_SUMMARY_CSV']
+        self.update_confluence_summary = confluence['UPDATE_CONFLUENCE_SUMMARY']
+        self.search_limit = confluence['SEARCH_LIMIT']
+        self.token_cache = get_token_cache(nlp)
+        self.tokenize = self.token_cache.tokenize
+        self.invalid = False
+        self.http = get_http_client()
+        self.corpus_id = uuid.uuid4().hex
+        self.corpus_version = 0
+        self.store = SummaryStore(self.CONFLUENCE_SUMMARY_DB, self.CONFLUENCE_SUMMARY_CSV)
+
+        # BM25 index over the summaries of self.page_ids, rebuilt when the set of pages or their summaries change
+        self.summary_index = None
+        self.summary_index_pages = frozenset()
+
+        self.validate()
+
+        # pages of this space known from previous syncs, until a listing of this retriever has succeeded -
+        # pages imported from the summary CSV have no space yet, they can belong to another space
+        self.page_ids = [str(page_id) for page_id in self.store.page_ids(self.SPACEKEY, include_imported=False)]
+        self.page_versions = {}
+
+        # the pages are listed once before the first question, so that it is answered from all pages of the space
+        if not self.invalid:
+            try:
+                self.search_pages()
+            except (requests.RequestException, ValueError):
+                logger.warning('Listing the pages of %s failed, using the pages of previous syncs', self.SPACEKEY,
+                               exc_info=True)
+
+        self.ingestor = ConfluenceIngestor(self, confluence['INGEST'])
+
+        # summaries of new and changed pages are generated right away, the next listing is due after SYNC_INTERVAL
+        self.syncer = None
+        if confluence['SYNC_INTERVAL']:
+            initial_delay = 0 if self.update_confluence_summary else confluence['SYNC_INTERVAL']
+            self.syncer = PeriodicTask(confluence['SYNC_INTERVAL'], self.sync, name='confluence-sync',
+                                       initial_delay=initial_delay)
+            self.syncer.start()
+
+    def validate(self):
+        url = self.base_url + '/wiki/rest/api/search?cql='
+        if self.SPACEKEY:
+            url = url + 'space=' + self.SPACEKEY + ' and '
+        url = url + 'type=page'
+        requestResponse = self.http.get(url, auth=(self.userName, self.token))
+        self.invalid = requestResponse.ok is False
+    
+    def search_page(self, page_id, expand=False):
+        if expand:
+            suffix = '?expand=' + expand
+        else:
+            suffix = ''
+
+        url = self.base_url + '/wiki/rest/api/content/' + page_id + suffix
+        response = self.http.get(url, auth=(self.userName, self.token))
+        response.encoding = 'utf8'
+
+        return json.loads(response.text)
+
+    def search_pages(self):
+        url = self.base_url + '/wiki/rest/api/search?cql='
+        if self.SPACEKEY:
+            url = url + 'space=' + self.SPACEKEY + ' and '
+        url = url + 'type=page&expand=content.version&limit=' + str(self.search_limit) + '&start='
+
+        page_versions = {}
+        start = 0
+        while True:
+            response = self.http.get(url + str(start), auth=(self.userName, self.token))
+            response.raise_for_status()
+            obj = response.json()
+
+            for page in obj['results']:
+                page_versions[page['content']['id']] = page['content']['version']['number']
+
+            start += len(obj['results'])
+            if not obj['results'] or 'next' not in obj.get('_links', {}):
+                break
+
+        if page_versions != self.page_versions:
+            self.corpus_version += 1
+        self.page_versions = page_versions
+        self.page_ids = list(page_versions)
+        return page_versions
+
+    def get_relavant_pages(self, question, topn=2):
+        summary_index = self.summary_index
+        page_ids = self.page_ids
+        pages = frozenset(page_ids)
+        if summary_index is None or self.summary_index_pages != pages:
+            summaries = self.store.summaries(page_ids)
+            corpus = self.token_cache.tokenize_many([summary for _, summary in summaries])
+            summary_index = BM25Index()
+            summary_index.add((str(page_id), tokens) for (page_id, _), tokens in zip(summaries, corpus))
+            self.summary_index = summary_index
+            self.summary_index_pages = pages
+
+        tokens = self.tokenize(question)
+        return [page_id for page_id, _ in summary_index.search(tokens, topn)]
+
+    def generate_summary(self, page_id):
+        page_json = self.search_page(page_id, 'body.storage')
+        page_html = page_json['body']['storage']['value']
+        return self.summarize_page(page_html)
+
+
     def update_confluence_summary_db(self):
-        df = pd.read_csv(self.CONFLUENCE_SUMMARY_DB)
-        csv_page_ids = df['page_id'].tolist()
-
-        new_data = []
-        for page_id in self.page_ids:
-            if int(page_id) not in csv_page_ids:
-                summary, passage = self.generate_summary(page_id)
-                if not summary:
-                    continue
-                new_data.append([int(page_id), summary, passage])
-
-        for idx, row in df.iterrows():
-            if str(row['page_id']) in self.page_ids:
-                new_data.append([row['page_id'], row['summary'], row['passages']])
-
-        if new_data:
-            with open(self.CONFLUENCE_SUMMARY_DB, 'w+') as csvfile:
-                csvwriter = csv.writer(csvfile)
-                csvwriter.writerow(['page_id', 'summary', 'passages'])
-                csvwriter.writerows(new_data)
+        stored_versions = self.store.versions(self.page_versions)
+        changed = {page_id: version for page_id, version in self.page_versions.items()
+                   if stored_versions.get(int(page_id)) != version}
+
+        # new and changed pages are written to the store as they are summarized
+        self.ingestor.ingest(changed)
+
+        # pages imported from the summary CSV have no space yet, they can belong to another space
+        stored_page_ids = self.store.page_ids(self.SPACEKEY, include_imported=False)
+        removed = [page_id for page_id in stored_page_ids if str(page_id) not in self.page_versions]
+        self.store.delete(removed)
+
+        if changed or removed:
+            self.summary_index = None
+            self.corpus_version += 1
+
+    def sync(self):
+        if self.invalid:
+            return
+
+        self.search_pages()
+        if self.update_confluence_summary:
+            self.update_confluence_summary_db()
+
+    def close(self):
+        if self.syncer is not None:
+            self.syncer.stop()
 
     def get_passages_from_string(self, text):
         passages = text.split(self.SEPARATOR)
         passages = [passage for passage in passages if len(passage)]
         return passages
 
-    def search(self, question):
+    def search(self, question, query=None):
         docs = []
         if self.invalid:
             return docs
 
-        df = pd.read_csv(self.CONFLUENCE_SUMMARY_DB)
-        self.search_pages()
-        topn_page_ids = self.get_relavant_pages(df, question)
+        topn_page_ids = self.get_relavant_pages(question)
 
-        for idx, row in df.iterrows():
-            if str(row['page_id']) in topn_page_ids:
-                passages = self.get_passages_from_string(row['passages'])
-                docs.extend(passages)
+        for _, passages in self.store.passages(topn_page_ids):
+            docs.extend(self.get_passages_from_string(passages))
 
         return docs
 
@@ -250,8 +329,23 @@ class JiraDocumentRetriever():
          in the form of stories.
 
          search: Search for items (issues, tasks, stories etc.) for a given Project using Jira API.
-         get_total_items: Get total Number of items for a given project.
-         search_items: Get metadata about each item for a given project.
+             - Given the keywords of the question (QueryProcessor.generate_query), only the items matching one of them
+               (`text ~` JQL, at most QUERY_MAX_RESULTS, in pages of at most PAGE_SIZE) are fetched.
+             - If that finds fewer than MIN_QUERY_HITS items, fails, or without keywords, all the items of the project
+               are used.
+         search_candidates: Get the stories of the items matching the keywords of the question.
+         refresh: Update the cached items and stories of the project.
+             - The first refresh (and one every FULL_REFRESH_INTERVAL seconds, to drop deleted items) fetches all items.
+             - Other refreshes only fetch the items updated since the previous refresh (`updated >= -Nm` JQL).
+             - Refreshes less than REFRESH_INTERVAL seconds apart are skipped.
+             - corpus_version is incremented whenever a refresh finds new, changed or deleted items.
+         revalidate: Check whether the project changed since answers were cached for it (incrementing corpus_version).
+             - Once all items of the project were fetched, same as refresh.
+             - Before that (only keyword searches so far) nothing is downloaded: one `updated >= -Nm` JQL count of the
+               items updated since the previous check, at most every REFRESH_INTERVAL seconds.
+         search_items: Get metadata about each item matching a JQL query. The first page tells the total, the other
+                       pages are then requested concurrently by MAX_WORKERS threads and yielded as they arrive.
+         search_items_page: Get one page of items matching a JQL query.
          extract_passages: Extract required fields from the object, parse it and return a list of strings.
     """
 
@@ -259,37 +353,110 @@ class JiraDocumentRetriever():
         self.userName = username
         self.token = token
         self.domain = domain
+        self.base_url = jira['BASE_URL'].format(domain=domain)
         self.projectKey = projectkey
         self.fields = jira['FIELDS']
+        self.page_size = jira['PAGE_SIZE']
+        self.max_workers = jira['MAX_WORKERS']
+        self.refresh_interval = jira['REFRESH_INTERVAL']
+        self.full_refresh_interval = jira['FULL_REFRESH_INTERVAL']
+        self.query_mode = jira['QUERY_MODE']
+        self.query_max_results = jira['QUERY_MAX_RESULTS']
+        self.min_query_hits = jira['MIN_QUERY_HITS']
         self.invalid = False
+        self.http = get_http_client()
+        self.corpus_id = uuid.uuid4().hex
+        self.corpus_version = 0
+
+        # items and their stories by item key, kept up to date by refresh
+        self.issues = {}
+        self.stories = {}
+        self.last_refresh = None
+        self.last_full_refresh = None
+        self.last_check = time.monotonic()
+        self.total = None
+        self.lock = threading.Lock()
+
         self.validate()
 
     def validate(self):
-        url = 'https://' + self.domain + '.atlassian.net//rest/api/2/search?jql=project=' + self.projectKey + '&maxResults=0'
-        requestResponse = requests.get(url, auth=(self.userName, self.token))
-        if requestResponse.ok is False:
-            self.invalid = True
-
-    def get_total_items(self):
-        url = 'https://' + self.domain + '.atlassian.net//rest/api/2/search?jql=project=' + self.projectKey + '&maxResults=0'
-
-        response = requests.get(url, auth=(self.userName, self.token))
+        url = self.base_url + '/rest/api/2/search?jql=project=' + self.projectKey + '&maxResults=0'
+        requestResponse = self.http.get(url, auth=(self.userName, self.token))
+        self.invalid = requestResponse.ok is False
+
+    def search_items_page(self, jql, start, max_results=None):
+        url = self.base_url + '/rest/api/2/search'
+        params = {'jql': jql, 'startAt': start, 'maxResults': self.page_size if max_results is None else max_results}
+        if self.fields:
+            params['fields'] = self.fields
+
+        response = self.http.get(url, params=params, auth=(self.userName, self.token))
+        response.raise_for_status()
         response.encoding = 'utf8'
-        json_data = json.loads(response.text)
-
-        return json_data['total']
-
-    def search_items(self, total):
-        suffix = '&fields=' + self.fields if self.fields else ''
-        url = 'https://' + self.domain + '.atlassian.net//rest/api/2/search?jql=project=' + self.projectKey + suffix + '&maxResults=1000&startAt='
-
-        for startIndex in range(0, total, 1000):
-            new_url = url + str(startIndex)
-            response = requests.get(new_url, auth=(self.userName, self.token))
-            response.encoding = 'utf8'
 
         return json.loads(response.text)
 
+    def search_items(self, jql):
+        first = self.search_items_page(jql, 0)
+        yield first
+
+        # the server may return fewer items per page than asked for
+        page_size = first['maxResults'] or self.page_size
+        starts = range(len(first['issues']), first['total'], page_size)
+        if not starts:
+            return
+
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            pages = [executor.submit(self.search_items_page, jql, start) for start in starts]
+            for page in as_completed(pages):
+                yield page.result()
+
+    def refresh(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.last_refresh is not None and now - self.last_refresh < self.refresh_interval:
+                return
+
+            jql = 'project=' + self.projectKey
+            full = self.last_full_refresh is None or now - self.last_full_refresh >= self.full_refresh_interval
+            if full:
+                issues, stories = {}, {}
+            else:
+                # relative dates do not depend on the timezone of the user, one extra minute covers the rounding
+                minutes = int((now - self.last_refresh) // 60) + 2
+                jql += ' AND updated >= -' + str(minutes) + 'm'
+                issues, stories = dict(self.issues), dict(self.stories)
+
+            # stories are created while the remaining pages are still being fetched
+            for page in self.search_items(jql):
+                for issue in page['issues']:
+                    issues[issue['key']] = issue
+                    stories[issue['key']] = self.create_story(issue)
+
+            if stories != self.stories:
+                self.corpus_version += 1
+            self.issues, self.stories = issues, stories
+            self.total = len(stories)
+            self.last_refresh = now
+            if full:
+                self.last_full_refresh = now
+
+    def revalidate(self):
+        with self.lock:
+            if self.last_full_refresh is None:
+                now = time.monotonic()
+                if now - self.last_check < self.refresh_interval:
+                    return
+
+                minutes = int((now - self.last_check) // 60) + 2
+                jql = 'project=' + self.projectKey + ' AND updated >= -' + str(minutes) + 'm'
+                if self.search_items_page(jql, 0, 0)['total']:
+                    self.corpus_version += 1
+                self.last_check = now
+                return
+
+        self.refresh()
+
     def extract_passages(self, obj):
         fieldMap = {
             'creator': 'created by',
@@ -348,8 +515,10 @@ class JiraDocumentRetriever():
     def create_story(self, obj):
         fields = obj['fields']
         assigned_to = fields['assignee']['displayName'] if fields['assignee'] is not None else 'No One'
-        sprint_name = fields['customfield_10020'][0]['name'] if len(fields['customfield_10020']) != 0 else 'no'
-        sprint_state = fields['customfield_10020'][0]['state'] if fields['customfield_10020'] != 0 else 'not defined'
+        # the sprint field is an empty list or null for issues outside of any sprint
+        sprints = fields['customfield_10020'] or []
+        sprint_name = sprints[0]['name'] if sprints else 'no'
+        sprint_state = sprints[0]['state'] if sprints else 'not defined'
         parent_issue = fields['parent']['fields']['summary'] if 'parent' in fields.keys() else 'None'
         subtasks = fields['subtasks']
         story = f'''
@@ -391,23 +560,58 @@ class JiraDocumentRetriever():
             story += subtask_story
         return story
 
-    def create_stories(self, objs):
+    def create_stories(self, stories=None):
+        if stories is None:
+            stories = list(self.stories.values())
         docs = []
-        txt = 'maxResults: ' + str(objs['maxResults']) + ', '
-        txt = 'There are total ' + str(objs['total']) + ' tasks in the project ' + self.projectKey + '.'
+        txt = 'There are total ' + str(self.total) + ' tasks in the project ' + self.projectKey + '.'
         docs.append(txt)
 
-        for obj in objs['issues']:
-            docs.append(self.create_story(obj))
+        docs.extend(stories)
         return docs
 
-    def search(self, question):
+    def search_candidates(self, query):
+        # quotes and JQL / lucene operators in the keywords would break the query
+        terms = list(dict.fromkeys(re.findall(r'\w+', query.lower())))
+        if not terms:
+            return []
+
+        text = ' OR '.join('text ~ "' + term + '"' for term in terms)
+        jql = 'project=' + self.projectKey + ' AND (' + text + ')'
+
+        # Jira Cloud returns at most 100 items per page, whatever maxResults asks for
+        issues = []
+        while len(issues) < self.query_max_results:
+            page = self.search_items_page(jql, len(issues), min(self.page_size, self.query_max_results - len(issues)))
+            issues.extend(page['issues'])
+            if not page['issues'] or len(issues) >= page['total']:
+                break
+
+        if self.total is None:
+            total = self.search_items_page('project=' + self.projectKey, 0, 0)['total']
+            with self.lock:
+                if self.total is None:
+                    self.total = total
+
+        return [self.create_story(issue) for issue in issues[:self.query_max_results]]
+
+    def search(self, question, query=None):
         docs = []
         if self.invalid:
             return docs
-        total_items = self.get_total_items()
-        objs = self.search_items(total_items)
-        docs = self.create_stories(objs)
+
+        if self.query_mode and query:
+            try:
+                stories = self.search_candidates(query)
+            except (requests.RequestException, ValueError):
+                logger.warning('Jira keyword search of %s failed, using all of its items', self.projectKey,
+                               exc_info=True)
+                stories = []
+            if len(stories) >= self.min_query_hits:
+                return self.create_stories(stories)
+
+        self.refresh()
+        docs = self.create_stories()
         return docs
     
     
@@ -418,124 +622,235 @@ class BitBucketRetriever():
     """
     This class is for retrieving Documents from BitBuckets API and returing the data (objects - commits, issues, branches, workspaces, repositories etc.) in the form of stories.
 
-    search_issues: Search for all the issues from a given repository of a given workspace and create a story from each issue object. These stories will be returned as a list of strings.
+    search: Refresh the issues and commits of the repository and return their stories.
+    refresh: Refresh the issues and commits of the repository concurrently - corpus_version is incremented whenever they change.
+    search_issues: Return the stories of all the issues of the repository, and one story with the number of issues per assignee. These stories will be returned as a list of strings.
+    search_commits: Return the stories of all the commits of the repository.
+    refresh_issues: Update the stored issues - all of them on the first refresh (and every FULL_REFRESH_INTERVAL seconds, to drop deleted issues), otherwise only the ones updated since the newest stored issue (`updated_on >` query). Return whether the issues changed.
+    refresh_commits: Update the stored commits - new commits are fetched until a page holds only known commits. Return whether the commits changed.
+    search_values: Follow the `next` links of a paginated listing and yield the values of one page at a time.
+    probe: Request the first entry of a listing with the ETag of the previous probe (If-None-Match). When the server answers 304 Not Modified the listing did not change, so an unchanged repository costs one cheap request per refresh.
     """
   
-    def __init__(self, username, password, domain, projectkey):
+    def __init__(self, username, password, bitbucket, domain, projectkey):
         self.userName = username
         self.password = password
         self.workspace = domain
+        self.api_url = bitbucket['API_URL']
         self.repository = projectkey
+        self.page_len = bitbucket['PAGE_LEN']
+        self.full_refresh_interval = bitbucket['FULL_REFRESH_INTERVAL']
         self.invalid = False
+        self.http = get_http_client()
+        self.corpus_id = uuid.uuid4().hex
+        self.corpus_version = 0
+
+        # issues by id and commits by hash (newest first), with their stories
+        self.issues = {}
+        self.issue_stories = {}
+        self.commits = {}
+        self.commit_stories = {}
+        self.etags = {}
+        self.last_full_refresh = {}
+        self.lock = threading.Lock()
+
         self.validate()
     
     def validate(self):
-        requestUrl = f"https://api.bitbucket.org/2.0/repositories/{self.workspace}/{self.repository}/issues"
-        requestResponse = requests.get(requestUrl, auth=(self.userName, self.password))
-        if requestResponse.ok is False:
-            self.invalid = True
+        requestUrl = f"{self.api_url}/repositories/{self.workspace}/{self.repository}/issues"
+        requestResponse = self.http.get(requestUrl, auth=(self.userName, self.password))
+        self.invalid = requestResponse.ok is False
 
     def search_all_repositories(self, workspace):
-        requestUrl = f"https://api.bitbucket.org/2.0/repositories/{workspace}/"
-        repo_response = requests.get(requestUrl, auth=(self.userName, self.password))
+        requestUrl = f"{self.api_url}/repositories/{workspace}/"
+        repo_response = self.http.get(requestUrl, auth=(self.userName, self.password))
         repositories = repo_response.json()
         return repositories
 
     def search_all_workspaces(self):
-        requestUrl = f"https://api.bitbucket.org/2.0/workspaces/"
-        workspaces = requests.get(requestUrl, auth=(self.userName, self.password))
+        requestUrl = f"{self.api_url}/workspaces/"
+        workspaces = self.http.get(requestUrl, auth=(self.userName, self.password))
         workspaces = workspaces.json()
         return workspaces
 
     def search_all_branches(self, workspace, repository):
-        requestUrl = f"https://api.bitbucket.org/2.0/repositories/{workspace}/{repository}/refs/branches/"
-        branches = requests.get(requestUrl, auth=(self.userName, self.password))
+        requestUrl = f"{self.api_url}/repositories/{workspace}/{repository}/refs/branches/"
+        branches = self.http.get(requestUrl, auth=(self.userName, self.password))
         branches = branches.json()
         return branches
 
-    def search_issues(self):
-        requestUrl = f"https://api.bitbucket.org/2.0/repositories/{self.workspace}/{self.repository}/issues"
-        requestResponse = requests.get(requestUrl, auth=(self.userName, self.password))
-        objs = requestResponse.json()
+    def search_values(self, requestUrl, params=None):
+        while requestUrl:
+            requestResponse = self.http.get(requestUrl, params=params, auth=(self.userName, self.password))
+            requestResponse.raise_for_status()
+            page = requestResponse.json()
+            yield page['values']
 
-        assignee_dict = {}
-        total_issues = objs['size']
+            # the next link already carries the query parameters
+            requestUrl = page.get('next')
+            params = None
 
-        issue_docs = []
-        for obj in objs['values']:
-            assignee = obj['assignee']['display_name'] if obj['assignee'] else 'None'
+    def probe(self, name, requestUrl, params=None):
+        params = dict(params or {}, pagelen=1)
+        headers = {'If-None-Match': self.etags[name]} if name in self.etags else {}
+        requestResponse = self.http.get(requestUrl, params=params, headers=headers, auth=(self.userName, self.password))
+        if requestResponse.status_code == 304:
+            return False, self.etags[name]
 
-            if (assignee in assignee_dict.keys()):
-                assignee_dict[assignee] = assignee_dict[assignee] + 1
-            else:
-                assignee_dict[assignee] = 1
+        requestResponse.raise_for_status()
+        return True, requestResponse.headers.get('ETag')
 
-            created_meta = obj['created_on'].split('T')
-            created_date = created_meta[0]
-            created_time = created_meta[1].split('.')[0]
+    def needs_full_refresh(self, name):
+        last = self.last_full_refresh.get(name)
+        return last is None or time.monotonic() - last >= self.full_refresh_interval
 
-            updated_meta = obj['created_on'].split('T')
-            updated_date = updated_meta[0]
-            updated_time = updated_meta[1].split('.')[0]
+    def create_issue_story(self, obj):
+        assignee = obj['assignee']['display_name'] if obj['assignee'] else 'None'
 
-            issue_type = obj['kind']
-            issue_title = obj['title']
-            reporter_name = obj['reporter']['display_name']
-            votes = obj['votes']
-            watches = obj['watches']
-            status = obj['state']
-            repo_name = obj['repository']['name']
-            priority = obj['priority']
+        created_meta = obj['created_on'].split('T')
+        created_date = created_meta[0]
+        created_time = created_meta[1].split('.')[0]
 
-            issue_story = f"A {issue_type} {issue_title} was reported by {reporter_name}. This {issue_type} was reported on {created_date} at {created_time}. This {issue_type} is assigned to {assignee}. It has {votes} number of votes and {watches} number of watches. It was last updated on {updated_date} at {updated_time}. Currently, this {issue_type} is in {status} state. It belongs to {repo_name} repository. The priority of this {issue_type} is {priority}."
+        updated_meta = obj['created_on'].split('T')
+        updated_date = updated_meta[0]
+        updated_time = updated_meta[1].split('.')[0]
 
-            if obj['content']:
-                issue_story += ' Description: ' + obj['content']['raw']
+        issue_type = obj['kind']
+        issue_title = obj['title']
+        reporter_name = obj['reporter']['display_name']
+        votes = obj['votes']
+        watches = obj['watches']
+        status = obj['state']
+        repo_name = obj['repository']['name']
+        priority = obj['priority']
 
-            issue_docs.append(issue_story)
+        issue_story = f"A {issue_type} {issue_title} was reported by {reporter_name}. This {issue_type} was reported on {created_date} at {created_time}. This {issue_type} is assigned to {assignee}. It has {votes} number of votes and {watches} number of watches. It was last updated on {updated_date} at {updated_time}. Currently, this {issue_type} is in {status} state. It belongs to {repo_name} repository. The priority of this {issue_type} is {priority}."
 
-        issue_story = f"Total {total_issues} issues are there in {self.repository}. "
+        if obj['content']:
+            issue_story += ' Description: ' + obj['content']['raw']
 
-        for key, value in assignee_dict.items():
-            issue_story += f"{value} issues have been assigned to {key} in repository named {self.repository}. "
+        return issue_story
 
-        issue_docs.append(issue_story)
+    def create_commit_story(self, obj):
+        message = obj['message'].strip()
 
-        return issue_docs
+        created_meta = obj['date'].split('T')
+        created_date = created_meta[0]
+        created_time = created_meta[1].split('+')[0]
 
+        repo_name = obj['repository']['name']
 
-    def search_commits(self):
-        requestUrl = f"https://api.bitbucket.org/2.0/repositories/{self.workspace}/{self.repository}/commits"
-        requestResponse = requests.get(requestUrl, auth=(self.userName, self.password))
-        objs = requestResponse.json()
+        author_meta = obj['author']['raw'].split('<')
+        author_name = author_meta[0][:-1]
+        author_mailID = author_meta[1][:-1]
+
+        commit_hash = obj['hash']
+        parent_hash = obj['parents'][0]['hash'] if len(obj['parents']) > 0 else 'does not exist'
 
-        commit_docs = []
-        for obj in objs['values']:
-            message = obj['message'].strip()
+        commit_story = f"The commit {message} was done by {author_name} on {created_date} at {created_time}. The author of this commit is {author_name}. {author_name}'s mail is {author_mailID}. The hash of this commit is {commit_hash}. The hash of the parent commit of the commit {message} is {parent_hash}. This commit belongs to {repo_name} repository."
+        return commit_story
 
-            created_meta = obj['date'].split('T')
-            created_date = created_meta[0]
-            created_time = created_meta[1].split('+')[0]
+    def refresh_issues(self):
+        requestUrl = f"{self.api_url}/repositories/{self.workspace}/{self.repository}/issues"
+        changed, etag = self.probe('issues', requestUrl, {'sort': '-updated_on'})
+        full = self.needs_full_refresh('issues')
+        if not changed and not full:
+            return False
 
-            repo_name = obj['repository']['name']
+        params = {'pagelen': self.page_len}
+        if full:
+            issues, stories = {}, {}
+            started = time.monotonic()
+        else:
+            issues, stories = dict(self.issues), dict(self.issue_stories)
+            if issues:
+                params['q'] = 'updated_on > ' + max(obj['updated_on'] for obj in issues.values())
+
+        for values in self.search_values(requestUrl, params):
+            for obj in values:
+                issues[obj['id']] = obj
+                stories[obj['id']] = self.create_issue_story(obj)
+
+        changed = stories != self.issue_stories
+        self.issues, self.issue_stories = issues, stories
+        self.etags['issues'] = etag
+        if full:
+            self.last_full_refresh['issues'] = started
+        return changed
+
+    def refresh_commits(self):
+        requestUrl = f"{self.api_url}/repositories/{self.workspace}/{self.repository}/commits"
+        changed, etag = self.probe('commits', requestUrl)
+        full = self.needs_full_refresh('commits')
+        if not changed and not full:
+            return False
+
+        started = time.monotonic()
+        known = {} if full else self.commits
+        commits, stories = {}, {}
+        for values in self.search_values(requestUrl, {'pagelen': self.page_len}):
+            new_values = [obj for obj in values if obj['hash'] not in known]
+            for obj in new_values:
+                commits[obj['hash']] = obj
+                stories[obj['hash']] = self.create_commit_story(obj)
+            if known and not new_values:
+                break
+
+        # new commits come first, like in the listing
+        if not full:
+            commits.update(self.commits)
+            stories.update(self.commit_stories)
+
+        changed = stories != self.commit_stories
+        self.commits, self.commit_stories = commits, stories
+        self.etags['commits'] = etag
+        if full:
+            self.last_full_refresh['commits'] = started
+        return changed
+
+    def refresh(self):
+        with self.lock, ThreadPoolExecutor(2) as executor:
+            refreshes = [executor.submit(self.refresh_issues), executor.submit(self.refresh_commits)]
+            if any([refresh.result() for refresh in refreshes]):
+                self.corpus_version += 1
+
+    def search_issues(self):
+        issues = self.issues
+        assignee_dict = {}
+        total_issues = len(issues)
+
+        for obj in issues.values():
+            assignee = obj['assignee']['display_name'] if obj['assignee'] else 'None'
+
+            if (assignee in assignee_dict.keys()):
+                assignee_dict[assignee] = assignee_dict[assignee] + 1
+            else:
+                assignee_dict[assignee] = 1
 
-            author_meta = obj['author']['raw'].split('<')
-            author_name = author_meta[0][:-1]
-            author_mailID = author_meta[1][:-1]
+        issue_docs = list(self.issue_stories.values())
 
-            commit_hash = obj['hash']
-            parent_hash = obj['parents'][0]['hash'] if len(obj['parents']) > 0 else 'does not exist'
+        issue_story = f"Total {total_issues} issues are there in {self.repository}. "
+
+        for key, value in assignee_dict.items():
+            issue_story += f"{value} issues have been assigned to {key} in repository named {self.repository}. "
 
-            commit_story = f"The commit {message} was done by {author_name} on {created_date} at {created_time}. The author of this commit is {author_name}. {author_name}'s mail is {author_mailID}. The hash of this commit is {commit_hash}. The hash of the parent commit of the commit {message} is {parent_hash}. This commit belongs to {repo_name} repository."
-            commit_docs.append(commit_story)
+        issue_docs.append(issue_story)
 
+        return issue_docs
+
+
+    def search_commits(self):
+        commit_docs = list(self.commit_stories.values())
         return commit_docs
 
 
-    def search(self, question):
+    def search(self, question, query=None):
         docs = []
         if self.invalid:
             return docs
+
+        self.refresh()
+
         issue_docs = self.search_issues()
         commit_docs = self.search_commits()
         docs.extend(issue_docs)
@@ -0,0 +1,120 @@
+import email.utils
+import http.cookiejar
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import config
+
+
+logger = logging.getLogger(__name__)
+
+
+class HttpClient:
+    """
+      HTTP client shared by the document retrievers, so that calls to the same host reuse keep-alive connections
+      instead of paying for a TCP and TLS handshake each.
+
+      Every host gets its own requests.Session with a pool of POOL_SIZE connections and a semaphore that lets at
+      most MAX_PER_HOST requests of the process run against it at the same time. Requests that fail with a
+      connection error, a timeout, 429 or a 5xx status are retried up to MAX_RETRIES times, after the Retry-After
+      delay of the response (at most MAX_RETRY_AFTER seconds) or a jittered exponential backoff. Credentials are
+      given per request and the sessions do not keep cookies, so a session can be shared by every user of a host.
+
+      get: Send a GET request, return the response - like requests.get, with the default timeouts of the client.
+      request: Send a request with the given method.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, http):
+        self.timeout = (http['CONNECT_TIMEOUT'], http['READ_TIMEOUT'])
+        self.pool_size = http['POOL_SIZE']
+        self.max_per_host = http['MAX_PER_HOST']
+        self.max_retries = http['MAX_RETRIES']
+        self.backoff_base = http['BACKOFF_BASE']
+        self.backoff_max = http['BACKOFF_MAX']
+        self.max_retry_after = http['MAX_RETRY_AFTER']
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def host(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.hosts:
+                session = requests.Session()
+                session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self.hosts[host] = (session, threading.BoundedSemaphore(self.max_per_host))
+            return self.hosts[host]
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def retry_after(self, response):
+        value = response.headers.get('Retry-After')
+        if value is None:
+            return None
+
+        if value.strip().isdigit():
+            delay = int(value)
+        else:
+            try:
+                delay = email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+        return min(max(delay, 0), self.max_retry_after)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        session, semaphore = self.host(url)
+
+        attempt = 0
+        while True:
+            try:
+                with semaphore:
+                    response = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt)
+                reason = type(e).__name__
+            else:
+                if response.status_code not in self.RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+                delay = self.retry_after(response)
+                if delay is None:
+                    delay = self.backoff(attempt)
+                reason = response.status_code
+                response.close()
+
+            attempt += 1
+            logger.info('Retrying %s %s (%s) in %.1f sec, attempt %d/%d', method, urlsplit(url).path, reason, delay,
+                        attempt, self.max_retries)
+            time.sleep(delay)
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_http_client():
+    """
+        Returns the HttpClient shared by every retriever of this process, configured by the HTTP config variable.
+    """
+
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = HttpClient(config.HTTP)
+    return _shared
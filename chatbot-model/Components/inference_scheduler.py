@@ -0,0 +1,127 @@
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceScheduler:
+    """
+      Micro-batching of QA model inputs across concurrent requests.
+
+      Requests submit their features (one per passage window) to a shared queue and wait on a future per feature.
+      A single worker thread takes the oldest feature, waits at most `max_wait` seconds for more to arrive, and runs
+      up to `max_batch_size` features - of any request - through `forward` in one padded batch. The start and end
+      logits of every feature are routed back to its future. Running the model on one thread also keeps concurrent
+      requests from competing for the cores with their own small batches.
+
+      Threads do not survive fork(), so a scheduler created before a fork (see serve.py) is started again, with an
+      empty queue and statistics, in the child process.
+
+      submit: Queue features, return one future per feature resolving to its (start_logits, end_logits).
+      metrics: Return throughput, batch size and queueing delay statistics.
+      close: Stop the worker thread.
+    """
+
+    def __init__(self, forward, max_batch_size, max_wait, name='inference-scheduler'):
+        self.forward = forward
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.name = name
+
+        self.start()
+        os.register_at_fork(after_in_child=self.start)
+
+    def start(self):
+        self.queue = queue.Queue()
+
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.items = 0
+        self.batches = 0
+        self.busy = 0.0
+        self.delays = deque(maxlen=1024)
+
+        self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def submit(self, features):
+        now = time.monotonic()
+        futures = []
+        for feature in features:
+            future = Future()
+            self.queue.put((feature, future, now))
+            futures.append(future)
+        return futures
+
+    def next_batch(self):
+        item = self.queue.get()
+        if item is None:
+            return None
+
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # stop after this batch
+                self.queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                return
+
+            started = time.monotonic()
+            try:
+                start_logits, end_logits = self.forward([feature for feature, _, _ in batch])
+            except Exception as e:
+                logger.exception('Inference of a batch of %d features failed', len(batch))
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            for row, (_, future, _) in enumerate(batch):
+                future.set_result((start_logits[row], end_logits[row]))
+
+            finished = time.monotonic()
+            with self.lock:
+                self.items += len(batch)
+                self.batches += 1
+                self.busy += finished - started
+                self.delays.extend(started - enqueued for _, _, enqueued in batch)
+
+    def metrics(self):
+        with self.lock:
+            uptime = time.monotonic() - self.started
+            delays = np.array(self.delays) if self.delays else np.zeros(1)
+            return {
+                'items': self.items,
+                'batches': self.batches,
+                'queued': self.queue.qsize(),
+                'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+                'items_per_sec': self.items / uptime if uptime else 0.0,
+                'items_per_busy_sec': self.items / self.busy if self.busy else 0.0,
+                'utilization': self.busy / uptime if uptime else 0.0,
+                'queue_delay_p50': float(np.percentile(delays, 50)),
+                'queue_delay_p95': float(np.percentile(delays, 95)),
+                'queue_delay_max': float(delays.max()),
+            }
+
+    def close(self):
+        self.queue.put(None)
@@ -0,0 +1,250 @@
+import bisect
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import config
+
+
+logger = logging.getLogger(__name__)
+
+# Shared instance, created on first use
+_registry = None
+_lock = threading.Lock()
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, escape(value)) for name, value in pairs) + '}'
+
+
+class Metric:
+    """
+      Values of a metric per combination of label values. A label that is not given is an empty string.
+    """
+
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+
+class Counter(Metric):
+    """
+      Monotonic count per combination of label values.
+
+      inc: Add amount (1 by default) to the count of the given labels.
+      render: Return the Prometheus text exposition lines of the counter.
+    """
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        with self.lock:
+            values = dict(self.values)
+        return ['{}{} {}'.format(self.name, format_labels(self.labelnames, key), value)
+                for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    """
+      Distribution of observed values (durations in seconds) per combination of label values, as cumulative
+      counts of values up to every bucket bound, plus their sum and count.
+
+      observe: Record a value for the given labels.
+      render: Return the Prometheus text exposition lines of the histogram.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=()):
+        super().__init__(name, help, labelnames)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    def render(self):
+        with self.lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self.values.items()}
+
+        lines = []
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ['+Inf'], counts):
+                cumulative += count
+                le = bound if bound == '+Inf' else repr(float(bound))
+                lines.append('{}_bucket{} {}'.format(self.name, format_labels(self.labelnames, key, [('le', le)]),
+                                                     cumulative))
+            lines.append('{}_sum{} {}'.format(self.name, format_labels(self.labelnames, key), total))
+            lines.append('{}_count{} {}'.format(self.name, format_labels(self.labelnames, key), cumulative))
+        return lines
+
+
+class MetricsRegistry:
+    """
+      In-process metrics, rendered in the Prometheus text exposition format for a /metrics endpoint.
+
+      counter / histogram: Return the metric of that name, created on first use.
+      collector: Register a function returning a (possibly nested) dictionary of numbers, exported as gauges
+                 named prefix_key every time the metrics are rendered - for statistics kept elsewhere, like the
+                 inference scheduler metrics.
+      render: Return all metrics as text.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.metrics = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def get(self, cls, name, help, labelnames, **kwargs):
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = cls(name, help, labelnames, **kwargs)
+            return self.metrics[name]
+
+    def counter(self, name, help, labelnames=()):
+        return self.get(Counter, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=None):
+        return self.get(Histogram, name, help, labelnames, buckets=self.buckets if buckets is None else buckets)
+
+    def collector(self, prefix, function):
+        with self.lock:
+            self.collectors.append((prefix, function))
+
+    @staticmethod
+    def flatten(prefix, values):
+        for key, value in values.items():
+            name = prefix + '_' + str(key)
+            if isinstance(value, dict):
+                yield from MetricsRegistry.flatten(name, value)
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield name, value
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+            collectors = list(self.collectors)
+
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            lines.extend(metric.render())
+
+        for prefix, function in collectors:
+            try:
+                values = list(self.flatten(prefix, function()))
+            except Exception:
+                logger.exception('Metrics collector %s failed', prefix)
+                continue
+            for name, value in values:
+                lines.append('# TYPE {} gauge'.format(name))
+                lines.append('{} {}'.format(name, value))
+
+        return '\n'.join(lines) + '\n'
+
+
+class Trace:
+    """
+      Timings and counts of one request, identified by a random trace id that is returned with the response.
+      Every stage timed by the trace is also observed by the stage histogram of the registry.
+
+      span: Context manager timing a stage, optionally of one source.
+      record: Record the duration of a stage timed elsewhere.
+      count: Add to a count of the request (documents, passages, answers).
+      summary: Return the trace id, the stages and the counts as a dictionary.
+      finish: Observe the total duration of the request and log its summary (at WARNING level when it took more
+              than SLOW_TRACE seconds). Only the first call counts, the result of the request is kept in `result`.
+    """
+
+    def __init__(self, registry):
+        self.trace_id = uuid.uuid4().hex
+        self.started = time.monotonic()
+        self.stages = registry.histogram('chatbot_stage_duration_seconds',
+                                         'Duration of a stage of answering a question', ('stage', 'source'))
+        self.queries = registry.histogram('chatbot_query_duration_seconds',
+                                          'Duration of answering a question', ('result',))
+        self.spans = []
+        self.counts = {}
+        self.result = None
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage, source=None):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(stage, time.monotonic() - started, source)
+
+    def record(self, stage, seconds, source=None):
+        self.stages.observe(seconds, stage=stage, source=source or '')
+        with self.lock:
+            self.spans.append((stage, source, seconds))
+
+    def count(self, name, amount):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def summary(self):
+        with self.lock:
+            spans = list(self.spans)
+            counts = dict(self.counts)
+        return {
+            'trace_id': self.trace_id,
+            'stages': [{'stage': stage, 'source': source, 'ms': round(seconds * 1000, 1)}
+                       for stage, source, seconds in spans],
+            'counts': counts,
+        }
+
+    def finish(self, result):
+        with self.lock:
+            if self.result is not None:
+                return
+            self.result = result
+
+        seconds = time.monotonic() - self.started
+        self.queries.observe(seconds, result=result)
+
+        level = logging.WARNING if seconds >= config.METRICS['SLOW_TRACE'] else logging.DEBUG
+        if logger.isEnabledFor(level):
+            logger.log(level, 'Trace %s (%s) took %.3f sec: %s', self.trace_id, result, seconds, self.summary())
+
+
+def get_metrics():
+    """
+        Returns the MetricsRegistry shared by all components of this process.
+    """
+
+    global _registry
+    with _lock:
+        if _registry is None:
+            _registry = MetricsRegistry(config.METRICS['BUCKETS'])
+    return _registry
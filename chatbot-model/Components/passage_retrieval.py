@@ -1,4 +1,13 @@
-from gensim.summarization.bm25 import BM25
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+import config
+from Components.bm25_index import BM25Index
+from Components.dense_index import DenseIndex, load_encoder
+from Components.token_cache import get_token_cache
 
 
 class PassageRetrieval:
@@ -22,28 +31,123 @@ class PassageRetrieval:
 
     where, N = total number of docs in the collection,
            n(qi) = number of docs containing qi
+
+    Passages are kept in a persistent BM25Index keyed by a hash of their text, so fit only tokenizes and indexes
+    the passages it has not seen before. The collection used for IDF and avgDL is still the docs given to fit.
+    The index holds at most PASSAGE_INDEX['MAX_DOCS'] passages, the least recently fitted ones are removed first,
+    and save() writes it to PASSAGE_INDEX['PATH'] to be memory-mapped on the next start.
+
+    Optionally (PASSAGE_INDEX['DENSE']['ENABLED'], requires sentence-transformers) the passages are also embedded by
+    a small sentence encoder when they are first fitted and kept in a DenseIndex (float16 or int8, saved to the
+    'dense' directory of the index). most_similar then takes the top CANDIDATES passages of both BM25 and cosine
+    similarity, rescales both scores to [0, 1] and ranks the candidates by
+        WEIGHT * dense score + (1 - WEIGHT) * BM25 score
+    so that passages which share few words with the question but answer it still reach the AnswerExtractor.
   """
   
   # Initialize tokenize function 
   def __init__(self, nlp):
-    # pass the given text though the Spacy NLP pipeline and extract the lemma of each token
-    self.tokenize = lambda text: [token.lemma_ for token in nlp(text)]
-    self.bm25 = None
+    # pass the given text though the Spacy NLP pipeline and extract the lemma of each token,
+    # the lemmas are cached by the TokenCache shared with the other components
+    self.token_cache = get_token_cache(nlp)
+    self.tokenize = self.token_cache.tokenize
+    self.index_path = config.PASSAGE_INDEX['PATH']
+    self.max_docs = config.PASSAGE_INDEX['MAX_DOCS']
+
+    if self.index_path and os.path.exists(os.path.join(self.index_path, 'meta.json')):
+      self.index = BM25Index.load(self.index_path)
+    else:
+      self.index = BM25Index(config.PASSAGE_INDEX['K1'], config.PASSAGE_INDEX['B'])
+
+    self.encoder = None
+    self.dense = None
+    dense = config.PASSAGE_INDEX['DENSE']
+    if dense['ENABLED']:
+      self.encoder = load_encoder(dense['MODEL'])
+
+    if self.encoder is not None:
+      self.dense_path = os.path.join(self.index_path, 'dense') if self.index_path else None
+      self.encode_batch_size = dense['BATCH_SIZE']
+      self.candidates = dense['CANDIDATES']
+      self.weight = dense['WEIGHT']
+
+      if self.dense_path and os.path.exists(os.path.join(self.dense_path, 'meta.json')):
+        self.dense = DenseIndex.load(self.dense_path)
+      if self.dense is None or self.dense.model != dense['MODEL'] or self.dense.dtype != dense['DTYPE']:
+        self.dense = DenseIndex(self.encoder.get_sentence_embedding_dimension(), dense['DTYPE'], dense['MODEL'])
+
+    # indexed passage keys, least recently fitted first
+    self.recent = OrderedDict.fromkeys(self.index.columns)
+    self.subset = None
     self.passages = None
 
-  # Create an instance of BM25 with the given corpus
+  @staticmethod
+  def key(text):
+    return hashlib.sha1(text.encode('utf8')).hexdigest()
+
+  # Add the passages of the given corpus that are not indexed yet and select the corpus for scoring
   def fit(self, docs):
-    corpus = [self.tokenize(p) for p in docs]
-    self.bm25 = BM25(corpus)
-    self.passages = docs
+    keys = [self.key(doc) for doc in docs]
+    passages = dict(zip(keys, docs))
+
+    new_docs = [(key, doc) for key, doc in passages.items() if key not in self.index]
+    corpus = self.token_cache.tokenize_many([doc for _, doc in new_docs])
+    self.index.add((key, tokens) for (key, _), tokens in zip(new_docs, corpus))
+
+    if self.dense is not None:
+      new_dense = [(key, doc) for key, doc in passages.items() if key not in self.dense]
+      if new_dense:
+        embeddings = self.encode([doc for _, doc in new_dense])
+        self.dense.add([key for key, _ in new_dense], embeddings)
+
+    for key in keys:
+      self.recent[key] = None
+      self.recent.move_to_end(key)
+
+    excess = len(self.recent) - self.max_docs
+    if excess > 0:
+      stale = [key for key in self.recent if key not in passages][:excess]
+      for key in stale:
+        del self.recent[key]
+      self.index.remove(stale)
+      if self.dense is not None:
+        self.dense.remove(stale)
+
+    self.subset = self.index.subset(passages)
+    self.passages = passages
+
+  def encode(self, texts):
+    return self.encoder.encode(texts, batch_size=self.encode_batch_size, convert_to_numpy=True)
+
+  @staticmethod
+  def rescale(scores):
+    low, high = scores.min(), scores.max()
+    return (scores - low) / (high - low) if high > low else np.zeros(len(scores))
 
   # Compute the scores of given query in relation to every passage in the corpus and return the top N passages
   def most_similar(self, question, topn=4):
     tokens = self.tokenize(question)
-    average_idf = sum(float(val) for val in self.bm25.idf.values()) / len(self.bm25.idf)
-    scores = self.bm25.get_scores(tokens, average_idf)
-    pairs = [(s, i) for i, s in enumerate(scores)]
-    pairs.sort(reverse=True)
-    passages = [self.passages[i] for _, i in pairs[:topn]]
-    return passages
+    if self.dense is None:
+      return [self.passages[key] for key, _ in self.index.search(tokens, topn, self.subset)]
+
+    candidates = max(topn, self.candidates)
+    lexical = dict(self.index.search(tokens, candidates, self.subset))
+    query = self.encode([question])[0]
+    dense = self.dense.search(query, candidates, self.passages)
+
+    # every candidate gets its exact dense score, BM25 candidates outside the lexical top count as 0
+    keys = list(OrderedDict.fromkeys(list(lexical) + [key for key, _ in dense]))
+    dense_scores = self.dense.score(query, keys)
+    lexical_scores = np.array([lexical.get(key, 0.0) for key in keys])
+    fused = self.weight * self.rescale(dense_scores) + (1 - self.weight) * self.rescale(lexical_scores)
+
+    order = np.argsort(-fused, kind='stable')[:topn]
+    return [self.passages[keys[i]] for i in order]
+
+  # Write the index to PASSAGE_INDEX['PATH']
+  def save(self):
+    if self.index_path:
+      self.index.save(self.index_path)
+      if self.dense is not None:
+        self.dense.save(self.dense_path)
 
@@ -0,0 +1,102 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class PassageWindows:
+    """
+      Content-hash keyed cache of tokenized passages, split into the windows the QA model reads, so that a passage
+      is tokenized and windowed once instead of on every question it is retrieved for.
+
+      A passage is tokenized without special tokens, with the character offsets of its tokens, and split into
+      windows of max_seq_len - max_query_len - 3 tokens. doc_stride is the stride of BERT's run_squad: a window
+      starts every doc_stride tokens (capped at the window length), so consecutive windows overlap by the window
+      length - doc_stride tokens, and the last window ends with the passage. At question time a feature is built
+      for every window by concatenating the (once tokenized, at most max_query_len tokens) question and the
+      window: [CLS] question [SEP] window [SEP] - the input layout of every model in utils.
+      Every window token carries the character offsets of the word it belongs to (the words of the tokenizer's
+      pre-tokenizer, which BERT splits on whitespace and punctuation), so an answer span maps back to whole words
+      of the passage, like word_to_chars in QuestionAnsweringPipeline.
+      At most max_entries passages are kept, the least recently used ones are evicted first.
+
+      windows: Return the (input_ids, offsets) windows of every given passage.
+      features: Return the model features of a question with every window of the given passages.
+    """
+
+    def __init__(self, tokenizer, max_seq_len, max_query_len, doc_stride, max_entries):
+        self.tokenizer = tokenizer
+        self.max_query_len = max_query_len
+        self.window_len = max_seq_len - max_query_len - 3
+        self.step = max(min(doc_stride, self.window_len), 1)
+        self.max_entries = max_entries
+        self.token_type_ids = 'token_type_ids' in tokenizer.model_input_names
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(text):
+        return hashlib.sha1(text.encode('utf8')).hexdigest()
+
+    @staticmethod
+    def word_offsets(offsets, word_ids):
+        spans = {}
+        for (start, end), word in zip(offsets, word_ids):
+            if word is not None:
+                first, last = spans.get(word, (start, end))
+                spans[word] = (min(first, start), max(last, end))
+        return [offset if word is None else spans[word] for offset, word in zip(offsets, word_ids)]
+
+    def split(self, input_ids, offsets):
+        windows = []
+        start = 0
+        while True:
+            end = min(start + self.window_len, len(input_ids))
+            windows.append((input_ids[start:end], offsets[start:end]))
+            if end == len(input_ids):
+                return windows
+            start += self.step
+
+    def windows(self, passages):
+        keys = [self.key(passage) for passage in passages]
+        found = {}
+        missing = OrderedDict()
+
+        with self.lock:
+            for key, passage in zip(keys, passages):
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    found[key] = self.entries[key]
+                else:
+                    missing[key] = passage
+
+        if missing:
+            encodings = self.tokenizer(list(missing.values()), add_special_tokens=False, return_offsets_mapping=True)
+            computed = [(key, self.split(input_ids, self.word_offsets(offsets, encodings.word_ids(i))))
+                        for i, (key, input_ids, offsets)
+                        in enumerate(zip(missing, encodings['input_ids'], encodings['offset_mapping']))]
+
+            with self.lock:
+                for key, windows in computed:
+                    found[key] = windows
+                    self.entries[key] = windows
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+
+        return [found[key] for key in keys]
+
+    def features(self, question, passages):
+        question_ids = self.tokenizer(question, add_special_tokens=False)['input_ids'][:self.max_query_len]
+        prefix = [self.tokenizer.cls_token_id] + question_ids + [self.tokenizer.sep_token_id]
+
+        features = []
+        for passage, windows in enumerate(self.windows(passages)):
+            for input_ids, offsets in windows:
+                features.append({
+                    'passage': passage,
+                    'input_ids': prefix + list(input_ids) + [self.tokenizer.sep_token_id],
+                    'token_type_ids': [0] * len(prefix) + [1] * (len(input_ids) + 1) if self.token_type_ids else None,
+                    'offsets': [(0, 0)] * len(prefix) + list(offsets) + [(0, 0)],
+                    'context': [False] * len(prefix) + [True] * len(input_ids) + [False],
+                })
+
+        return features
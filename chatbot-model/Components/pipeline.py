@@ -0,0 +1,348 @@
+import asyncio
+import functools
+import logging
+import operator
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+import config
+from Components.metrics import Trace, get_metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryPipeline:
+    """
+      Answers a question end to end: query generation, document retrieval, passage retrieval and answer extraction.
+
+      The retrievers make blocking HTTP calls, they run on a pool of IO_WORKERS threads. spaCy, BM25 and the QA
+      model are CPU bound, they run on a separate pool of CPU_WORKERS threads, so a burst of questions cannot
+      starve the event loop or oversubscribe the CPU, and questions waiting on Atlassian or BitBucket do not hold
+      a CPU worker. The passage index is shared by all questions, fitting it and searching it is serialized by a lock.
+
+      Sources are fanned out: every source of the question ("all" = every source) is built and searched at the
+      same time, each within its own deadline (SOURCE_DEADLINES, DEFAULT_DEADLINE seconds for the others). The
+      question is answered from the sources that finished in time, and the response reports the status of every
+      source under 'sources' - 'ok', 'timeout' or 'error'. A source that timed out keeps running in the
+      background, so its retriever is cached (and its documents refreshed) for the next question.
+
+      With an AnswerCache, responses are cached under the normalized question (lemmas, see QueryProcessor) and
+      the corpus id and version of every retriever searched - the corpus id also stands for the source, domain,
+      project and credentials of a retriever. Only complete answers are cached. A question answered from the
+      cache still triggers a background revalidate (refresh for retrievers without it) of the retrievers, so a
+      changed corpus misses the cache the next time, and the ttl of the cache bounds how stale the live lookups
+      of a cached response can get.
+
+      Every question is traced (see Trace): the cache lookup, query generation, building and searching every
+      source, fit, most_similar and extract are timed into the stage histogram of the metrics registry, the numbers
+      of documents fetched per source and of passages scored are counted, and the trace id is returned in the
+      response under 'trace_id'.
+
+      run: Answer a question on the calling thread, return the response dictionary. With inline=True the sources are
+           searched one after the other and the QA model runs on the calling thread too (without the deadlines and
+           the inference scheduler), so that a profiler of that thread sees every stage. With use_cache=False the
+           answer cache is neither read nor written. The stages are timed by the given trace (a new Trace by
+           default), whose summary the caller can print.
+      arun: Answer a question from the event loop - every stage is awaited on its pool, so a question cancelled
+            (for example because the client disconnected) stops before its next stage.
+      astream: Same as arun, but an async generator of (event, data) pairs: 'retrieval' (status of the sources,
+               number of documents, trace id), 'passages' (number of passages selected), one 'answer' per scored passage
+               (flagged 'best' when it beats every answer before it) and finally 'done' with the response of arun.
+      close: Shut the worker pools down.
+    """
+
+    def __init__(self, query_processor, passage_retriever, answer_extractor, get_source_retriever, get_sources, pipeline,
+                 answer_cache=None):
+        self.query_processor = query_processor
+        self.passage_retriever = passage_retriever
+        self.answer_extractor = answer_extractor
+        self.get_source_retriever = get_source_retriever
+        self.get_sources = get_sources
+        self.deadlines = pipeline['SOURCE_DEADLINES']
+        self.default_deadline = pipeline['DEFAULT_DEADLINE']
+        self.io_executor = ThreadPoolExecutor(pipeline['IO_WORKERS'], thread_name_prefix='pipeline-io')
+        self.cpu_executor = ThreadPoolExecutor(pipeline['CPU_WORKERS'], thread_name_prefix='pipeline-cpu')
+        self.passage_lock = threading.Lock()
+        self.answer_cache = answer_cache
+
+        self.metrics = get_metrics()
+        self.documents_fetched = self.metrics.counter('chatbot_documents_fetched_total',
+                                                      'Documents returned by the retrievers', ('source',))
+        self.source_searches = self.metrics.counter('chatbot_source_searches_total',
+                                                    'Source searches by status (ok, timeout, error)', ('source', 'status'))
+        self.passages_scored = self.metrics.counter('chatbot_passages_scored_total',
+                                                    'Passages given to the answer extractor')
+        self.cache_lookups = self.metrics.counter('chatbot_answer_cache_lookups_total',
+                                                  'Answer cache lookups by result (hit, miss)', ('result',))
+
+    def deadline(self, source):
+        return self.deadlines.get(source, self.default_deadline)
+
+    def search_source(self, source, question, query, retriever_args, trace):
+        with trace.span('retriever', source):
+            retriever = self.get_source_retriever(source, *retriever_args)
+        with trace.span('fetch', source):
+            docs = retriever.search(question, query)
+
+        self.documents_fetched.inc(len(docs), source=source)
+        trace.count('documents', len(docs))
+        return docs
+
+    def collect(self, source, future, docs, sources):
+        if not future.done():
+            logger.warning('Source %s did not answer within %s sec', source, self.deadline(source))
+            sources[source] = 'timeout'
+            future.add_done_callback(functools.partial(self.late, source))
+        elif future.exception() is not None:
+            logger.error('Source %s failed', source, exc_info=future.exception())
+            sources[source] = 'error'
+        else:
+            docs.extend(future.result())
+            sources[source] = 'ok'
+        self.source_searches.inc(source=source, status=sources[source])
+
+    @staticmethod
+    def late(source, future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error('Source %s failed in the background', source, exc_info=future.exception())
+
+    def cache_key(self, normalized, doc_retriever_key, retriever_args):
+        versions = []
+        for source in self.get_sources(doc_retriever_key):
+            retriever = self.get_source_retriever(source, *retriever_args, build=False)
+            if retriever is None:
+                return None
+            versions.append((retriever.corpus_id, retriever.corpus_version))
+        return normalized, tuple(versions)
+
+    def refresh_sources(self, doc_retriever_key, retriever_args):
+        for source in self.get_sources(doc_retriever_key):
+            # revalidate checks for changes without downloading a corpus the retriever does not hold (Jira)
+            retriever = self.get_source_retriever(source, *retriever_args, build=False)
+            refresh = getattr(retriever, 'revalidate', None) or getattr(retriever, 'refresh', None)
+            if refresh is not None:
+                self.io_executor.submit(refresh).add_done_callback(functools.partial(self.late, source))
+
+    def lookup(self, question, doc_retriever_key, retriever_args, trace):
+        if self.answer_cache is None:
+            return None, None
+
+        with trace.span('cache'):
+            normalized = self.query_processor.normalize(question)
+            key = self.cache_key(normalized, doc_retriever_key, retriever_args)
+            response = None if key is None else self.answer_cache.get(key)
+
+        self.cache_lookups.inc(result='miss' if response is None else 'hit')
+        if response is not None:
+            self.refresh_sources(doc_retriever_key, retriever_args)
+        return normalized, response
+
+    def store(self, normalized, doc_retriever_key, retriever_args, response):
+        if self.answer_cache is None or response['error'] is not None:
+            return
+        if any(status != 'ok' for status in response['sources'].values()):
+            return
+
+        key = self.cache_key(normalized, doc_retriever_key, retriever_args)
+        if key is not None:
+            self.answer_cache.put(key, response)
+
+    def generate_query(self, question, trace):
+        with trace.span('query'):
+            return self.query_processor.generate_query(question)
+
+    def retrieve_passages(self, question, docs, trace):
+        with self.passage_lock:
+            with trace.span('fit'):
+                self.passage_retriever.fit(docs)
+            with trace.span('most_similar'):
+                passages = self.passage_retriever.most_similar(question)
+
+        self.passages_scored.inc(len(passages))
+        trace.count('passages', len(passages))
+        return passages
+
+    def extract(self, question, passages, trace, inline=False):
+        with trace.span('extract'):
+            answers = self.answer_extractor.extract(question, passages, inline)
+        trace.count('answers', len(answers))
+        return answers
+
+    @staticmethod
+    def strip_code_prefix(answer):
+        if answer['text'].startswith(config.CONFLUENCE['CODE_PREFIX']):
+            answer['answer'] = ' '.join(answer['text'].split(' ')[1:])
+
+    def respond(self, answers, sources):
+        if answers:
+            self.strip_code_prefix(answers[0])
+
+        return {'answers': answers, 'error': None, 'sources': sources}
+
+    @staticmethod
+    def no_documents(sources):
+        if all(status == 'ok' for status in sources.values()):
+            error = 'Invalid username or password! Type /restart to reset username and password.'
+        else:
+            error = 'No source returned documents in time, please try again.'
+        return {'answers': None, 'error': error, 'sources': sources}
+
+    @staticmethod
+    def finish(trace, response, result):
+        response['trace_id'] = trace.trace_id
+        trace.finish(result)
+        return response
+
+    def search_inline(self, source, question, query, retriever_args, trace):
+        future = Future()
+        try:
+            future.set_result(self.search_source(source, question, query, retriever_args, trace))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def run(self, question, doc_retriever_key, *retriever_args, inline=False, use_cache=True, trace=None):
+        trace = Trace(self.metrics) if trace is None else trace
+        normalized, response = None, None
+        if use_cache:
+            normalized, response = self.lookup(question, doc_retriever_key, retriever_args, trace)
+        if response is not None:
+            return self.finish(trace, response, 'cached')
+
+        query = self.generate_query(question, trace)
+
+        if inline:
+            futures = {source: self.search_inline(source, question, query, retriever_args, trace)
+                       for source in self.get_sources(doc_retriever_key)}
+        else:
+            started = time.monotonic()
+            futures = {source: self.io_executor.submit(self.search_source, source, question, query, retriever_args, trace)
+                       for source in self.get_sources(doc_retriever_key)}
+            for source, future in futures.items():
+                wait([future], timeout=max(0, started + self.deadline(source) - time.monotonic()))
+
+        docs, sources = [], {}
+        for source, future in futures.items():
+            self.collect(source, future, docs, sources)
+
+        if len(docs) == 0:
+            return self.finish(trace, self.no_documents(sources), 'no_documents')
+
+        passages = self.retrieve_passages(question, docs, trace)
+        answers = self.extract(question, passages, trace, inline)
+        response = self.respond(answers, sources)
+        if use_cache:
+            self.store(normalized, doc_retriever_key, retriever_args, response)
+        return self.finish(trace, response, 'answered')
+
+    async def io(self, function, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.io_executor, functools.partial(function, *args))
+
+    async def cpu(self, function, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.cpu_executor, functools.partial(function, *args))
+
+    async def fan_out(self, question, query, doc_retriever_key, retriever_args, trace):
+        futures = {source: asyncio.ensure_future(self.io(self.search_source, source, question, query, retriever_args,
+                                                         trace))
+                   for source in self.get_sources(doc_retriever_key)}
+        try:
+            # shield the searches from the deadline, a late source still finishes and warms its retriever
+            await asyncio.gather(*[asyncio.wait([future], timeout=self.deadline(source))
+                                   for source, future in futures.items()])
+        except asyncio.CancelledError:
+            for future in futures.values():
+                future.cancel()
+            raise
+
+        docs, sources = [], {}
+        for source, future in futures.items():
+            self.collect(source, future, docs, sources)
+        return docs, sources
+
+    async def arun(self, question, doc_retriever_key, *retriever_args):
+        trace = Trace(self.metrics)
+        try:
+            normalized, response = await self.cpu(self.lookup, question, doc_retriever_key, retriever_args, trace)
+            if response is not None:
+                return self.finish(trace, response, 'cached')
+
+            query = await self.cpu(self.generate_query, question, trace)
+            docs, sources = await self.fan_out(question, query, doc_retriever_key, retriever_args, trace)
+
+            if len(docs) == 0:
+                return self.finish(trace, self.no_documents(sources), 'no_documents')
+
+            passages = await self.cpu(self.retrieve_passages, question, docs, trace)
+            answers = await self.cpu(self.extract, question, passages, trace)
+        except asyncio.CancelledError:
+            trace.finish('cancelled')
+            raise
+
+        response = self.respond(answers, sources)
+        self.store(normalized, doc_retriever_key, retriever_args, response)
+        return self.finish(trace, response, 'answered')
+
+    async def astream(self, question, doc_retriever_key, *retriever_args):
+        trace = Trace(self.metrics)
+        try:
+            normalized, response = await self.cpu(self.lookup, question, doc_retriever_key, retriever_args, trace)
+            if response is not None:
+                yield 'done', self.finish(trace, response, 'cached')
+                return
+
+            query = await self.cpu(self.generate_query, question, trace)
+            docs, sources = await self.fan_out(question, query, doc_retriever_key, retriever_args, trace)
+            yield 'retrieval', {'sources': sources, 'documents': len(docs), 'trace_id': trace.trace_id}
+
+            if len(docs) == 0:
+                yield 'done', self.finish(trace, self.no_documents(sources), 'no_documents')
+                return
+
+            passages = await self.cpu(self.retrieve_passages, question, docs, trace)
+            yield 'passages', {'passages': len(passages)}
+
+            # passages are scored one at a time, every answer is sent as soon as it is scored - extractors that
+            # can only score all passages at once (the cascade) run on the CPU pool too, then their answers are sent
+            answers = []
+            best = None
+            extracting = 0.0
+            extract = getattr(self.answer_extractor, 'extract_iter', None)
+            if extract is not None:
+                answer_iter = extract(question, passages)
+            else:
+                started = time.monotonic()
+                answer_iter = iter(await self.cpu(self.answer_extractor.extract, question, passages))
+                extracting += time.monotonic() - started
+            while True:
+                started = time.monotonic()
+                answer = await self.cpu(next, answer_iter, None)
+                extracting += time.monotonic() - started
+                if answer is None:
+                    break
+
+                answers.append(answer)
+                self.strip_code_prefix(answer)
+                is_best = best is None or answer['score'] > best['score']
+                if is_best:
+                    best = answer
+                yield 'answer', {'answer': answer, 'best': is_best}
+
+            # only the time spent scoring, not the time the client took to read the answers
+            trace.record('extract', extracting)
+            trace.count('answers', len(answers))
+
+            answers.sort(key=operator.itemgetter('score'), reverse=True)
+            response = self.respond(answers, sources)
+            self.store(normalized, doc_retriever_key, retriever_args, response)
+            yield 'done', self.finish(trace, response, 'answered')
+        except (asyncio.CancelledError, GeneratorExit):
+            # the client disconnected (the task was cancelled or the generator closed), an unfinished trace ends as
+            # cancelled instead of staying open
+            trace.finish('cancelled')
+            raise
+
+    def close(self):
+        self.io_executor.shutdown(wait=False)
+        self.cpu_executor.shutdown(wait=False)
@@ -0,0 +1,63 @@
+import os
+
+
+def memory_usage(pid='self'):
+    """
+        Returns the memory of a process in MB, from /proc/<pid>/smaps_rollup (or the sum over /proc/<pid>/smaps on
+        kernels older than 4.14), or None where /proc is not available:
+          rss: resident memory.
+          pss: resident memory, with every page shared by N processes counted as 1/N.
+          shared: resident pages also mapped by other processes, such as model weights and indexes preloaded
+                  before fork or memory-mapped files.
+          unique: resident pages of this process only (the USS) - what stopping the process would free.
+          swap: swapped out memory.
+    """
+
+    for name in ('smaps_rollup', 'smaps'):
+        try:
+            f = open(os.path.join('/proc', str(pid), name))
+        except OSError:
+            continue
+
+        # value lines look like "Shared_Clean:      1234 kB", the other lines are mapping headers and flags
+        totals = {}
+        with f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[0].endswith(':') and parts[2] == 'kB':
+                    totals[parts[0][:-1]] = totals.get(parts[0][:-1], 0) + int(parts[1])
+
+        return {
+            'rss_mb': totals.get('Rss', 0) / 1024,
+            'pss_mb': totals.get('Pss', 0) / 1024,
+            'shared_mb': (totals.get('Shared_Clean', 0) + totals.get('Shared_Dirty', 0)) / 1024,
+            'unique_mb': (totals.get('Private_Clean', 0) + totals.get('Private_Dirty', 0)) / 1024,
+            'swap_mb': totals.get('Swap', 0) / 1024,
+        }
+
+    return None
+
+
+def memory_report(processes):
+    """
+        Returns a text table of the memory of the given {name: pid} processes, with the totals - the PSS total is
+        the memory the processes really use together, the RSS total counts the shared pages once per process.
+    """
+
+    lines = ['{:<12} {:>8} {:>10} {:>10} {:>10} {:>10}'.format('process', 'pid', 'rss MB', 'pss MB', 'shared MB',
+                                                                'unique MB')]
+    totals = {'rss_mb': 0.0, 'pss_mb': 0.0, 'unique_mb': 0.0}
+
+    for name, pid in processes.items():
+        usage = memory_usage(pid)
+        if usage is None:
+            lines.append('{:<12} {:>8} {:>10}'.format(name, pid, 'n/a'))
+            continue
+        lines.append('{:<12} {:>8} {rss_mb:>10.0f} {pss_mb:>10.0f} {shared_mb:>10.0f} {unique_mb:>10.0f}'.format(
+            name, pid, **usage))
+        for key in totals:
+            totals[key] += usage[key]
+
+    lines.append('{:<12} {:>8} {rss_mb:>10.0f} {pss_mb:>10.0f} {:>10} {unique_mb:>10.0f}'.format('total', '', '',
+                                                                                                   **totals))
+    return '\n'.join(lines)
@@ -0,0 +1,85 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import time
+import uuid
+
+try:
+    from pyinstrument import Profiler as SamplingProfiler
+except ImportError:
+    SamplingProfiler = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class RequestProfiler:
+    """
+      Runs a single request under a profiler, for finding out why the questions of one project are slow.
+
+      PROFILER 'cprofile' is the deterministic profiler of the standard library: the report lists the TOP functions
+      by cumulative time with the functions that called them, and the raw stats are saved as a .prof file (for
+      snakeviz or pstats). 'pyinstrument' is a sampling profiler with much lower overhead whose report is the call
+      tree of the hot stacks, saved as .html - cprofile is used when pyinstrument is not installed.
+
+      Both only see the thread they run on, so the profiled function has to do all of its work on the calling thread
+      (see QueryPipeline.run with inline=True). Nothing is profiled outside of profile(), other requests do not pay
+      for it.
+
+      profile: Run function(*args, **kwargs) under the profiler, return its result, the text report and the path the
+               profile was saved to (None without OUTPUT_DIR).
+    """
+
+    def __init__(self, profiling):
+        self.kind = profiling['PROFILER']
+        self.output_dir = profiling['OUTPUT_DIR']
+        self.top = profiling['TOP']
+
+        if self.kind == 'pyinstrument' and SamplingProfiler is None:
+            logger.warning('pyinstrument is not installed, requests are profiled with cProfile')
+            self.kind = 'cprofile'
+        if self.kind not in ('cprofile', 'pyinstrument'):
+            raise ValueError('Unknown profiler: {}'.format(self.kind))
+
+    def path(self, name, extension):
+        if not self.output_dir:
+            return None
+        os.makedirs(self.output_dir, exist_ok=True)
+        file = '{}-{}-{}.{}'.format(time.strftime('%Y%m%d-%H%M%S'), name, uuid.uuid4().hex[:8], extension)
+        return os.path.join(self.output_dir, file)
+
+    def profile(self, name, function, *args, **kwargs):
+        if self.kind == 'pyinstrument':
+            return self.profile_sampling(name, function, *args, **kwargs)
+        return self.profile_deterministic(name, function, *args, **kwargs)
+
+    def profile_deterministic(self, name, function, *args, **kwargs):
+        profiler = cProfile.Profile()
+        result = profiler.runcall(function, *args, **kwargs)
+
+        report = io.StringIO()
+        stats = pstats.Stats(profiler, stream=report)
+        stats.strip_dirs().sort_stats('cumulative')
+        stats.print_stats(self.top)
+        stats.print_callers(self.top)
+
+        path = self.path(name, 'prof')
+        if path:
+            profiler.dump_stats(path)
+        return result, report.getvalue(), path
+
+    def profile_sampling(self, name, function, *args, **kwargs):
+        profiler = SamplingProfiler()
+        profiler.start()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            profiler.stop()
+
+        path = self.path(name, 'html')
+        if path:
+            with open(path, 'w') as f:
+                f.write(profiler.output_html())
+        return result, profiler.output_text(unicode=False, color=False), path
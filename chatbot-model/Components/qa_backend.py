@@ -0,0 +1,182 @@
+import logging
+import os
+
+import torch
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+
+logger = logging.getLogger(__name__)
+
+# (question, context) pairs the exported backends are compared with the fp32 model on
+PARITY_SAMPLES = [
+    ('Who maintains the deployment scripts?',
+     'The deployment scripts are maintained by the platform team. They run every night and push the latest '
+     'build of the chatbot to the staging environment.'),
+    ('When was the issue reported?',
+     'A bug Login fails on Safari was reported by John Smith. This bug was reported on 2021-06-14 at 09:12:44. '
+     'This bug is assigned to Jane Doe. Currently, this bug is in open state.'),
+    ('What is the default port of the API?',
+     'The API is served by uvicorn. By default it listens on port 8000 on all interfaces, the port can be '
+     'changed in model-api.py.'),
+]
+
+
+class QAOutputs(torch.nn.Module):
+    """
+        Wraps a question answering model to take its inputs as positional tensors and return (start, end) logits,
+        which is what tracing and ONNX export need.
+    """
+
+    def __init__(self, model, input_names):
+        super().__init__()
+        self.model = model
+        self.input_names = input_names
+
+    def forward(self, *inputs):
+        outputs = self.model(**dict(zip(self.input_names, inputs)), return_dict=False)
+        return outputs[0], outputs[1]
+
+
+class TorchBackend:
+    """
+      Runs the fp32 PyTorch model. Every backend is called with a dictionary of (batch, sequence) input tensors
+      and returns the start and end logits as numpy arrays. Backends with fixed_length need inputs padded to
+      max_seq_len.
+    """
+
+    name = 'torch'
+    fixed_length = False
+
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, inputs):
+        with torch.no_grad():
+            outputs = self.model(**inputs)
+        return outputs[0].numpy(), outputs[1].numpy()
+
+
+class QuantizedBackend(TorchBackend):
+    """
+      Runs the model with dynamic int8 quantization of its Linear layers (weights stored as int8, activations
+      quantized on the fly). Quantizing takes a few seconds, so the quantized model is not cached on disk.
+    """
+
+    name = 'quantized'
+
+    def __init__(self, model):
+        super().__init__(torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8))
+
+
+class TorchScriptBackend:
+    """
+      Runs the model traced to TorchScript, cached as qa_torchscript.pt next to the model. The trace is recorded
+      for inputs of max_seq_len tokens, so inputs are padded to that length.
+    """
+
+    name = 'torchscript'
+    fixed_length = True
+    FILE = 'qa_torchscript.pt'
+
+    def __init__(self, model, input_names, model_path, max_seq_len):
+        self.input_names = input_names
+        path = os.path.join(model_path, self.FILE)
+
+        if is_stale(path, model_path):
+            logger.info('Tracing the QA model to %s', path)
+            example = tuple(torch.ones((1, max_seq_len), dtype=torch.long) for _ in input_names)
+            with torch.no_grad():
+                traced = torch.jit.trace(QAOutputs(model, input_names), example)
+            traced.save(path + '.tmp')
+            os.replace(path + '.tmp', path)
+
+        self.module = torch.jit.load(path)
+        self.module.eval()
+
+    def __call__(self, inputs):
+        with torch.no_grad():
+            start, end = self.module(*[inputs[name] for name in self.input_names])
+        return start.numpy(), end.numpy()
+
+
+class OnnxBackend:
+    """
+      Runs the model exported to ONNX with ONNX Runtime, cached as qa.onnx next to the model. Batch size and
+      sequence length are dynamic axes of the graph.
+    """
+
+    name = 'onnx'
+    fixed_length = False
+    FILE = 'qa.onnx'
+
+    def __init__(self, model, input_names, model_path, max_seq_len):
+        self.input_names = input_names
+        path = os.path.join(model_path, self.FILE)
+
+        if is_stale(path, model_path):
+            logger.info('Exporting the QA model to %s', path)
+            example = tuple(torch.ones((1, max_seq_len), dtype=torch.long) for _ in input_names)
+            axes = {name: {0: 'batch', 1: 'sequence'} for name in list(input_names) + ['start_logits', 'end_logits']}
+            with torch.no_grad():
+                torch.onnx.export(QAOutputs(model, input_names), example, path + '.tmp', opset_version=12,
+                                  input_names=list(input_names), output_names=['start_logits', 'end_logits'],
+                                  dynamic_axes=axes)
+            os.replace(path + '.tmp', path)
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(path, options)
+
+    def __call__(self, inputs):
+        start, end = self.session.run(['start_logits', 'end_logits'],
+                                      {name: inputs[name].numpy() for name in self.input_names})
+        return start, end
+
+
+# files of a model directory an exported artifact is derived from - the weights in any format save_pretrained
+# or a training script writes, and the model config
+WEIGHT_SUFFIXES = ('.bin', '.safetensors', '.pt', '.pth', '.ckpt', '.h5', '.msgpack')
+MODEL_CONFIG = 'config.json'
+
+
+def is_stale(path, model_path):
+    """
+        Whether an artifact exported from the model in model_path is missing or older than the model weights or
+        config. The exported artifacts themselves (which may share a weight suffix) are not model files.
+    """
+
+    if not os.path.exists(path):
+        return True
+
+    artifacts = {TorchScriptBackend.FILE, OnnxBackend.FILE}
+    sources = [os.path.join(model_path, name) for name in os.listdir(model_path)
+               if name == MODEL_CONFIG or (name.endswith(WEIGHT_SUFFIXES) and name not in artifacts)]
+    return any(os.path.getmtime(source) > os.path.getmtime(path) for source in sources)
+
+
+def load_backend(name, model, tokenizer, model_path, max_seq_len):
+    """
+        Returns the inference backend `name` (torch, quantized, torchscript or onnx) of a question answering model.
+        onnx falls back to torch when onnxruntime is not installed.
+    """
+
+    input_names = [input_name for input_name in tokenizer.model_input_names
+                   if input_name in ('input_ids', 'attention_mask', 'token_type_ids')]
+
+    if name == 'torch':
+        return TorchBackend(model)
+    if name == 'quantized':
+        return QuantizedBackend(model)
+    if name == 'torchscript':
+        return TorchScriptBackend(model, input_names, model_path, max_seq_len)
+    if name == 'onnx':
+        if onnxruntime is None:
+            logger.warning('onnxruntime is not installed, the QA model runs on the torch backend')
+            return TorchBackend(model)
+        return OnnxBackend(model, input_names, model_path, max_seq_len)
+
+    raise ValueError('Unknown QA backend: {}'.format(name))
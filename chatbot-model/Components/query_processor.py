@@ -1,9 +1,17 @@
+from Components.token_cache import get_token_cache
+
+
 class QueryProcessor:
     def __init__(self, nlp, keep=None):
         self.nlp = nlp
         self.keep = keep or {'PROPN', 'NUM', 'VERB', 'NOUN', 'ADJ'}
+        self.token_cache = get_token_cache(nlp)
 
     def generate_query(self, text):
-        doc = self.nlp(text)
-        query = ' '.join(token.text for token in doc if token.pos_ in self.keep)
-        return query
\ No newline at end of file
+        tokens = self.token_cache.analyze(text)
+        query = ' '.join(token for token, _, pos in tokens if pos in self.keep)
+        return query
+
+    def normalize(self, text):
+        tokens = self.token_cache.analyze(text)
+        return ' '.join(lemma.lower() for _, lemma, pos in tokens if pos not in ('PUNCT', 'SPACE'))
\ No newline at end of file
@@ -0,0 +1,128 @@
+import hashlib
+import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from Components.scheduler import PeriodicTask
+
+
+logger = logging.getLogger(__name__)
+
+
+class RetrieverRegistry:
+    """
+      Process-wide cache of document retrievers, so that a warm question does not pay for building a retriever
+      (model loading, credential validation round-trip) on every request.
+
+      Entries are keyed by (source, domain, projectkey, credential fingerprint) - the raw credentials are only
+      hashed, never stored as part of a key. An entry expires `ttl` seconds after it was built and the least
+      recently used entry is evicted once more than `max_size` retrievers are cached. Every
+      `revalidate_interval` seconds the cached retrievers are re-validated on a background thread, so revoked
+      credentials or a recovered Atlassian outage are picked up without a request paying for it.
+
+      get: Return the cached retriever for a source and credentials, building it (once) on a miss - or None
+           on a miss with build=False.
+      revalidate: Drop expired entries and call validate() on every remaining retriever.
+      clear: Drop every cached retriever.
+    """
+
+    def __init__(self, factories, max_size=32, ttl=3600, revalidate_interval=300):
+        self.factories = factories
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.build_locks = weakref.WeakValueDictionary()
+        self.revalidator = None
+
+        if revalidate_interval:
+            self.revalidator = PeriodicTask(revalidate_interval, self.revalidate, name='retriever-revalidate')
+            self.revalidator.start()
+
+    @staticmethod
+    def fingerprint(username, password):
+        return hashlib.sha256((username + '\0' + password).encode('utf8')).hexdigest()
+
+    def get(self, source, username, password, nlp, domain, projectkey, build=True):
+        key = (source, domain, projectkey, self.fingerprint(username, password))
+
+        retriever = self._lookup(key)
+        if retriever is not None or not build:
+            return retriever
+
+        # only one request builds a given retriever, the others wait for it instead of building their own
+        with self.lock:
+            build_lock = self.build_locks.get(key)
+            if build_lock is None:
+                build_lock = threading.Lock()
+                self.build_locks[key] = build_lock
+
+        with build_lock:
+            retriever = self._lookup(key)
+            if retriever is None:
+                retriever = self.factories[source](username, password, nlp, domain, projectkey)
+                self._insert(key, retriever)
+
+        return retriever
+
+    def revalidate(self):
+        with self.lock:
+            expired = [key for key, (created, _) in self.entries.items() if self._expired(created)]
+            evicted = [self.entries.pop(key)[1] for key in expired]
+            retrievers = [retriever for _, retriever in self.entries.values()]
+
+        for retriever in evicted:
+            self._close(retriever)
+
+        for retriever in retrievers:
+            try:
+                retriever.validate()
+            except Exception:
+                logger.exception('Failed to re-validate %s', type(retriever).__name__)
+
+    def clear(self):
+        with self.lock:
+            evicted = [retriever for _, retriever in self.entries.values()]
+            self.entries.clear()
+
+        for retriever in evicted:
+            self._close(retriever)
+
+    def _expired(self, created):
+        return self.ttl is not None and time.monotonic() - created > self.ttl
+
+    def _lookup(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            created, retriever = entry
+            if not self._expired(created):
+                self.entries.move_to_end(key)
+                return retriever
+
+            del self.entries[key]
+
+        self._close(retriever)
+        return None
+
+    def _insert(self, key, retriever):
+        evicted = []
+        with self.lock:
+            self.entries[key] = (time.monotonic(), retriever)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                _, (_, old) = self.entries.popitem(last=False)
+                evicted.append(old)
+
+        for old in evicted:
+            self._close(old)
+
+    @staticmethod
+    def _close(retriever):
+        close = getattr(retriever, 'close', None)
+        if close is not None:
+            close()
@@ -0,0 +1,39 @@
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """
+      Runs a callable every `interval` seconds on a daemon thread until stop() is called. The first run happens
+      after `initial_delay` seconds (default: `interval`). Exceptions raised by the callable are logged and do
+      not stop the schedule.
+
+      start: Start the background thread.
+      stop: Stop the schedule - the thread exits after the current run (if any) finishes.
+    """
+
+    def __init__(self, interval, target, name=None, initial_delay=None):
+        self.interval = interval
+        self.initial_delay = interval if initial_delay is None else initial_delay
+        self.target = target
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def _run(self):
+        delay = self.initial_delay
+        while not self.stopped.wait(delay):
+            try:
+                self.target()
+            except Exception:
+                logger.exception('Periodic task %s failed', self.thread.name)
+            delay = self.interval
@@ -0,0 +1,94 @@
+import csv
+import os
+import sqlite3
+import sys
+import threading
+
+
+class SummaryStore:
+    """
+      SQLite store of the summaries and passages of Confluence pages, with page_id as primary key.
+      It replaces the summary CSV file, which had to be read (and rewritten) as a whole.
+      Every page also records its space key and the page version its summary was generated from.
+
+      On first start (empty store) the summary CSV of previous versions, if given and present, is imported.
+      Imported pages have no space and no version, so the first sync of their space summarizes them again.
+
+      page_ids: Return the ids of all stored pages, or of the pages of a space (including imported pages).
+      versions: Return {page_id: version} of the given pages.
+      summaries: Return (page_id, summary) pairs of the given pages - only the summary column is read.
+      passages: Return (page_id, passages) pairs of the given pages.
+      upsert: Insert or replace (page_id, summary, passages, space, version) rows.
+      delete: Delete pages by id.
+      migrate_csv: Import the rows of a summary CSV file.
+    """
+
+    # stay below SQLite's limit of host parameters per statement
+    CHUNK_SIZE = 500
+
+    def __init__(self, path, legacy_csv=None):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+
+        with self.lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS pages ('
+                                    'page_id INTEGER PRIMARY KEY, summary TEXT NOT NULL, passages TEXT NOT NULL)')
+
+            # stores created before pages recorded their space and version
+            columns = {row[1] for row in self.connection.execute('PRAGMA table_info(pages)')}
+            for column, kind in (('space', 'TEXT'), ('version', 'INTEGER')):
+                if column not in columns:
+                    self.connection.execute('ALTER TABLE pages ADD COLUMN {} {}'.format(column, kind))
+            self.connection.execute('CREATE INDEX IF NOT EXISTS pages_space ON pages (space)')
+
+        if legacy_csv and os.path.exists(legacy_csv) and not self.page_ids():
+            self.migrate_csv(legacy_csv)
+
+    def select(self, columns, page_ids):
+        page_ids = [int(page_id) for page_id in page_ids]
+        rows = []
+        with self.lock:
+            for i in range(0, len(page_ids), self.CHUNK_SIZE):
+                chunk = page_ids[i:i + self.CHUNK_SIZE]
+                query = 'SELECT page_id, {} FROM pages WHERE page_id IN ({})'.format(columns, ','.join('?' * len(chunk)))
+                rows.extend(self.connection.execute(query, chunk).fetchall())
+        return rows
+
+    def page_ids(self, space=None, include_imported=True):
+        with self.lock:
+            if space is None:
+                rows = self.connection.execute('SELECT page_id FROM pages')
+            elif include_imported:
+                rows = self.connection.execute('SELECT page_id FROM pages WHERE space = ? OR space IS NULL', (space,))
+            else:
+                rows = self.connection.execute('SELECT page_id FROM pages WHERE space = ?', (space,))
+            return [row[0] for row in rows]
+
+    def versions(self, page_ids):
+        return dict(self.select('version', page_ids))
+
+    def summaries(self, page_ids):
+        return self.select('summary', page_ids)
+
+    def passages(self, page_ids):
+        return self.select('passages', page_ids)
+
+    def upsert(self, rows):
+        with self.lock, self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO pages (page_id, summary, passages, space, version) '
+                                        'VALUES (?, ?, ?, ?, ?)',
+                                        [(int(page_id), summary, passages, space, version)
+                                         for page_id, summary, passages, space, version in rows])
+
+    def delete(self, page_ids):
+        with self.lock, self.connection:
+            self.connection.executemany('DELETE FROM pages WHERE page_id = ?', [(int(page_id),) for page_id in page_ids])
+
+    def migrate_csv(self, path):
+        # passages of a page can be far longer than the default field size limit
+        csv.field_size_limit(sys.maxsize)
+
+        with open(path, newline='') as csvfile:
+            reader = csv.DictReader(csvfile)
+            self.upsert((row['page_id'], row['summary'], row['passages'], None, None) for row in reader)
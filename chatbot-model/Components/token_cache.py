@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import config
+
+
+class TokenCache:
+    """
+      Content-hash keyed cache of spaCy token analyses, so that the same Jira stories, Confluence passages and
+      summaries are not run through the spaCy pipeline again on every request.
+
+      An entry holds the (text, lemma, part-of-speech) triple of every token of a text. At most `max_bytes` of
+      entries (an estimate of their in-memory size) are kept in memory, the least recently used ones are evicted
+      first. With a `spill_path`, evicted entries are written to a SQLite file and read back on a later miss. The
+      SQLite connection is opened on first use, and again in a forked process (see serve.py) - a connection must
+      not be used by two processes.
+      Texts that are neither in memory nor spilled are analysed in batches of `batch_size` with nlp.pipe.
+
+      analyze / analyze_many: Return the (text, lemma, pos) triples of the tokens of one text / many texts.
+      tokenize / tokenize_many: Return the lemmas of the tokens of one text / many texts.
+    """
+
+    # rough size of a token triple in memory, on top of the characters of its strings
+    TOKEN_OVERHEAD = 200
+
+    def __init__(self, nlp, max_bytes, spill_path=None, batch_size=64):
+        self.nlp = nlp
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+        self.spill_path = spill_path
+        self.spill = None
+        os.register_at_fork(after_in_child=self.after_fork)
+
+    def after_fork(self):
+        # the connection inherited from the parent is not used, the child opens its own on first use
+        self.spill = None
+        self.lock = threading.Lock()
+
+    def spill_db(self):
+        if self.spill is None and self.spill_path:
+            self.spill = sqlite3.connect(self.spill_path, check_same_thread=False)
+            self.spill.execute('CREATE TABLE IF NOT EXISTS tokens (key TEXT PRIMARY KEY, tokens TEXT)')
+            self.spill.commit()
+        return self.spill
+
+    @staticmethod
+    def key(text):
+        return hashlib.sha1(text.encode('utf8')).hexdigest()
+
+    @classmethod
+    def sizeof(cls, tokens):
+        return sum(len(text) + len(lemma) + len(pos) + cls.TOKEN_OVERHEAD for text, lemma, pos in tokens)
+
+    def analyze(self, text):
+        return self.analyze_many([text])[0]
+
+    def tokenize(self, text):
+        return [lemma for _, lemma, _ in self.analyze(text)]
+
+    def tokenize_many(self, texts):
+        return [[lemma for _, lemma, _ in tokens] for tokens in self.analyze_many(texts)]
+
+    def analyze_many(self, texts):
+        keys = [self.key(text) for text in texts]
+        found = {}
+        missing = OrderedDict()
+
+        with self.lock:
+            for key, text in zip(keys, texts):
+                if key in found or key in missing:
+                    continue
+                tokens = self.entries.get(key)
+                if tokens is not None:
+                    self.entries.move_to_end(key)
+                    found[key] = tokens
+                else:
+                    missing[key] = text
+
+            if missing and self.spill_path:
+                for key, tokens in self.read_spill(list(missing)):
+                    found[key] = tokens
+                    self.insert(key, tokens)
+                    del missing[key]
+
+        if missing:
+            docs = self.nlp.pipe(list(missing.values()), batch_size=self.batch_size)
+            analysed = [(key, tuple((token.text, token.lemma_, token.pos_) for token in doc)) for key, doc in zip(missing, docs)]
+
+            with self.lock:
+                for key, tokens in analysed:
+                    found[key] = tokens
+                    self.insert(key, tokens)
+
+        return [found[key] for key in keys]
+
+    def insert(self, key, tokens):
+        if key in self.entries:
+            return
+
+        self.entries[key] = tokens
+        self.size += self.sizeof(tokens)
+
+        evicted = []
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            old_key, old_tokens = self.entries.popitem(last=False)
+            self.size -= self.sizeof(old_tokens)
+            evicted.append((old_key, old_tokens))
+
+        if evicted and self.spill_path:
+            spill = self.spill_db()
+            spill.executemany('INSERT OR REPLACE INTO tokens (key, tokens) VALUES (?, ?)',
+                              [(old_key, json.dumps(old_tokens)) for old_key, old_tokens in evicted])
+            spill.commit()
+
+    def read_spill(self, keys):
+        rows = []
+        # stay below SQLite's limit of host parameters per statement
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            query = 'SELECT key, tokens FROM tokens WHERE key IN ({})'.format(','.join('?' * len(chunk)))
+            rows.extend(self.spill_db().execute(query, chunk).fetchall())
+        return [(key, tuple(tuple(token) for token in json.loads(tokens))) for key, tokens in rows]
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def get_token_cache(nlp):
+    """
+        Returns the TokenCache shared by every component that uses the given spaCy pipeline,
+        configured by the TOKEN_CACHE config variable.
+    """
+
+    with _shared_lock:
+        cache = _shared.get(id(nlp))
+        if cache is None:
+            cache = TokenCache(nlp, config.TOKEN_CACHE['MAX_BYTES'], config.TOKEN_CACHE['SPILL_PATH'],
+                               config.TOKEN_CACHE['BATCH_SIZE'])
+            _shared[id(nlp)] = cache
+    return cache
@@ -0,0 +1,274 @@
+import asyncio
+import functools
+import hmac
+import json
+import logging
+import os
+import re
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, Response
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+import config
+from Components.metrics import get_metrics
+from Components.process_memory import memory_usage
+
+
+logger = logging.getLogger(__name__)
+
+SPACY_MODEL = 'en_core_web_sm'
+
+
+def rss_mb():
+    """
+        Returns the resident set size of this process in MB (the peak RSS where /proc is not available).
+    """
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class ServingState:
+    """
+      The components behind the API. spaCy, the passage index and the QA model take long to load, so they are
+      loaded by load() - on a background thread when the app is created with background=True - instead of at
+      import, and the API answers 503 until they are ready.
+
+      The duration of every phase of loading (imports, spacy, passage_index, qa_model, pipeline, warmup) and the
+      RSS of the process after it are kept in `startup`, logged, exported as chatbot_startup_* gauges and returned
+      by /ready.
+
+      With several workers (see serve.py) the state is loaded once in the parent process, without the parity check
+      of the QA backend, and inherited by the forked workers, which then run the parity check and warm up.
+
+      load: Import and build the components unless they are loaded already (with verify, check the parity of the QA
+            backend), optionally warm them up, then mark the state ready.
+      warm_up: Answer a sample question, so that the first request does not pay for lazy initialization (allocator
+               warm-up, first forward pass, spaCy vocabulary).
+      close: Stop the pipeline and, with save, save the passage index, if they were loaded.
+    """
+
+    def __init__(self):
+        self.ready = threading.Event()
+        self.error = None
+        self.startup = {}
+        self.started = time.monotonic()
+        self.worker = None
+
+        self.nlp = None
+        self.query_processor = None
+        self.passage_retriever = None
+        self.answer_extractor = None
+        self.pipeline = None
+        self.profiler = None
+        self.metrics = get_metrics()
+        self.metrics.collector('chatbot_startup', lambda: dict(self.startup))
+        self.metrics.collector('chatbot_memory', lambda: memory_usage() or {})
+
+    @contextmanager
+    def phase(self, name):
+        started = time.monotonic()
+        yield
+        self.startup[name] = {'seconds': time.monotonic() - started, 'rss_mb': rss_mb()}
+        logger.info('Startup: %s took %.2f sec, RSS %.0f MB', name, self.startup[name]['seconds'],
+                    self.startup[name]['rss_mb'])
+
+    def load(self, warmup=False, verify=True):
+        try:
+            if self.pipeline is None:
+                self.load_components(verify)
+            elif verify:
+                with self.phase('parity_check'):
+                    self.answer_extractor.verify()
+
+            if warmup:
+                with self.phase('warmup'):
+                    self.warm_up()
+        except Exception as e:
+            logger.exception('Loading the model API failed')
+            self.error = '{}: {}'.format(type(e).__name__, e)
+            return
+
+        self.startup['total'] = {'seconds': time.monotonic() - self.started, 'rss_mb': rss_mb()}
+        logger.info('Startup: ready after %.2f sec, RSS %.0f MB', self.startup['total']['seconds'],
+                    self.startup['total']['rss_mb'])
+        self.ready.set()
+
+    def load_components(self, verify=True):
+        # the heavy modules (spaCy, torch, transformers) are only imported here
+        with self.phase('imports'):
+            import spacy
+            from utils import get_answer_extractor, get_source_retriever, get_doc_retriever_keys
+            from Components.answer_cache import AnswerCache
+            from Components.passage_retrieval import PassageRetrieval
+            from Components.pipeline import QueryPipeline
+            from Components.profiler import RequestProfiler
+            from Components.query_processor import QueryProcessor
+
+        with self.phase('spacy'):
+            self.nlp = spacy.load(SPACY_MODEL, disable=['ner', 'parser', 'textcat'])
+            self.query_processor = QueryProcessor(self.nlp)
+
+        with self.phase('passage_index'):
+            self.passage_retriever = PassageRetrieval(self.nlp)
+
+        with self.phase('qa_model'):
+            self.answer_extractor = get_answer_extractor(verify)
+
+        with self.phase('pipeline'):
+            answer_cache = AnswerCache(config.ANSWER_CACHE['MAX_SIZE'], config.ANSWER_CACHE['TTL'])
+            self.pipeline = QueryPipeline(self.query_processor, self.passage_retriever, self.answer_extractor,
+                                          get_source_retriever, get_doc_retriever_keys, config.PIPELINE,
+                                          answer_cache)
+            self.metrics.collector('chatbot_inference', self.answer_extractor.metrics)
+            if config.PROFILING['ENABLED']:
+                self.profiler = RequestProfiler(config.PROFILING)
+
+    def warm_up(self):
+        from Components.qa_backend import PARITY_SAMPLES
+
+        question, context = PARITY_SAMPLES[0]
+        self.query_processor.generate_query(question)
+        self.query_processor.normalize(question)
+        self.answer_extractor.extract(question, [context])
+
+    def close(self, save=True):
+        if self.pipeline is not None:
+            self.pipeline.close()
+        if self.passage_retriever is not None and save:
+            self.passage_retriever.save()
+
+
+def create_app(background=None, warmup=None, state=None, save_index=True):
+    """
+        Returns the FastAPI app of the model API. Nothing heavy is loaded before the app starts: on startup the
+        components are loaded by a ServingState - on a background thread with background=True, so the server
+        accepts connections right away and /ready tells when questions can be asked. background and warmup
+        default to the SERVER config variable. A ServingState loaded beforehand can be given as state, and
+        save_index=False keeps the app from saving the passage index on shutdown (only one worker saves it).
+
+        Can be served by any ASGI server, for example: uvicorn api:create_app --factory
+    """
+
+    background = config.SERVER['BACKGROUND_LOAD'] if background is None else background
+    warmup = config.SERVER['WARMUP'] if warmup is None else warmup
+
+    state = ServingState() if state is None else state
+    app = FastAPI()
+    app.state.serving = state
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=['*'],
+        allow_credentials=True,
+        allow_methods=['*'],
+        allow_headers=['*'],
+    )
+
+    @app.on_event('startup')
+    def load_components():
+        if background:
+            threading.Thread(target=state.load, args=(warmup,), name='model-loader', daemon=True).start()
+        else:
+            state.load(warmup)
+
+    @app.on_event('shutdown')
+    def save_indexes():
+        state.close(save_index)
+
+    # the endpoints that need the components answer 503 (with Retry-After) until they are loaded
+    def components():
+        if state.error is not None:
+            raise HTTPException(status_code=500, detail='The model API failed to load: ' + state.error)
+        if not state.ready.is_set():
+            raise HTTPException(status_code=503, detail='The model is still loading, please try again.',
+                                headers={'Retry-After': str(config.SERVER['RETRY_AFTER'])})
+
+    # readiness, with the duration and memory of every startup phase
+    @app.get('/ready')
+    def ready():
+        status = 200 if state.ready.is_set() else 503
+        return JSONResponse({'ready': state.ready.is_set(), 'error': state.error, 'startup': state.startup},
+                            status_code=status)
+
+    async def cancel_on_disconnect(request, task):
+        while not task.done():
+            if await request.is_disconnected():
+                task.cancel()
+                return
+            await asyncio.sleep(config.PIPELINE['DISCONNECT_POLL_INTERVAL'])
+
+    def is_admin(token):
+        admin_token = config.PROFILING['ADMIN_TOKEN']
+        return bool(admin_token) and token is not None and hmac.compare_digest(token.encode(), admin_token.encode())
+
+    # the whole request runs on one thread of its own under the profiler (sources searched one after the other, no
+    # inference scheduler, no answer cache), the profile is saved to OUTPUT_DIR and returned under 'profile'
+    async def profile_answer(question, doc_retriever_key, *retriever_args):
+        name = re.sub(r'\W+', '_', retriever_args[-1] or doc_retriever_key)
+        run = functools.partial(state.profiler.profile, name, state.pipeline.run, question, doc_retriever_key,
+                                *retriever_args, inline=True, use_cache=False)
+        result, report, path = await asyncio.get_event_loop().run_in_executor(None, run)
+
+        result['profile'] = {'profiler': state.profiler.kind, 'path': path}
+        if config.PROFILING['RETURN_REPORT']:
+            result['profile']['report'] = report
+        return result
+
+    # profile=true (with the X-Admin-Token header of PROFILING['ADMIN_TOKEN']) profiles this request, see profile_answer
+    @app.get('/query/', dependencies=[Depends(components)])
+    async def get_answer(request: Request, response: Response, confluence_username: str, confluence_password: str, bitbucket_username: str, bitbucket_password: str, question: str, doc_retriever_key: str, domain: str, projectkey: str, profile: bool = False, x_admin_token: Optional[str] = Header(None)):
+        if profile:
+            if state.profiler is None or not is_admin(x_admin_token):
+                raise HTTPException(status_code=403, detail='Profiling is only available to administrators.')
+            result = await profile_answer(question, doc_retriever_key, confluence_username, confluence_password, bitbucket_username, bitbucket_password, state.nlp, domain, projectkey)
+            response.headers['X-Trace-Id'] = result['trace_id']
+            return result
+
+        task = asyncio.ensure_future(state.pipeline.arun(question, doc_retriever_key, confluence_username, confluence_password, bitbucket_username, bitbucket_password, state.nlp, domain, projectkey))
+        watcher = asyncio.ensure_future(cancel_on_disconnect(request, task))
+
+        try:
+            result = await task
+        finally:
+            watcher.cancel()
+
+        response.headers['X-Trace-Id'] = result['trace_id']
+        return result
+
+    # throughput, batch sizes and queueing delay of QA inference
+    @app.get('/metrics/inference/', dependencies=[Depends(components)])
+    def inference_metrics():
+        return state.answer_extractor.metrics()
+
+    # unique and shared memory of this process (of this worker with serve.py)
+    @app.get('/metrics/memory/')
+    def process_memory():
+        return {'pid': os.getpid(), 'worker': state.worker, 'memory': memory_usage()}
+
+    # latency histograms of every stage, documents / passages / tokens counters, the inference metrics and the
+    # startup phases, in the Prometheus text format - available while the model is loading
+    @app.get('/metrics')
+    def prometheus_metrics():
+        return PlainTextResponse(state.metrics.render(), media_type='text/plain; version=0.0.4')
+
+    # same as /query/, as server-sent events: retrieval and passages progress, every answer as soon as it is scored
+    # (best so far flagged) and the complete response in the final 'done' event
+    @app.get('/query/stream/', dependencies=[Depends(components)])
+    async def stream_answer(confluence_username: str, confluence_password: str, bitbucket_username: str, bitbucket_password: str, question: str, doc_retriever_key: str, domain: str, projectkey: str):
+        async def events():
+            async for event, data in state.pipeline.astream(question, doc_retriever_key, confluence_username, confluence_password, bitbucket_username, bitbucket_password, state.nlp, domain, projectkey):
+                yield 'event: {}\ndata: {}\n\n'.format(event, json.dumps(data))
+
+        return StreamingResponse(events(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    return app
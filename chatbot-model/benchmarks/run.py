@@ -0,0 +1,279 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import config
+from benchmarks.stub_server import StubCorpus, StubServer, load_fixture
+
+
+SOURCES = ('confluence', 'jira', 'bitbucket')
+
+
+def percentiles(samples):
+    """
+        Returns count, mean, p50, p90, p99 and max of a list of durations, in milliseconds.
+    """
+
+    if not samples:
+        return {'count': 0}
+
+    ms = np.array(samples) * 1000
+    return {
+        'count': len(ms),
+        'mean': float(ms.mean()),
+        'p50': float(np.percentile(ms, 50)),
+        'p90': float(np.percentile(ms, 90)),
+        'p99': float(np.percentile(ms, 99)),
+        'max': float(ms.max()),
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def configure(server, workdir):
+    """
+        Points the config at the stub server and at empty stores in workdir, so a run never reads or writes the
+        summary DB or the passage index of the deployment.
+    """
+
+    config.CONFLUENCE.update({
+        'BASE_URL': server.base_url,
+        'CONFLUENCE_SUMMARY_DB': os.path.join(workdir, 'confluence_summary_db.sqlite'),
+        'CONFLUENCE_SUMMARY_CSV': None,
+        'UPDATE_CONFLUENCE_SUMMARY': True,
+        'SYNC_INTERVAL': None,
+    })
+    config.JIRA['BASE_URL'] = server.base_url
+    config.BITBUCKET['API_URL'] = server.api_url
+    config.PASSAGE_INDEX['PATH'] = os.path.join(workdir, 'passage_index')
+
+
+def build_retrievers(nlp, workspace, repository):
+    from Components.document_retriever import ConfluenceDocumentRetriever, JiraDocumentRetriever, BitBucketRetriever
+
+    # the fixture pages are shorter than MIN_SUMMARY_WORDS, so the GPT-2 summarizer is never loaded
+    retrievers = {
+        'confluence': ConfluenceDocumentRetriever('bench', 'bench', nlp, config.CONFLUENCE, workspace, repository),
+        'jira': JiraDocumentRetriever('bench', 'bench', config.JIRA, workspace, repository),
+        'bitbucket': BitBucketRetriever('bench', 'bench', config.BITBUCKET, workspace, repository),
+    }
+
+    setup = {}
+    for source, retriever in retrievers.items():
+        if retriever.invalid:
+            raise RuntimeError('The stub server rejected the {} retriever'.format(source))
+
+        started = time.perf_counter()
+        if source == 'confluence':
+            retriever.sync()
+        else:
+            retriever.refresh()
+        setup[source + '_sync'] = time.perf_counter() - started
+    return retrievers, setup
+
+
+def answer(question, sources, query_processor, retrievers, passage_retriever, answer_extractor, timings):
+    """
+        Answers a question stage by stage, the way QueryPipeline.run does, and appends the duration of every stage
+        to timings.
+    """
+
+    started = time.perf_counter()
+    query = query_processor.generate_query(question)
+    timings['query'].append(time.perf_counter() - started)
+
+    docs = []
+    for source in sources:
+        before = time.perf_counter()
+        docs.extend(retrievers[source].search(question, query))
+        timings['retrieval.' + source].append(time.perf_counter() - before)
+
+    before = time.perf_counter()
+    passage_retriever.fit(docs)
+    passages = passage_retriever.most_similar(question)
+    timings['passages'].append(time.perf_counter() - before)
+
+    before = time.perf_counter()
+    answers = answer_extractor.extract(question, passages)
+    timings['extraction'].append(time.perf_counter() - before)
+
+    timings['total'].append(time.perf_counter() - started)
+    return answers
+
+
+def measure_throughput(pipeline, questions, concurrency, repeat):
+    work = [(item['question'], item['source']) for item in questions] * repeat
+    latencies = []
+
+    def run(question, source):
+        started = time.perf_counter()
+        pipeline.run(question, source, 'bench', 'bench', 'bench', 'bench', None, None, None)
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        for future in [executor.submit(run, question, source) for question, source in work]:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    return {'concurrency': concurrency, 'questions': len(work), 'seconds': elapsed,
+            'questions_per_sec': len(work) / elapsed, 'latency': percentiles(latencies)}
+
+
+def compare(results, baseline_path):
+    """
+        Prints the change of every stage's p50 and p90 against the results of a previous run.
+    """
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    print('\n> Compared with {} ({})'.format(baseline_path, (baseline.get('commit') or 'unknown')[:10]))
+    for stage, stats in results['stages'].items():
+        before = baseline.get('stages', {}).get(stage)
+        if not before or not before.get('count') or not stats.get('count'):
+            continue
+        changes = ['{} {:+.1f}%'.format(name, 100 * (stats[name] - before[name]) / before[name])
+                   for name in ('p50', 'p90') if before[name]]
+        print('  {:<22} {}'.format(stage, ', '.join(changes)))
+
+
+def main():
+    """
+        Benchmarks the pipeline offline: QueryProcessor, the Confluence, Jira and BitBucket retrievers (served by the
+        local stub server), PassageRetrieval and AnswerExtractor answer the questions of the question set, and the
+        latency percentiles of every stage, the throughput under concurrency and the peak RSS are written as JSON.
+    """
+
+    parser = argparse.ArgumentParser(description='Offline benchmark of the question answering pipeline.')
+    parser.add_argument('--questions', default=None, help='JSON list of {"question", "source"} (fixtures/questions.json)')
+    parser.add_argument('--repeat', type=int, default=3, help='passes over the question set')
+    parser.add_argument('--warmup', type=int, default=1, help='passes over the question set before measuring')
+    parser.add_argument('--concurrency', type=int, default=0, help='also measure QueryPipeline.run with N threads')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every stub server response')
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--issues', type=int, default=500)
+    parser.add_argument('--bitbucket-issues', type=int, default=200)
+    parser.add_argument('--commits', type=int, default=500)
+    parser.add_argument('--model-type', default=config.MODEL_TYPE)
+    parser.add_argument('--model-path', default=config.MODEL_PATH)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', default=None, help='results of a previous run to compare with')
+    args = parser.parse_args()
+
+    questions = load_fixture('questions.json') if args.questions is None else json.load(open(args.questions))
+    workspace, repository = 'bench', 'DB'
+
+    corpus = StubCorpus(args.pages, args.issues, args.bitbucket_issues, args.commits, workspace, repository)
+    server = StubServer(corpus, args.latency).start()
+    workdir = tempfile.mkdtemp(prefix='chatbot-bench-')
+    configure(server, workdir)
+    config.MODEL_TYPE = args.model_type
+    config.MODEL_PATH = args.model_path
+
+    # heavy imports after the config is final, the components read it when they are created
+    import spacy
+    from utils import get_answer_extractor
+    from Components.passage_retrieval import PassageRetrieval
+    from Components.pipeline import QueryPipeline
+    from Components.query_processor import QueryProcessor
+
+    setup = {}
+    started = time.perf_counter()
+    nlp = spacy.load('en_core_web_sm', disable=['ner', 'parser', 'textcat'])
+    query_processor = QueryProcessor(nlp)
+    passage_retriever = PassageRetrieval(nlp)
+    setup['nlp_load'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    answer_extractor = get_answer_extractor()
+    setup['model_load'] = time.perf_counter() - started
+
+    print('> Syncing the retrievers with the stub server...')
+    retrievers, sync = build_retrievers(nlp, workspace, repository)
+    setup.update(sync)
+
+    print('> Answering {} questions x {} passes...'.format(len(questions), args.warmup + args.repeat))
+    stages = ['query'] + ['retrieval.' + source for source in SOURCES] + ['passages', 'extraction', 'total']
+    timings = {stage: [] for stage in stages}
+    for i in range(args.warmup + args.repeat):
+        if i == args.warmup:
+            timings = {stage: [] for stage in stages}
+        for item in questions:
+            sources = SOURCES if item['source'] == 'all' else [item['source']]
+            answer(item['question'], sources, query_processor, retrievers, passage_retriever, answer_extractor, timings)
+
+    total = sum(timings['total'])
+    results = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'parameters': {
+            'questions': len(questions), 'repeat': args.repeat, 'warmup': args.warmup, 'latency': args.latency,
+            'pages': args.pages, 'issues': args.issues, 'bitbucket_issues': args.bitbucket_issues,
+            'commits': args.commits, 'model_type': args.model_type,
+            'qa_backend': config.QA_BACKEND['BACKEND'], 'cascade': config.CASCADE['ENABLED'],
+        },
+        'setup': setup,
+        'stages': {stage: percentiles(samples) for stage, samples in timings.items()},
+        'sequential_questions_per_sec': len(timings['total']) / total if total else 0.0,
+    }
+
+    if args.concurrency:
+        print('> Measuring throughput with {} concurrent questions...'.format(args.concurrency))
+        pipeline = QueryPipeline(query_processor, passage_retriever, answer_extractor,
+                                 lambda source, *retriever_args, build=True: retrievers[source],
+                                 lambda key: list(SOURCES) if key == 'all' else [key], config.PIPELINE)
+        results['throughput'] = measure_throughput(pipeline, questions, args.concurrency, args.repeat)
+        pipeline.close()
+
+    results['inference'] = answer_extractor.metrics()
+    results['peak_rss_mb'] = peak_rss_mb()
+
+    for retriever in retrievers.values():
+        getattr(retriever, 'close', lambda: None)()
+    server.stop()
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print('\n  {:<22} {:>8} {:>8} {:>8} {:>8}'.format('stage (ms)', 'p50', 'p90', 'p99', 'max'))
+    for stage, stats in results['stages'].items():
+        if stats['count']:
+            print('  {:<22} {p50:8.1f} {p90:8.1f} {p99:8.1f} {max:8.1f}'.format(stage, **stats))
+    print('\n> {:.2f} questions/sec sequential, peak RSS {:.0f} MB'.format(
+        results['sequential_questions_per_sec'], results['peak_rss_mb']))
+    if 'throughput' in results:
+        print('> {:.2f} questions/sec with {} threads'.format(results['throughput']['questions_per_sec'],
+                                                              args.concurrency))
+    print('> Results written to', args.output)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
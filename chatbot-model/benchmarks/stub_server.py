@@ -0,0 +1,262 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return json.load(f)
+
+
+def instantiate(template, n):
+    # every "{n}" of the template becomes the number of the generated object
+    return json.loads(json.dumps(template).replace('{n}', str(n)))
+
+
+def commit_hash(n):
+    return hashlib.sha1(str(n).encode('utf8')).hexdigest()
+
+
+class StubCorpus:
+    """
+      The objects served by the stub server: the fixture templates repeated until the requested number of
+      Confluence pages, Jira issues, BitBucket issues and BitBucket commits is reached, with unique ids.
+
+      confluence_page / jira_issue / bitbucket_issue / bitbucket_commit: Return the n-th object of a listing.
+    """
+
+    def __init__(self, pages, issues, bitbucket_issues, commits, workspace, repository):
+        self.pages = pages
+        self.issues = issues
+        self.bitbucket_issues = bitbucket_issues
+        self.commits = commits
+        self.workspace = workspace
+        self.repository = repository
+
+        self.page_templates = load_fixture('confluence_pages.json')
+        self.issue_templates = load_fixture('jira_issues.json')
+        self.bitbucket_issue_templates = load_fixture('bitbucket_issues.json')
+        self.commit_templates = load_fixture('bitbucket_commits.json')
+
+        # the listings never change, so one ETag per listing is enough
+        self.etag = '"' + hashlib.sha1(repr((pages, issues, bitbucket_issues, commits)).encode('utf8')).hexdigest() + '"'
+
+    def confluence_page(self, n):
+        page = instantiate(self.page_templates[n % len(self.page_templates)], n)
+        return {
+            'id': str(100000 + n),
+            'type': 'page',
+            'title': page['title'],
+            'version': {'number': 1},
+            'body': {'storage': {'value': page['body'], 'representation': 'storage'}},
+        }
+
+    def jira_issue(self, n):
+        issue = instantiate(self.issue_templates[n % len(self.issue_templates)], n)
+        issue.update({'id': str(10000 + n), 'key': '{}-{}'.format(self.repository, n + 1)})
+        return issue
+
+    def bitbucket_issue(self, n):
+        issue = instantiate(self.bitbucket_issue_templates[n % len(self.bitbucket_issue_templates)], n)
+        issue.update({'id': n + 1, 'type': 'issue', 'repository': {'name': self.repository}})
+        return issue
+
+    def bitbucket_commit(self, n):
+        commit = instantiate(self.commit_templates[n % len(self.commit_templates)], n)
+        parents = [{'hash': commit_hash(n + 1)}] if n + 1 < self.commits else []
+        commit.update({'hash': commit_hash(n), 'type': 'commit', 'parents': parents,
+                       'repository': {'name': self.repository}})
+        return commit
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+      Answers the subset of the Confluence, Jira and BitBucket REST APIs the document retrievers use:
+
+        GET /wiki/rest/api/search              Confluence pages (start / limit pagination, _links.next)
+        GET /wiki/rest/api/content/<id>        Confluence page with its body.storage
+        GET /rest/api/2/search                 Jira issues (startAt / maxResults, `text ~ "term"` filtering)
+        GET /2.0/repositories/<ws>/<repo>/issues    BitBucket issues (page / pagelen, next links, ETag)
+        GET /2.0/repositories/<ws>/<repo>/commits   BitBucket commits (page / pagelen, next links, ETag)
+
+      Every request is answered after `latency` seconds. Credentials are not checked.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, obj, status=200, headers=None):
+        body = json.dumps(obj).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_status(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        path = url.path.rstrip('/')
+        bitbucket = '/2.0/repositories/{}/{}/'.format(self.server.corpus.workspace, self.server.corpus.repository)
+
+        if path == '/wiki/rest/api/search':
+            self.confluence_search(params)
+        elif path.startswith('/wiki/rest/api/content/'):
+            self.confluence_content(path.rsplit('/', 1)[1])
+        elif path == '/rest/api/2/search':
+            self.jira_search(params)
+        elif path == bitbucket + 'issues':
+            self.bitbucket_listing('issues', self.server.corpus.bitbucket_issues, self.server.corpus.bitbucket_issue, params)
+        elif path == bitbucket + 'commits':
+            self.bitbucket_listing('commits', self.server.corpus.commits, self.server.corpus.bitbucket_commit, params)
+        else:
+            self.send_status(404)
+
+    def confluence_search(self, params):
+        corpus = self.server.corpus
+        start = int(params.get('start', 0))
+        limit = int(params.get('limit', 25))
+        end = min(start + limit, corpus.pages)
+
+        results = []
+        for n in range(start, end):
+            page = corpus.confluence_page(n)
+            results.append({'content': {'id': page['id'], 'type': 'page', 'title': page['title'],
+                                        'version': page['version']}, 'title': page['title']})
+
+        links = {}
+        if end < corpus.pages:
+            links['next'] = '/rest/api/search?' + urlencode(dict(params, start=end))
+        self.send_json({'results': results, 'start': start, 'limit': limit, 'size': len(results),
+                        'totalSize': corpus.pages, '_links': links})
+
+    def confluence_content(self, page_id):
+        n = int(page_id) - 100000 if page_id.isdigit() else -1
+        if not 0 <= n < self.server.corpus.pages:
+            self.send_status(404)
+            return
+        self.send_json(self.server.corpus.confluence_page(n))
+
+    def jira_search(self, params):
+        corpus = self.server.corpus
+        start = int(params.get('startAt', 0))
+        max_results = int(params.get('maxResults', 50))
+
+        # only the `text ~ "term"` clauses are understood, an issue matches if its text contains one of the terms
+        terms = re.findall(r'text ~ "([^"]*)"', params.get('jql', ''))
+        matches = range(corpus.issues)
+        if terms:
+            matches = [n for n in matches
+                       if any(term in json.dumps(corpus.jira_issue(n)['fields']).lower() for term in terms)]
+
+        issues = [corpus.jira_issue(n) for n in matches[start:start + max_results]]
+        self.send_json({'startAt': start, 'maxResults': max_results, 'total': len(matches), 'issues': issues})
+
+    def bitbucket_listing(self, name, size, get, params):
+        corpus = self.server.corpus
+        if self.headers.get('If-None-Match') == corpus.etag:
+            self.send_status(304)
+            return
+
+        page = int(params.get('page', 1))
+        pagelen = int(params.get('pagelen', 10))
+        matches = range(size)
+
+        # only `updated_on > "date"` queries are understood
+        updated = re.match(r'updated_on > "?([^"]*)"?$', params.get('q', ''))
+        if updated:
+            matches = [n for n in matches if get(n)['updated_on'] > updated.group(1)]
+
+        values = [get(n) for n in matches[(page - 1) * pagelen:page * pagelen]]
+        listing = {'pagelen': pagelen, 'size': len(matches), 'page': page, 'values': values}
+        if page * pagelen < len(matches):
+            listing['next'] = 'http://{}:{}{}?{}'.format(self.server.server_address[0], self.server.server_address[1],
+                                                         urlparse(self.path).path, urlencode(dict(params, page=page + 1)))
+        self.send_json(listing, headers={'ETag': corpus.etag})
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+      Local stand-in for the Atlassian (Confluence, Jira) and BitBucket APIs, for benchmarking the pipeline
+      without credentials or network. The server runs on a background thread once started.
+
+      base_url / api_url: Values of CONFLUENCE['BASE_URL'] and JIRA['BASE_URL'], and of BITBUCKET['API_URL'].
+      start: Serve requests on a daemon thread.
+      stop: Stop serving.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, corpus, latency=0.0, host='127.0.0.1', port=0):
+        super().__init__((host, port), StubHandler)
+        self.corpus = corpus
+        self.latency = latency
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return 'http://{}:{}'.format(*self.server_address[:2])
+
+    @property
+    def api_url(self):
+        return self.base_url + '/2.0'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name='stub-server', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    """
+        Runs the stub server in the foreground, for pointing a manually started API or main.py at it.
+    """
+
+    parser = argparse.ArgumentParser(description='Local stand-in for the Confluence, Jira and BitBucket APIs.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds added to every response')
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--issues', type=int, default=500)
+    parser.add_argument('--bitbucket-issues', type=int, default=200)
+    parser.add_argument('--commits', type=int, default=500)
+    parser.add_argument('--workspace', default='bench')
+    parser.add_argument('--repository', default='DB')
+    args = parser.parse_args()
+
+    corpus = StubCorpus(args.pages, args.issues, args.bitbucket_issues, args.commits, args.workspace, args.repository)
+    server = StubServer(corpus, args.latency, args.host, args.port)
+    print('> Serving on', server.base_url)
+    print("> CONFLUENCE['BASE_URL'] = JIRA['BASE_URL'] = '{}', BITBUCKET['API_URL'] = '{}'".format(server.base_url, server.api_url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
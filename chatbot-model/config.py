@@ -21,13 +21,139 @@ DO_EVAL = True
 PRINT_ALL_ANSWERS = True
 USERNAME = ''
 TOKEN = ''
+BITBUCKET_USERNAME = ''
+BITBUCKET_PASSWORD = ''
+DOC_RETRIEVER_KEY = 'confluence'
+DOMAIN = ''
+PROJECTKEY = ''
 CONFLUENCE = {
-    'CONFLUENCE_SUMMARY_DB': './confluence_summary_db.csv',
+    'BASE_URL': 'https://{domain}.atlassian.net',
+    'CONFLUENCE_SUMMARY_DB': './confluence_summary_db.sqlite',
+    'CONFLUENCE_SUMMARY_CSV': './confluence_summary_db.csv',
     'MIN_SUMMARY_WORDS': 200,
     'UPDATE_CONFLUENCE_SUMMARY': False,
+    'SYNC_INTERVAL': 900,
+    'SEARCH_LIMIT': 100,
+    'INGEST': {
+        'FETCH_WORKERS': 8,
+        'PROCESS_WORKERS': 0,
+        'MAX_IN_FLIGHT': 16,
+        'CHECKPOINT_EVERY': 20,
+        'REPORT_EVERY': 30,
+    },
     'CODE_PREFIX': '###code###',
     'SEPARATOR': '###SEP###',
 }
 JIRA = {
+    'BASE_URL': 'https://{domain}.atlassian.net',
     'FIELDS': 'summary,assignee,creator,created,priority,votes,status,customfield_10020,parent,subtasks,description,resolutiondate,timespent',
+    'PAGE_SIZE': 100,
+    'MAX_WORKERS': 8,
+    'REFRESH_INTERVAL': 60,
+    'FULL_REFRESH_INTERVAL': 3600,
+    'QUERY_MODE': True,
+    'QUERY_MAX_RESULTS': 200,
+    'MIN_QUERY_HITS': 10,
+}
+BITBUCKET = {
+    'API_URL': 'https://api.bitbucket.org/2.0',
+    'PAGE_LEN': 100,
+    'FULL_REFRESH_INTERVAL': 3600,
+}
+HTTP = {
+    'CONNECT_TIMEOUT': 5,
+    'READ_TIMEOUT': 30,
+    'POOL_SIZE': 16,
+    'MAX_PER_HOST': 16,
+    'MAX_RETRIES': 3,
+    'BACKOFF_BASE': 0.5,
+    'BACKOFF_MAX': 10,
+    'MAX_RETRY_AFTER': 60,
+}
+RETRIEVER_REGISTRY = {
+    'MAX_SIZE': 32,
+    'TTL': 3600,
+    'REVALIDATE_INTERVAL': 300,
+}
+ANSWER_EXTRACTOR = {
+    'BATCH_SIZE': 8,
+    'MAX_SEQ_LEN': 384,
+    'DOC_STRIDE': 128,
+    'MAX_ANSWER_LEN': 15,
+    'MAX_QUERY_LEN': 64,
+    'WINDOW_CACHE_SIZE': 20000,
+    'SCHEDULER': {
+        'ENABLED': True,
+        'MAX_BATCH_SIZE': 16,
+        'MAX_WAIT': 0.005,
+    },
+}
+CASCADE = {
+    'ENABLED': False,
+    'FAST_MODEL_TYPE': 'distilbert-base-uncased',
+    'FAST_MODEL_PATH': './distilbert/',
+    'THRESHOLD': 0.5,
+    'ESCALATE_TOPN': 2,
+    'LOG_EVERY': 100,
+}
+QA_BACKEND = {
+    'BACKEND': 'torch',
+    'PARITY_CHECK': True,
+    'PARITY_TOLERANCE': 0.05,
+}
+PASSAGE_INDEX = {
+    'PATH': './passage_index',
+    'MAX_DOCS': 100000,
+    'K1': 1.5,
+    'B': 0.75,
+    'DENSE': {
+        'ENABLED': False,
+        'MODEL': 'sentence-transformers/all-MiniLM-L6-v2',
+        'DTYPE': 'float16',
+        'BATCH_SIZE': 64,
+        'CANDIDATES': 20,
+        'WEIGHT': 0.5,
+    },
+}
+TOKEN_CACHE = {
+    'MAX_BYTES': 256 * 1024 * 1024,
+    'SPILL_PATH': None,
+    'BATCH_SIZE': 64,
+}
+ANSWER_CACHE = {
+    'MAX_SIZE': 1024,
+    'TTL': 600,
+}
+PIPELINE = {
+    'IO_WORKERS': 32,
+    'CPU_WORKERS': 4,
+    'DISCONNECT_POLL_INTERVAL': 0.5,
+    'DEFAULT_DEADLINE': 10,
+    'SOURCE_DEADLINES': {
+        'confluence': 15,
+    },
+}
+METRICS = {
+    'BUCKETS': [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30],
+    'SLOW_TRACE': 5,
+}
+PROFILING = {
+    'ENABLED': False,
+    'ADMIN_TOKEN': '',
+    'PROFILER': 'cprofile',
+    'OUTPUT_DIR': './profiles',
+    'RETURN_REPORT': True,
+    'TOP': 40,
+}
+SERVER = {
+    'HOST': '0.0.0.0',
+    'PORT': 8000,
+    'BACKGROUND_LOAD': True,
+    'WARMUP': True,
+    'RETRY_AFTER': 5,
+    'WORKERS': 2,
+    'PRELOAD': True,
+    'PRELOAD_SUMMARIZER': True,
+    'TORCH_THREADS': None,
+    'MEMORY_REPORT_INTERVAL': 300,
 }
@@ -0,0 +1,50 @@
+import argparse
+import logging
+import spacy
+
+import config
+from Components.document_retriever import ConfluenceDocumentRetriever
+
+
+def main():
+    """
+        Generates the summaries of all the pages of a confluence space, with parallel fetching and summarization.
+        Meant for the first run on large spaces, an interrupted run continues where it stopped when started again.
+    """
+
+    parser = argparse.ArgumentParser(description='Bulk summary generation for a confluence space.')
+    parser.add_argument('domain')
+    parser.add_argument('spacekey')
+    parser.add_argument('--username', default=config.USERNAME)
+    parser.add_argument('--token', default=config.TOKEN)
+    parser.add_argument('--fetch-workers', type=int, default=config.CONFLUENCE['INGEST']['FETCH_WORKERS'])
+    parser.add_argument('--process-workers', type=int, default=config.CONFLUENCE['INGEST']['PROCESS_WORKERS'])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    confluence = dict(config.CONFLUENCE)
+    confluence['SYNC_INTERVAL'] = None
+    confluence['INGEST'] = dict(confluence['INGEST'])
+    confluence['INGEST']['FETCH_WORKERS'] = args.fetch_workers
+    confluence['INGEST']['PROCESS_WORKERS'] = args.process_workers
+    confluence['INGEST']['MAX_IN_FLIGHT'] = max(confluence['INGEST']['MAX_IN_FLIGHT'], args.fetch_workers + 2 * args.process_workers)
+
+    SPACY_MODEL = 'en_core_web_sm'
+    nlp = spacy.load(SPACY_MODEL, disable=['ner', 'parser', 'textcat'])
+
+    retriever = ConfluenceDocumentRetriever(args.username, args.token, nlp, confluence, args.domain, args.spacekey)
+    if retriever.invalid:
+        print('Invalid username or password!')
+        return
+
+    print('> Listing pages...')
+    retriever.search_pages()
+    print('> {} pages found.'.format(len(retriever.page_ids)))
+
+    retriever.update_confluence_summary_db()
+    print('> Summary store updated.')
+
+
+if __name__ == "__main__":
+    main()
@@ -9,11 +9,13 @@ import config
 from SQUAD.squad_dataset import SquadDataset
 from SQUAD.squad_processor import read_squad, add_end_idx, add_token_positions
 from model import Model
-from utils import get_tokenizer, get_model, get_doc_retriever
+from utils import get_answer_extractor, get_source_retriever, get_doc_retriever_keys
 
 from Components.passage_retrieval import PassageRetrieval
 from Components.query_processor import QueryProcessor
-from Components.answer_extractor import AnswerExtractor
+from Components.answer_cache import AnswerCache
+from Components.metrics import Trace, get_metrics
+from Components.pipeline import QueryPipeline
 
 
 def main():
@@ -88,60 +90,48 @@ def main():
         nlp = spacy.load(SPACY_MODEL, disable=['ner', 'parser', 'textcat'])
         query_processor = QueryProcessor(nlp)
         
-        document_retriever = get_doc_retriever(config.USERNAME, config.TOKEN, nlp)
-        
         passage_retriever = PassageRetrieval(nlp)
 
-        tokenizer = get_tokenizer()
-        model = get_model()
-        answer_extractor = AnswerExtractor(tokenizer, model)
+        answer_extractor = get_answer_extractor()
+
+        answer_cache = AnswerCache(config.ANSWER_CACHE['MAX_SIZE'], config.ANSWER_CACHE['TTL'])
+        pipeline = QueryPipeline(query_processor, passage_retriever, answer_extractor, get_source_retriever,
+                                 get_doc_retriever_keys, config.PIPELINE, answer_cache)
 
         print('\nEnter "stop" in question to STOP.\n')
         while True:
-            main_start_time = time.time()
             question = input('\nEnter question > ')
 
             if question.lower() == 'stop':
                 break
 
-            start_time = time.time()
-            query = query_processor.generate_query(question)
-            print('---- query processor: {} sec ----'.format(time.time() - start_time))
-
-            start_time = time.time()
-            docs = None
-            if isinstance(document_retriever, list):
-                docs = []
-                for retriever in document_retriever:
-                    docs.extend(retriever.search(question))
-            else:
-                docs = document_retriever.search(question)
+            main_start_time = time.time()
+            trace = Trace(get_metrics())
+            response = pipeline.run(question, config.DOC_RETRIEVER_KEY, config.USERNAME, config.TOKEN,
+                                    config.BITBUCKET_USERNAME, config.BITBUCKET_PASSWORD, nlp, config.DOMAIN,
+                                    config.PROJECTKEY, trace=trace)
+            for span in trace.summary()['stages']:
+                stage = span['stage'] if span['source'] is None else '{} {}'.format(span['stage'], span['source'])
+                print('---- {}: {} sec ----'.format(stage, span['ms'] / 1000))
+            print('---- main: {} sec ----'.format(time.time() - main_start_time))
 
-            if len(docs) == 0:
-                print("Invalid username or password!")
+            if response['error'] is not None:
+                print(response['error'])
+                print(response['sources'])
                 break
-            print('---- doc retriever: {} sec ----'.format(time.time() - start_time))
-
-            start_time = time.time()
-            passage_retriever.fit(docs)
-            passages = passage_retriever.most_similar(question)
-            print('---- passage retriever: {} sec ----'.format(time.time() - start_time))
-
-            start_time = time.time()
-            answers = answer_extractor.extract(question, passages)
-            print('---- answer extractor: {} sec ----'.format(time.time() - start_time))
 
-            if answers[0]['text'].startswith(config.CONFLUENCE['CODE_PREFIX']):
-                answers[0]['answer'] = ' '.join(answers[0]['text'].split(' ')[1:])
-
-            print('---- main: {} sec ----'.format(time.time() - main_start_time))
-            
-            if config.PRINT_ALL_ANSWERS:
+            answers = response['answers']
+            if not answers:
+                print('No answer found in the retrieved passages.')
+            elif config.PRINT_ALL_ANSWERS:
                 for i in range(len(answers)):
                     print("{} > {}".format(i, answers[i]))
             else:
                 print(answers[0]['answer'])
 
+        pipeline.close()
+        passage_retriever.save()
+
 if __name__ == "__main__":
     main()
 
@@ -1,72 +1,42 @@
-import os
-import spacy
-from transformers import TrainingArguments, Trainer
+import argparse
+import json
+import logging
 
 import config
-from SQUAD.squad_dataset import SquadDataset
-from SQUAD.squad_processor import read_squad, add_end_idx, add_token_positions
-from model import Model
-from utils import get_tokenizer, get_model, get_doc_retriever
+from api import ServingState, create_app
 
-from Components.passage_retrieval import PassageRetrieval
-from Components.query_processor import QueryProcessor
-from Components.answer_extractor import AnswerExtractor
 
-import uvicorn
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-import nest_asyncio
-from pyngrok import ngrok
+def main():
+    """
+        Serves the model API (see api.create_app) with uvicorn. The model is loaded in the background after the server
+        has started, /ready tells when it can answer. With --measure-startup the components are loaded in the
+        foreground instead, and the duration and memory of every startup phase are printed as JSON.
+    """
 
+    parser = argparse.ArgumentParser(description='Model API server.')
+    parser.add_argument('--host', default=config.SERVER['HOST'])
+    parser.add_argument('--port', type=int, default=config.SERVER['PORT'])
+    parser.add_argument('--no-warmup', action='store_true')
+    parser.add_argument('--measure-startup', action='store_true')
+    args = parser.parse_args()
 
-SPACY_MODEL = 'en_core_web_sm'
-nlp = spacy.load(SPACY_MODEL, disable=['ner', 'parser', 'textcat'])
-query_processor = QueryProcessor(nlp)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 
-passage_retriever = PassageRetrieval(nlp)
+    if args.measure_startup:
+        state = ServingState()
+        state.load(warmup=not args.no_warmup)
+        print(json.dumps({'ready': state.ready.is_set(), 'error': state.error, 'startup': state.startup}, indent=2))
+        # only startup was measured, the passage index on disk is left as it is
+        state.close(save=False)
+        return
 
-tokenizer = get_tokenizer()
-model = get_model()
-answer_extractor = AnswerExtractor(tokenizer, model)
+    import uvicorn
 
+    # from pyngrok import ngrok
+    # ngrok_tunnel = ngrok.connect(args.port)
+    # print('Public URL:', ngrok_tunnel.public_url)
+    uvicorn.run(create_app(warmup=not args.no_warmup), port=args.port, host=args.host)
 
-app = FastAPI()
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=['*'],
-    allow_credentials=True,
-    allow_methods=['*'],
-    allow_headers=['*'],
-)
-
-@app.get('/query/')
-def get_answer(confluence_username: str, confluence_password: str, bitbucket_username: str, bitbucket_password: str, question: str, doc_retriever_key: str, domain: str, projectkey: str):
-    query = query_processor.generate_query(question)
-    document_retriever = get_doc_retriever(confluence_username, confluence_password, bitbucket_username, bitbucket_password, nlp, doc_retriever_key, domain, projectkey)
-    docs = None
-
-    if not isinstance(document_retriever, list):
-        docs = document_retriever.search(question)
-    else:
-        docs = []
-        for ret in document_retriever:
-            docs.extend(ret.search(question))
-
-    if len(docs) == 0:
-        return { 'answers': None, 'error': 'Invalid username or password! Type /restart to reset username and password.' }
-    
-    passage_retriever.fit(docs)
-    passages = passage_retriever.most_similar(question)
-    answers = answer_extractor.extract(question, passages)
-    
-    if answers[0]['text'].startswith(config.CONFLUENCE['CODE_PREFIX']):
-        answers[0]['answer'] = ' '.join(answers[0]['text'].split(' ')[1:])
-
-    return {'answers': answers, 'error': None }
-
-
-# ngrok_tunnel = ngrok.connect(8000)
-# print('Public URL:', ngrok_tunnel.public_url)
-nest_asyncio.apply()
-uvicorn.run(app, port=8000, host='0.0.0.0')
\ No newline at end of file
+if __name__ == "__main__":
+    main()
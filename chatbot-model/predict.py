@@ -1,18 +1,15 @@
-import config
-from transformers import QuestionAnsweringPipeline
 from utils import get_tokenizer, get_model
 
+from Components.answer_extractor import AnswerExtractor
+
 
 # Create an instance of Tokenizer and Model
 tokenizer = get_tokenizer()
 model = get_model()
 
-# Loading the trained Tokenizer and Model
-tokenizer = tokenizer.from_pretrained(config.MODEL_PATH) 
-model = model.from_pretrained(config.MODEL_PATH)
-
-# NLP Pipeline for Question-Answering
-nlp = QuestionAnsweringPipeline(model=model, tokenizer=tokenizer)
+# Loading the trained Tokenizer and Model, run on the inference backend chosen by QA_BACKEND
+answer_extractor = AnswerExtractor(tokenizer, model)
+print('QA backend >', answer_extractor.backend.name)
 
 # To test the Model on sample contexts and questions
 context = input('Enter context > ')
@@ -22,7 +19,7 @@ while True:
     question = input('\nEnter question > ')
     if question.lower() == 'stop':
         break
-    answer = nlp(question=question, context=context)
+    answers = answer_extractor.extract(question, [context])
+    answer = answers[0] if answers else None
     print('answer > ', answer)
-    
-    
\ No newline at end of file
+
@@ -0,0 +1,192 @@
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import time
+
+import config
+from api import ServingState, create_app
+from Components.process_memory import memory_report
+
+
+logger = logging.getLogger('serve')
+
+
+def bind(host, port, backlog=2048):
+    """
+        Returns a listening socket shared by all workers, the kernel spreads the connections over them.
+    """
+
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(worker, sock, state, args):
+    """
+        Serves the app on the shared socket in a forked worker process, until uvicorn stops on SIGTERM / SIGINT.
+    """
+
+    import torch
+    import uvicorn
+
+    # every worker gets its share of the cores instead of all of them
+    torch.set_num_threads(args.torch_threads)
+
+    # the workers inherit the handlers of the supervisor, uvicorn installs its own
+    for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGUSR1):
+        signal.signal(sig, signal.SIG_DFL)
+
+    state.worker = worker
+    app = create_app(background=False, warmup=args.warmup, state=state, save_index=worker == 0)
+    server = uvicorn.Server(uvicorn.Config(app, host=args.host, port=args.port))
+    server.run(sockets=[sock])
+
+
+class Supervisor:
+    """
+      Prefork server: loads the model API once, then forks WORKERS uvicorn workers that serve a shared socket.
+
+      Preloaded before the fork (PRELOAD), the model weights, spaCy, the GPT-2 summarizer (PRELOAD_SUMMARIZER) and the
+      passage index are inherited by every worker as copy-on-write pages, which stay shared as long as they are only
+      read - inference does not write to the weights, and gc.freeze() keeps the garbage collector from touching the
+      objects of the parent. The passage index files are memory-mapped, so their pages live in the page cache and are
+      shared even by workers that load them on their own. New passages fitted by a worker go to its own copy, only
+      worker 0 saves the index on shutdown.
+
+      Without PRELOAD, and with the onnx backend (ONNX Runtime sessions do not survive fork), every worker loads its
+      own copy. The models run no forward pass before the fork: the parity check of the quantized and torchscript
+      backends and the warm-up run in every worker. The supervisor runs torch on a single thread, so that no
+      OpenMP / MKL thread pool (for quantizing the model or tracing it to TorchScript) exists when it forks.
+
+      A worker that dies is started again. The unique and shared memory of the supervisor and of every worker is
+      logged every MEMORY_REPORT_INTERVAL seconds and on SIGUSR1 (see memory_report).
+
+      run: Preload, fork the workers and supervise them until SIGTERM / SIGINT.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.workers = {}
+        self.running = True
+        self.report_requested = False
+
+    def preload(self):
+        state = ServingState()
+        if not self.args.preload:
+            return state
+        if config.QA_BACKEND['BACKEND'] == 'onnx':
+            logger.warning('The onnx QA backend cannot be preloaded, every worker loads its own model')
+            return state
+
+        import torch
+        torch.set_num_threads(1)
+
+        state.load(warmup=False, verify=False)
+        if state.error is not None:
+            raise RuntimeError('Preloading the model API failed: ' + state.error)
+        if config.SERVER['PRELOAD_SUMMARIZER']:
+            from utils import get_summarizer
+            get_summarizer()
+
+        # objects created so far are never collected, so the collector does not write to their pages
+        gc.collect()
+        gc.freeze()
+        return state
+
+    def spawn(self, worker, sock, state):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(worker, sock, state, self.args)
+            except BaseException:
+                logger.exception('Worker %d failed', worker)
+                code = 1
+            finally:
+                os._exit(code)
+
+        self.workers[pid] = worker
+        logger.info('Started worker %d (pid %d)', worker, pid)
+
+    def stop(self, signum, frame):
+        self.running = False
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def request_report(self, signum, frame):
+        self.report_requested = True
+
+    def report(self):
+        processes = {'supervisor': os.getpid()}
+        processes.update(('worker {}'.format(worker), pid) for pid, worker in sorted(self.workers.items(),
+                                                                                      key=lambda item: item[1]))
+        logger.info('Memory:\n%s', memory_report(processes))
+
+    def run(self):
+        sock = bind(self.args.host, self.args.port)
+        state = self.preload()
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGUSR1, self.request_report)
+
+        for worker in range(self.args.workers):
+            self.spawn(worker, sock, state)
+        logger.info('Serving on %s:%d with %d workers', self.args.host, self.args.port, self.args.workers)
+
+        interval = self.args.memory_report_interval
+        next_report = time.monotonic() + interval if interval else None
+        while self.workers:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid:
+                worker = self.workers.pop(pid)
+                if self.running:
+                    logger.error('Worker %d (pid %d) exited with status %d, restarting it', worker, pid, status)
+                    time.sleep(1)
+                    self.spawn(worker, sock, state)
+                continue
+
+            if self.report_requested or (next_report is not None and time.monotonic() >= next_report):
+                self.report_requested = False
+                self.report()
+                if next_report is not None:
+                    next_report = time.monotonic() + interval
+            time.sleep(0.5)
+
+        sock.close()
+        logger.info('All workers stopped')
+
+
+def main():
+    """
+        Serves the model API with several worker processes sharing one copy of the models (see Supervisor).
+    """
+
+    parser = argparse.ArgumentParser(description='Multi-worker model API server.')
+    parser.add_argument('--host', default=config.SERVER['HOST'])
+    parser.add_argument('--port', type=int, default=config.SERVER['PORT'])
+    parser.add_argument('--workers', type=int, default=config.SERVER['WORKERS'])
+    parser.add_argument('--no-preload', dest='preload', action='store_false', default=config.SERVER['PRELOAD'])
+    parser.add_argument('--no-warmup', dest='warmup', action='store_false', default=config.SERVER['WARMUP'])
+    parser.add_argument('--torch-threads', type=int, default=config.SERVER['TORCH_THREADS'])
+    parser.add_argument('--memory-report-interval', type=float, default=config.SERVER['MEMORY_REPORT_INTERVAL'])
+    args = parser.parse_args()
+
+    if args.torch_threads is None:
+        args.torch_threads = max(1, (os.cpu_count() or 1) // args.workers)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(process)d %(levelname)s %(message)s')
+    Supervisor(args).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+
+# the modules of the project are imported the way main.py and api.py import them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+WORDS = ('the deployment scripts are maintained by platform team they run every night and push latest build of '
+         'chatbot to staging environment who maintains when was issue reported what is default port api served '
+         'uvicorn it listens on all interfaces can be changed in model py bug login fails safari john smith this '
+         'assigned jane doe currently open state').split()
+
+
+@pytest.fixture(scope='session')
+def qa_model_path(tmp_path_factory):
+    """
+        Directory of a tiny randomly initialized BERT question answering model and its tokenizer.
+    """
+
+    torch = pytest.importorskip('torch')
+    transformers = pytest.importorskip('transformers')
+
+    path = tmp_path_factory.mktemp('qa_model')
+    vocab = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]', '.', ',', '-', ':', '?'] + sorted(set(WORDS))
+    vocab += [str(digit) for digit in range(10)]
+    with open(str(path / 'vocab.txt'), 'w') as f:
+        f.write('\n'.join(vocab) + '\n')
+
+    torch.manual_seed(0)
+    model_config = transformers.BertConfig(vocab_size=len(vocab), hidden_size=32, num_hidden_layers=2,
+                                           num_attention_heads=2, intermediate_size=64, max_position_embeddings=512)
+    transformers.BertForQuestionAnswering(model_config).save_pretrained(str(path))
+    transformers.BertTokenizerFast(str(path / 'vocab.txt')).save_pretrained(str(path))
+    return str(path)
@@ -0,0 +1,80 @@
+import pytest
+
+import config
+
+
+def make_extractor(model_path):
+    transformers = pytest.importorskip('transformers')
+    from Components.answer_extractor import AnswerExtractor
+
+    return AnswerExtractor(transformers.BertTokenizerFast, transformers.BertForQuestionAnswering, model_path=model_path)
+
+
+@pytest.mark.parametrize('backend', ['quantized', 'torchscript'])
+def test_parity_check_of_non_torch_backend(qa_model_path, monkeypatch, backend):
+    from Components.qa_backend import PARITY_SAMPLES
+
+    monkeypatch.setitem(config.QA_BACKEND, 'BACKEND', backend)
+    monkeypatch.setitem(config.QA_BACKEND, 'PARITY_CHECK', True)
+
+    extractor = make_extractor(qa_model_path)
+
+    # the backend either passed the check or was replaced by the fp32 model
+    assert extractor.backend.name in (backend, 'torch')
+    question, context = PARITY_SAMPLES[0]
+    answers = extractor.extract(question, [context])
+    assert answers and answers[0]['text'] == context
+
+
+def test_parity_check_left_for_verify(qa_model_path, monkeypatch):
+    from Components.answer_extractor import AnswerExtractor
+
+    monkeypatch.setitem(config.QA_BACKEND, 'BACKEND', 'quantized')
+    monkeypatch.setitem(config.QA_BACKEND, 'PARITY_CHECK', True)
+    checks = []
+    monkeypatch.setattr(AnswerExtractor, 'check_parity', lambda self, tolerance: checks.append(tolerance))
+
+    transformers = pytest.importorskip('transformers')
+    extractor = AnswerExtractor(transformers.BertTokenizerFast, transformers.BertForQuestionAnswering,
+                                model_path=qa_model_path, verify=False)
+    assert checks == []
+
+    extractor.verify()
+    extractor.verify()
+    assert checks == [config.QA_BACKEND['PARITY_TOLERANCE']]
+
+
+def test_scores_match_the_pipeline(qa_model_path, monkeypatch):
+    from Components.qa_backend import PARITY_SAMPLES
+
+    monkeypatch.setitem(config.QA_BACKEND, 'BACKEND', 'torch')
+    extractor = make_extractor(qa_model_path)
+
+    for question, context in PARITY_SAMPLES:
+        expected = extractor.nlp(question=question, context=context)
+        answers = extractor.extract_batched(question, [context], inline=True)
+        assert answers[0]['score'] == pytest.approx(expected['score'], rel=1e-4)
+
+
+def test_answer_followed_by_punctuation_matches_the_pipeline(qa_model_path, monkeypatch):
+    pytest.importorskip('torch')
+    from transformers.modeling_outputs import QuestionAnsweringModelOutput
+
+    monkeypatch.setitem(config.QA_BACKEND, 'BACKEND', 'torch')
+    extractor = make_extractor(qa_model_path)
+    answer_id = extractor.tokenizer.convert_tokens_to_ids('uvicorn')
+
+    # a model that always answers with the word uvicorn, which is followed by a comma in the passage
+    def forward(input_ids=None, attention_mask=None, token_type_ids=None, **kwargs):
+        logits = (input_ids == answer_id).float() * 10
+        return QuestionAnsweringModelOutput(start_logits=logits, end_logits=logits)
+
+    monkeypatch.setattr(extractor.model, 'forward', forward)
+    question, context = 'What is the API served by?', 'The API is served by uvicorn, it listens on all interfaces.'
+
+    expected = extractor.nlp(question=question, context=context)
+    answers = extractor.extract_batched(question, [context], inline=True)
+
+    assert expected['answer'] == 'uvicorn'
+    assert (answers[0]['answer'], answers[0]['start'], answers[0]['end']) == \
+        (expected['answer'], expected['start'], expected['end'])
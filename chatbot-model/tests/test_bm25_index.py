@@ -0,0 +1,123 @@
+import math
+import random
+
+import pytest
+
+from Components.bm25_index import BM25Index
+
+
+VOCABULARY = 'deploy build staging login safari bug port api uvicorn team night script issue open'.split()
+
+
+def naive_scores(documents, tokens, k1=1.5, b=0.75):
+    """
+        BM25 of the query tokens against every document of a {key: tokens} dictionary, term by term.
+    """
+
+    avgdl = sum(len(document) for document in documents.values()) / len(documents)
+    scores = {}
+    for key, document in documents.items():
+        score = 0.0
+        for term in tokens:
+            doc_freq = sum(term in other for other in documents.values())
+            idf = math.log((len(documents) - doc_freq + 0.5) / (doc_freq + 0.5) + 1)
+            tf = document.count(term)
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(document) / avgdl))
+        scores[key] = score
+    return scores
+
+
+def make_documents(rng, keys):
+    return {key: [rng.choice(VOCABULARY) for _ in range(rng.randint(1, 12))] for key in keys}
+
+
+def assert_scores(index, documents, queries, subset=None):
+    for tokens in queries:
+        expected = naive_scores(documents, tokens)
+        scores = dict(index.search(tokens, len(index), subset))
+        assert scores.keys() == expected.keys()
+        for key, score in expected.items():
+            assert scores[key] == pytest.approx(score, rel=1e-5, abs=1e-6)
+
+
+@pytest.fixture
+def queries():
+    rng = random.Random(1)
+    return [['deploy', 'staging'], ['login', 'safari', 'login'], ['unknown'], [rng.choice(VOCABULARY) for _ in range(4)]]
+
+
+def test_scores_match_naive_bm25_after_updates(queries):
+    rng = random.Random(0)
+    index = BM25Index()
+    documents = make_documents(rng, ['doc-{}'.format(i) for i in range(40)])
+    index.add(documents.items())
+    assert_scores(index, documents, queries)
+
+    # removed documents are only tombstoned
+    removed = ['doc-{}'.format(i) for i in range(0, 40, 3)]
+    index.remove(removed)
+    for key in removed:
+        documents.pop(key)
+    assert_scores(index, documents, queries)
+
+    # pending documents, some of them replacing indexed ones
+    added = make_documents(rng, ['doc-1', 'doc-2', 'new-0', 'new-1', 'new-2'])
+    index.add(added.items())
+    documents.update(added)
+    assert_scores(index, documents, queries)
+
+    index.compact()
+    assert index.main.shape[1] == len(documents) and not index.pending
+    assert_scores(index, documents, queries)
+
+    # removing more than half of the documents compacts the index
+    removed = list(documents)[:len(documents) // 2 + 1]
+    index.remove(removed)
+    for key in removed:
+        documents.pop(key)
+    assert index.main.shape[1] == len(documents)
+    assert_scores(index, documents, queries)
+
+
+def test_scores_match_naive_bm25_after_save_and_load(tmp_path, queries):
+    rng = random.Random(0)
+    index = BM25Index()
+    documents = make_documents(rng, ['doc-{}'.format(i) for i in range(30)])
+    index.add(documents.items())
+    index.remove(['doc-3', 'doc-4'])
+    documents.pop('doc-3')
+    documents.pop('doc-4')
+
+    path = str(tmp_path / 'bm25')
+    index.save(path)
+    loaded = BM25Index.load(path)
+    assert not loaded.doc_freq.flags.writeable
+    assert_scores(loaded, documents, queries)
+
+    # a memory-mapped index can be updated and saved again over the files it maps
+    added = make_documents(rng, ['doc-5', 'new-0'])
+    loaded.add(added.items())
+    loaded.remove(['doc-6'])
+    documents.update(added)
+    documents.pop('doc-6')
+    assert_scores(loaded, documents, queries)
+
+    loaded.save(path)
+    assert_scores(BM25Index.load(path), documents, queries)
+
+
+def test_subset_scores_match_naive_bm25_over_the_subset(queries):
+    rng = random.Random(0)
+    index = BM25Index()
+    documents = make_documents(rng, ['doc-{}'.format(i) for i in range(30)])
+    index.add(documents.items())
+    index.compact()
+    added = make_documents(rng, ['new-{}'.format(i) for i in range(5)])
+    index.add(added.items())
+    documents.update(added)
+    index.remove(['doc-0'])
+    documents.pop('doc-0')
+
+    # compacted and pending documents, IDF and length norms of the subset only
+    keys = ['doc-1', 'doc-2', 'doc-7', 'doc-11', 'new-0', 'new-3']
+    assert_scores(index, {key: documents[key] for key in keys}, queries, index.subset(keys))
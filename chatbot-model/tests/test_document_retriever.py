@@ -0,0 +1,138 @@
+import pytest
+
+import config
+from benchmarks.stub_server import StubCorpus, StubServer
+
+
+@pytest.fixture
+def stub_server():
+    server = StubServer(StubCorpus(pages=5, issues=250, bitbucket_issues=5, commits=5, workspace='bench',
+                                   repository='DB')).start()
+    yield server
+    server.stop()
+
+
+class Token:
+
+    def __init__(self, text):
+        self.text = text
+        self.lemma_ = text.lower()
+        self.pos_ = 'X'
+
+
+class Pipeline:
+
+    def pipe(self, texts, batch_size):
+        return [[Token(word) for word in text.split()] for text in texts]
+
+
+@pytest.fixture
+def confluence(stub_server, tmp_path):
+    from Components.document_retriever import ConfluenceDocumentRetriever
+    from Components.summary_store import SummaryStore
+
+    settings = dict(config.CONFLUENCE, BASE_URL=stub_server.base_url, UPDATE_CONFLUENCE_SUMMARY=True,
+                    SYNC_INTERVAL=None, CONFLUENCE_SUMMARY_CSV=None,
+                    CONFLUENCE_SUMMARY_DB=str(tmp_path / 'summaries.sqlite'))
+    # a page imported from the summary CSV (no space), of another space
+    SummaryStore(settings['CONFLUENCE_SUMMARY_DB']).upsert([(999, 'other space', 'other space', None, None)])
+
+    retriever = ConfluenceDocumentRetriever('bench', 'bench', Pipeline(), settings, 'bench', 'DB')
+    yield retriever
+    retriever.close()
+
+
+@pytest.fixture
+def jira(stub_server):
+    from Components.document_retriever import JiraDocumentRetriever
+
+    settings = dict(config.JIRA, BASE_URL=stub_server.base_url, REFRESH_INTERVAL=0, MIN_QUERY_HITS=1)
+    return JiraDocumentRetriever('bench', 'bench', settings, 'bench', 'DB')
+
+
+def test_jira_revalidate_without_full_corpus_only_counts_updates(jira):
+    docs = jira.search('Who fixed the login on Safari?', 'login safari')
+    assert len(docs) > 1 and jira.stories == {}
+
+    version = jira.corpus_version
+    jira.revalidate()
+
+    # the stub ignores the `updated >=` clause, so every item counts as updated
+    assert jira.corpus_version == version + 1
+    assert jira.stories == {} and jira.last_full_refresh is None
+
+
+def test_jira_revalidate_with_full_corpus_refreshes(jira):
+    jira.refresh()
+    assert len(jira.stories) == 250
+
+    jira.revalidate()
+    assert len(jira.stories) == 250
+
+
+def test_confluence_pages_before_first_sync_exclude_imported_pages(confluence):
+    assert '999' not in confluence.page_ids
+
+
+def test_confluence_first_search_uses_pages_imported_from_csv(stub_server, tmp_path):
+    import csv
+    from Components.document_retriever import ConfluenceDocumentRetriever
+
+    # summaries of a previous version, without the space of the pages
+    csv_path = str(tmp_path / 'summaries.csv')
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['page_id', 'summary', 'passages'])
+        for n in range(5):
+            writer.writerow([100000 + n, 'the chatbot is deployed every night', 'Deployment notes of page {}.'.format(n)])
+
+    settings = dict(config.CONFLUENCE, BASE_URL=stub_server.base_url, UPDATE_CONFLUENCE_SUMMARY=False,
+                    SYNC_INTERVAL=3600, CONFLUENCE_SUMMARY_CSV=csv_path,
+                    CONFLUENCE_SUMMARY_DB=str(tmp_path / 'summaries.sqlite'))
+    retriever = ConfluenceDocumentRetriever('bench', 'bench', Pipeline(), settings, 'bench', 'DB')
+    try:
+        docs = retriever.search('How is the chatbot deployed?')
+    finally:
+        retriever.close()
+
+    assert docs and all(doc.startswith('Deployment notes of page') for doc in docs)
+
+
+def test_confluence_summary_index_is_kept_when_no_page_changed(confluence):
+    confluence.sync()
+    confluence.search('How is the chatbot deployed?')
+    summary_index = confluence.summary_index
+    version = confluence.corpus_version
+
+    confluence.sync()
+    confluence.search('How is the chatbot deployed?')
+
+    assert confluence.corpus_version == version
+    assert confluence.summary_index is summary_index
+
+
+def test_jira_keyword_search_is_paginated(stub_server):
+    from Components.document_retriever import JiraDocumentRetriever
+
+    settings = dict(config.JIRA, BASE_URL=stub_server.base_url, PAGE_SIZE=20, QUERY_MAX_RESULTS=50, MIN_QUERY_HITS=1)
+    jira = JiraDocumentRetriever('bench', 'bench', settings, 'bench', 'DB')
+
+    # 84 of the 250 stub issues match
+    assert len(jira.search_candidates('login safari')) == 50
+    assert jira.total == 250
+
+
+def test_jira_keyword_search_failure_falls_back_to_all_items(jira, monkeypatch):
+    import requests
+
+    search_items_page = jira.search_items_page
+
+    def failing(jql, start, max_results=None):
+        if 'text ~' in jql:
+            raise requests.HTTPError('400 Client Error')
+        return search_items_page(jql, start, max_results)
+
+    monkeypatch.setattr(jira, 'search_items_page', failing)
+    docs = jira.search('Who fixed the login on Safari?', 'login safari')
+
+    assert len(docs) == 251 and len(jira.stories) == 250
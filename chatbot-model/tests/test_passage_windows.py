@@ -0,0 +1,27 @@
+from Components.passage_windows import PassageWindows
+
+
+class Tokenizer:
+    model_input_names = ['input_ids', 'attention_mask']
+
+
+def test_windows_start_every_doc_stride_tokens():
+    # windows of 13 - 0 - 3 = 10 tokens
+    windows = PassageWindows(Tokenizer(), max_seq_len=13, max_query_len=0, doc_stride=4, max_entries=10)
+    tokens = list(range(25))
+
+    split = windows.split(tokens, [(token, token + 1) for token in tokens])
+
+    assert [list(input_ids) for input_ids, _ in split] == [tokens[0:10], tokens[4:14], tokens[8:18], tokens[12:22],
+                                                         tokens[16:25]]
+    assert [offsets[0][0] for _, offsets in split] == [0, 4, 8, 12, 16]
+
+
+def test_doc_stride_is_capped_at_the_window_length():
+    windows = PassageWindows(Tokenizer(), max_seq_len=13, max_query_len=0, doc_stride=50, max_entries=10)
+    tokens = list(range(25))
+
+    split = windows.split(tokens, [(token, token + 1) for token in tokens])
+
+    # no token is skipped
+    assert [list(input_ids) for input_ids, _ in split] == [tokens[0:10], tokens[10:20], tokens[20:25]]
@@ -0,0 +1,87 @@
+import asyncio
+import threading
+
+import config
+from Components.metrics import get_metrics
+from Components.pipeline import QueryPipeline
+
+
+class QueryProcessor:
+
+    def generate_query(self, question):
+        return question.split()
+
+    def normalize(self, question):
+        return question.lower()
+
+
+class PassageRetrieval:
+
+    def fit(self, docs):
+        self.docs = docs
+
+    def most_similar(self, question):
+        return list(self.docs)
+
+
+class Retriever:
+
+    def search(self, question, query):
+        return ['The deployment scripts are maintained by the platform team.', 'The API listens on port 8000.']
+
+
+class CascadeExtractor:
+    """
+        Scores all passages at once, like CascadeAnswerExtractor (no extract_iter).
+    """
+
+    def __init__(self):
+        self.threads = []
+
+    def extract(self, question, passages, inline=False):
+        self.threads.append(threading.current_thread().name)
+        return [{'score': 1.0 / (i + 1), 'answer': passage.split()[0], 'text': passage}
+                for i, passage in enumerate(passages)]
+
+
+def make_pipeline(extractor):
+    return QueryPipeline(QueryProcessor(), PassageRetrieval(), extractor,
+                         lambda source, *retriever_args, build=True: Retriever(), lambda key: [key], config.PIPELINE)
+
+
+def cancelled_traces():
+    queries = get_metrics().histogram('chatbot_query_duration_seconds', 'Duration of answering a question', ('result',))
+    counts, _ = queries.values.get(('cancelled',), ([0], 0.0))
+    return sum(counts)
+
+
+def test_stream_runs_batch_extractor_off_the_event_loop():
+    extractor = CascadeExtractor()
+    pipeline = make_pipeline(extractor)
+
+    async def stream():
+        return [event async for event in pipeline.astream('Who maintains the scripts?', 'jira')]
+
+    events = asyncio.run(stream())
+    pipeline.close()
+
+    assert [event for event, _ in events] == ['retrieval', 'passages', 'answer', 'answer', 'done']
+    assert extractor.threads and all(name.startswith('pipeline-cpu') for name in extractor.threads)
+    assert events[-1][1]['answers'][0]['score'] == 1.0
+
+
+def test_stream_closed_by_the_client_ends_the_trace_as_cancelled():
+    pipeline = make_pipeline(CascadeExtractor())
+    before = cancelled_traces()
+
+    async def disconnect():
+        stream = pipeline.astream('Who maintains the scripts?', 'jira')
+        event, data = await stream.__anext__()
+        await stream.aclose()
+        return event, data
+
+    event, data = asyncio.run(disconnect())
+    pipeline.close()
+
+    assert event == 'retrieval' and data['trace_id']
+    assert cancelled_traces() == before + 1
@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+
+def touch(path, mtime):
+    with open(path, 'a'):
+        pass
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.mark.parametrize('source', ['pytorch_model.bin', 'model.safetensors', 'model.pt', 'config.json'])
+def test_artifact_older_than_a_model_file_is_stale(tmp_path, source):
+    pytest.importorskip('torch')
+    from Components.qa_backend import TorchScriptBackend, is_stale
+
+    artifact = str(tmp_path / TorchScriptBackend.FILE)
+    touch(str(tmp_path / 'vocab.txt'), 300)
+    touch(artifact, 200)
+    assert not is_stale(artifact, str(tmp_path))
+
+    touch(str(tmp_path / source), 300)
+    assert is_stale(artifact, str(tmp_path))
+
+
+def test_exported_artifacts_are_not_model_files(tmp_path):
+    pytest.importorskip('torch')
+    from Components.qa_backend import OnnxBackend, TorchScriptBackend, is_stale
+
+    touch(str(tmp_path / 'model.safetensors'), 100)
+    touch(str(tmp_path / OnnxBackend.FILE), 200)
+    touch(str(tmp_path / TorchScriptBackend.FILE), 300)
+
+    assert not is_stale(str(tmp_path / OnnxBackend.FILE), str(tmp_path))
+    assert is_stale(str(tmp_path / 'missing.onnx'), str(tmp_path))
@@ -0,0 +1,40 @@
+import os
+
+from Components.token_cache import TokenCache
+
+
+class Token:
+
+    def __init__(self, text):
+        self.text = text
+        self.lemma_ = text.lower()
+        self.pos_ = 'X'
+
+
+class Pipeline:
+
+    def pipe(self, texts, batch_size):
+        return [[Token(word) for word in text.split()] for text in texts]
+
+
+def test_spill_connection_is_opened_again_after_fork(tmp_path):
+    cache = TokenCache(Pipeline(), max_bytes=1, spill_path=str(tmp_path / 'tokens.sqlite'))
+    assert cache.spill is None
+
+    # the first text is evicted to the spill file by the second one
+    cache.tokenize_many(['Deployment scripts', 'Platform team'])
+    parent = cache.spill
+    assert parent is not None
+
+    pid = os.fork()
+    if pid == 0:
+        ok = False
+        try:
+            ok = cache.spill is None and cache.tokenize('Deployment scripts') == ['deployment', 'scripts']
+            ok = ok and cache.spill is not None and cache.spill is not parent
+        finally:
+            os._exit(0 if ok else 1)
+
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+    assert cache.spill is parent and cache.tokenize('Platform team') == ['platform', 'team']
@@ -1,8 +1,13 @@
+import threading
+
 import config
+from summarizer import TransformerSummarizer
 from transformers import BertTokenizerFast, BertForQuestionAnswering
 from transformers import DistilBertTokenizerFast, DistilBertForQuestionAnswering
 from transformers import AlbertTokenizerFast, AlbertForQuestionAnswering
 from Components.document_retriever import ConfluenceDocumentRetriever, JiraDocumentRetriever, BitBucketRetriever
+from Components.retriever_registry import RetrieverRegistry
+from Components.answer_extractor import AnswerExtractor, CascadeAnswerExtractor
 
 
 
@@ -24,45 +29,109 @@ model = {
 
 # Doc Retriever Classes
 doc_retriever = {
-    'confluence': lambda username, password, nlp, domain, projectkey: ConfluenceDocumentRetriever(username, password, nlp, config.CONFLUENCE, domain, projectkey),
+    'confluence': lambda username, password, nlp, domain, projectkey: ConfluenceDocumentRetriever(username, password, nlp, config.CONFLUENCE, domain, projectkey, get_summarizer()),
     'jira': lambda username, password, nlp, domain, projectkey: JiraDocumentRetriever(username, password, config.JIRA, domain, projectkey),
-    'bitbucket': lambda username, password, nlp, domain, projectkey: BitBucketRetriever(username, password, domain, projectkey),
+    'bitbucket': lambda username, password, nlp, domain, projectkey: BitBucketRetriever(username, password, config.BITBUCKET, domain, projectkey),
 }
 
-def get_tokenizer():
+# Shared instances, created on first use
+_summarizer = None
+_retriever_registry = None
+_lock = threading.Lock()
+
+
+def get_tokenizer(model_type=None):
     """
-        Returns an object to load pretrained Tokenizer according to MODEL_TYPE config variable.
+        Returns an object to load pretrained Tokenizer according to model_type (MODEL_TYPE config variable by default).
     """
     
-    return tokenizer[config.MODEL_TYPE]
+    return tokenizer[model_type or config.MODEL_TYPE]
 
 
-def get_model():
+def get_model(model_type=None):
     """
-        Returns an object to load pretrained Model according to MODEL_TYPE config variable.
+        Returns an object to load pretrained Model according to model_type (MODEL_TYPE config variable by default).
     """
     
-    return model[config.MODEL_TYPE]
+    return model[model_type or config.MODEL_TYPE]
+
+
+def get_answer_extractor(verify=True):
+    """
+        Returns the AnswerExtractor of the MODEL_TYPE model in MODEL_PATH or, if the CASCADE config variable is enabled,
+        a CascadeAnswerExtractor that puts the FAST_MODEL_TYPE model in FAST_MODEL_PATH in front of it.
+        With verify=False the parity check of the QA backend is left to its verify().
+    """
+
+    accurate = AnswerExtractor(get_tokenizer(), get_model(), verify=verify)
+    if not config.CASCADE['ENABLED']:
+        return accurate
+
+    fast_model_type = config.CASCADE['FAST_MODEL_TYPE']
+    fast = AnswerExtractor(get_tokenizer(fast_model_type), get_model(fast_model_type),
+                           model_path=config.CASCADE['FAST_MODEL_PATH'], verify=verify)
+    return CascadeAnswerExtractor(fast, accurate, config.CASCADE)
+
+
+def get_summarizer():
+    """
+        Returns the GPT-2 summarizer shared by all Confluence retrievers of this process.
+    """
+
+    global _summarizer
+    with _lock:
+        if _summarizer is None:
+            _summarizer = TransformerSummarizer(transformer_type="GPT2", transformer_model_key="gpt2-medium")
+    return _summarizer
+
+
+def get_retriever_registry():
+    """
+        Returns the process-wide RetrieverRegistry configured by the RETRIEVER_REGISTRY config variable.
+    """
+
+    global _retriever_registry
+    with _lock:
+        if _retriever_registry is None:
+            _retriever_registry = RetrieverRegistry(
+                doc_retriever,
+                max_size=config.RETRIEVER_REGISTRY['MAX_SIZE'],
+                ttl=config.RETRIEVER_REGISTRY['TTL'],
+                revalidate_interval=config.RETRIEVER_REGISTRY['REVALIDATE_INTERVAL'],
+            )
+    return _retriever_registry
+
+
+def get_doc_retriever_keys(doc_retriever_key):
+    """
+        Returns the sources searched for doc_retriever_key - every source for "all".
+    """
+
+    return list(doc_retriever) if doc_retriever_key == "all" else [doc_retriever_key]
+
+
+def get_source_retriever(source, confluence_username, confluence_password, bitbucket_username, bitbucket_password, nlp, domain, projectkey, build=True):
+    """
+        Returns the DocumentRetriever of a single source (confluence OR jira OR bitbucket) from the RetrieverRegistry.
+        BitBucket uses its own credentials, Confluence and Jira share the Atlassian ones.
+        With build=False, None is returned instead of building a retriever that is not cached yet.
+    """
+
+    registry = get_retriever_registry()
+
+    if source == "bitbucket":
+        return registry.get(source, bitbucket_username, bitbucket_password, nlp, domain, projectkey, build)
+    return registry.get(source, confluence_username, confluence_password, nlp, domain, projectkey, build)
+
 
 def get_doc_retriever(confluence_username, confluence_password, bitbucket_username, bitbucket_password, nlp, doc_retriever_key, domain, projectkey):
     """
-        Returns a DocumentRetriever based on doc_retriever_key (confluence OR jira OR BitBucket).
+        Returns a DocumentRetriever based on doc_retriever_key (confluence OR jira OR BitBucket), or a list of
+        the retrievers of every source for "all".
+        Retrievers are cached in the process-wide RetrieverRegistry, so repeated questions reuse them.
     """
 
-    if doc_retriever_key != "all":
-        if doc_retriever_key == "bitbucket":
-            return doc_retriever[doc_retriever_key](bitbucket_username, bitbucket_password, nlp, domain, projectkey)     
-        else:
-            return doc_retriever[doc_retriever_key](confluence_username, confluence_password, nlp, domain, projectkey)       
-    
-    doc_retriever_key = ["confluence", "jira", "bitbucket"]
-    
-    ret = []
-    for key in doc_retriever_key:
-        if doc_retriever_key == "bitbucket":
-            ret.append(doc_retriever[doc_retriever_key](bitbucket_username, bitbucket_password, nlp, domain, projectkey))
-        else:
-            ret.append(doc_retriever[doc_retriever_key](confluence_username, confluence_password, nlp, domain, projectkey))       
-    
-    return ret
+    ret = [get_source_retriever(key, confluence_username, confluence_password, bitbucket_username, bitbucket_password, nlp, domain, projectkey)
+           for key in get_doc_retriever_keys(doc_retriever_key)]
 
+    return ret if doc_retriever_key == "all" else ret[0]